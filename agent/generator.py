@@ -1,5 +1,4 @@
 import random
-from utils.general import tts_hd
 from pathlib import Path
 import yaml, json, re
 from utils.general import (
@@ -33,7 +32,7 @@ class Generator:
         prompt = "\n\n".join(rela_node.text(enclose=True) for rela_node in rela_nodes)
         sys_prompt = self.prompts_cfg["GapFillingQuestion"]["sys_prompt"]
         few_shots = self.prompts_cfg["GapFillingQuestion"]["few_shots"]
-        response = await self.engine.async_generate(prompt, sys_prompt, few_shots, temperature=temp)
+        response = await self.engine.async_generate(prompt, sys_prompt, few_shots, temperature=temp, use_cache=False, coalesce=False)
         try:
             response = Formatter.catch_json(response)
             content = response["question"]
@@ -48,7 +47,7 @@ class Generator:
         prompt = "\n\n".join(rela_node.text(enclose=True) for rela_node in rela_nodes)
         sys_prompt = self.prompts_cfg["SentenceMakingQuestion"]["sys_prompt"]
         few_shots = self.prompts_cfg["SentenceMakingQuestion"]["few_shots"]
-        response = await self.engine.async_generate(prompt, sys_prompt, few_shots, temperature=temp)
+        response = await self.engine.async_generate(prompt, sys_prompt, few_shots, temperature=temp, use_cache=False, coalesce=False)
         try:
             response = Formatter.catch_json(response)
             scenario = response["scenario"] + "\n\n\n\n" + response["role"]
@@ -65,17 +64,13 @@ class Generator:
         prompt = "\n\n".join(rela_node.text(enclose=True) for rela_node in rela_nodes)
         sys_prompt = self.prompts_cfg["ListeningQuestion"]["sys_prompt"]
         few_shots = self.prompts_cfg["ListeningQuestion"]["few_shots"]
-        response = await self.engine.async_generate(prompt, sys_prompt, few_shots, temperature=temp)
+        response = await self.engine.async_generate(prompt, sys_prompt, few_shots, temperature=temp, use_cache=False, coalesce=False)
         try:
             response = Formatter.catch_json(response)
             sentence = response["sentence"]
             voice = random.choice(['alloy', 'echo', 'fable', 'onyx', 'nova', 'shimmer'])
-            question = ListeningQuestion(content="", solution=sentence, rela_nodes=rela_nodes, voice=voice)
-            try:
-                await tts_hd.async_generate(text=sentence, voice=voice, timeout=60)
-            except Exception as e:
-                pass
-            return question
+            # the audio is synthesized by Quiz.prewarm() once the quiz is saved
+            return ListeningQuestion(content="", solution=sentence, rela_nodes=rela_nodes, voice=voice)
         except Exception as e:
             logger.error("Generator.gen_listening() : an error occurred when attempting to generate a listening question", e)
             return None
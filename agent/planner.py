@@ -1,10 +1,10 @@
-import asyncio, random
+import random
 import os
 import yaml
 from pathlib import Path
 from collections import defaultdict
 from typing import (
-    List, Dict, Tuple
+    List, Dict, Tuple, Iterator
 )
 from agent.generator import (
     Generator
@@ -23,6 +23,7 @@ from utils.general import (
 from utils.questions import (
     Quiz
 )
+from utils.concurrency import background_loop
 from utils.logger import logger
 
 from datetime import datetime
@@ -80,20 +81,34 @@ class Planner:
             "get_current_time": Toolbox.get_current_time,
             "generate_task": generate_task
         }
+        # seconds before a tool call gives up, generating a whole task takes a while
+        self.tool_timeouts = {
+            "get_current_time": 5,
+            "generate_task": 600
+        }
     
-    def chat(self, messages: List[Dict]) -> str:
+    def chat(self, messages: List[Dict], stream: bool = False) -> str | Iterator[Dict]:
         config_path = Path("config") / "prompts" / "planner.yml"
         toolset = (self.tools, self.functions)
         with open(config_path) as f:
             cfg = yaml.safe_load(f)
             sys_prompt = cfg["chat"]["sys_prompt"]
+        if stream:
+            return self.__chat_stream(messages, sys_prompt, toolset)
         try:
-            response = self.engine.chat(messages, sys_prompt=sys_prompt, toolset=toolset)
+            response = self.engine.chat(messages, sys_prompt=sys_prompt, toolset=toolset, tool_timeouts=self.tool_timeouts)
             return response
         except Exception as e:
             logger.error(f"Planner.chat() : one error occurred while attempting to chat with planner.", e)
             return str(e)
     
+    def __chat_stream(self, messages: List[Dict], sys_prompt: str, toolset: Tuple[List, Dict]) -> Iterator[Dict]:
+        try:
+            yield from self.engine.chat(messages, sys_prompt=sys_prompt, toolset=toolset, stream=True, tool_timeouts=self.tool_timeouts)
+        except Exception as e:
+            logger.error(f"Planner.chat() : one error occurred while attempting to chat with planner.", e)
+            yield {"type": "error", "content": str(e)}
+    
     def gen_task(self, node_number: int, profile: Dict[str, int]) -> Tuple[str, Quiz]:
         try:
             quiz = Quiz()
@@ -155,7 +170,7 @@ class Planner:
                     coro_list.append(
                         _addq(q_type, rela_nodes)
                     )
-            asyncio.run(asyncio.wait(coro_list, timeout=None))
+            background_loop.gather(coro_list)
             filepath = quiz.save()
             return filepath, quiz
         except Exception as e:
@@ -166,41 +181,43 @@ class Planner:
         mistakes = Quiz()
         mistakes.description = "This is a collection of mistakes based on a summary of your previous practice."
         f_prompt = ""
-        for q_type, problems in quiz.problemset.items():
-            low = {
-                "GapFillingQuestion": 0,
-                "ListeningQuestion": 0.85,
-                "SentenceMakingQuestion": 0.6
-            }[q_type]
-            for problem in problems:
-                if problem.score <= low:
-                    mistakes.addq(problem)
-                    f_prompt += (
-                        f"type: {q_type}\n"
-                        f"question: {problem.question()}\n"
-                        f"student's answer: {problem.answer}\n"
-                        f"right answer: {problem.solution}\n\n"
-                    )
-                else:
-                    for node in problem.rela_nodes:
-                        if node.label == "unfamiliar_word":
-                            familiarity = node.get_prop("familiarity")
-                            if familiarity is None:
-                                familiarity = 0
-                            familiarity += 10
-                            node.set_prop("familiarity", familiarity)
-                            if familiarity >= 100:
-                                node.set_label("word")
-                            node.update()
-                        elif node.label == "weakness" and node._node._alive:
-                            familiarity = node.get_prop("familarity")
-                            if familiarity is None:
-                                familiarity = 0
-                            familiarity += 50
-                            node.set_prop("familiarity", familiarity)
-                            node.update()
-                            if familiarity >= 100:
-                                node.destroy()
+        # the familiarity changes are written in one transaction at the end
+        with self.retriever.unit_of_work():
+            for q_type, problems in quiz.problemset.items():
+                low = {
+                    "GapFillingQuestion": 0,
+                    "ListeningQuestion": 0.85,
+                    "SentenceMakingQuestion": 0.6
+                }[q_type]
+                for problem in problems:
+                    if problem.score <= low:
+                        mistakes.addq(problem)
+                        f_prompt += (
+                            f"type: {q_type}\n"
+                            f"question: {problem.question()}\n"
+                            f"student's answer: {problem.answer}\n"
+                            f"right answer: {problem.solution}\n\n"
+                        )
+                    else:
+                        for node in problem.rela_nodes:
+                            if node.label == "unfamiliar_word":
+                                familiarity = node.get_prop("familiarity")
+                                if familiarity is None:
+                                    familiarity = 0
+                                familiarity += 10
+                                node.set_prop("familiarity", familiarity)
+                                if familiarity >= 100:
+                                    node.set_label("word")
+                                node.update()
+                            elif node.label == "weakness" and node._node._alive:
+                                familiarity = node.get_prop("familarity")
+                                if familiarity is None:
+                                    familiarity = 0
+                                familiarity += 50
+                                node.set_prop("familiarity", familiarity)
+                                node.update()
+                                if familiarity >= 100:
+                                    node.destroy()
                             
         if mistakes.problemset:    
             mistakes.save(Path("material") / "mistake")
@@ -217,9 +234,10 @@ class Planner:
             sys_prompt=sys_prompt
         )    
         data = Formatter.catch_json(response)
+        weaknesses: List[Tuple[Dict, MemoryNode]] = []
         for w_type in ["grammar", "listening"]:
             w_list = data.get(w_type, [])
-            if len(w_type) == 0:
+            if len(w_list) == 0:
                 continue
             result = self.retriever.match_node({"label": "topic", "abstract": w_type})
             if len(result) > 0:
@@ -229,11 +247,20 @@ class Planner:
             if topic_node is None:
                 continue
             for w in w_list:
-                try:
-                    w_node = self.retriever.remember({"label": "weakness", "abstract": w["abstract"], "content": w["content"], "familiarity": 0}, n_rela=0)
-                    w_node.create_rela(topic_node, label="belong", properties={})
-                except Exception as e:
-                    logger.error(f"Planner.critic_task() : one error occurred while attempting to critic one quiz.", e)
+                if "abstract" not in w or "content" not in w:
+                    logger.error(f"Planner.critic_task() : invalid weakness : {w}")
+                    continue
+                weaknesses.append(
+                    ({"label": "weakness", "abstract": w["abstract"], "content": w["content"], "familiarity": 0}, topic_node)
+                )
+        try:
+            # all the weaknesses and their `belong` edges in a couple of round trips
+            w_nodes = self.retriever.add_nodes([profile for profile, _ in weaknesses])
+            self.retriever.create_relas(
+                [(w_node, topic_node, "belong", {}) for w_node, (_, topic_node) in zip(w_nodes, weaknesses)]
+            )
+        except Exception as e:
+            logger.error(f"Planner.critic_task() : one error occurred while attempting to critic one quiz.", e)
 
         return []
     
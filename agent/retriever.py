@@ -1,30 +1,43 @@
-import os, asyncio
+import os
+import asyncio
 import yaml
 from pathlib import Path
 from shortuuid import uuid
 from typing import (
-    Dict, List, Tuple, Literal, Any
+    Dict, List, Tuple, Literal, Iterator, Any
 )
 from chromadb import PersistentClient, Collection
 from utils.neo4j_orm import (
-    Graph, Node, Relationship
+    Graph, Node, NodeRow, Relationship
+)
+from utils.neo4j_async import (
+    AsyncGraph, AsyncNode, AsyncRelationship
 )
 from utils.general import (
     LLMEngine
 )
+from utils.concurrency import background_loop
 from utils.logger import logger
 from utils.string import Formatter
 
 class MemoryNode:
+    """ From coroutines, use the async_* methods: they write through the AsyncGraph whichever graph the node was read from.
+    A node that came from an async_* method of MemoryManager can only be written with them,
+    its plain update / create_rela / destroy raise TypeError.
+    """
+    __slots__ = ("_node", "_collection", "_async_graph")
+
     def __init__(self,
                  node: Node,
-                 collection: Collection
+                 collection: Collection,
+                 async_graph: AsyncGraph | None = None
                  ):
         for key in ["abstract", "content"]:
             if key not in node._properties:
                 raise RuntimeError(f"MemoryNode.__init__() : {key} not found in the node : {node}")
         self._node: Node = node
         self._collection: Collection = collection
+        self._async_graph: AsyncGraph | None = async_graph
     
     @property
     def label(self):
@@ -45,13 +58,32 @@ class MemoryNode:
     def set_label(self, label: str):
         self._node.set_label(label)
     
+    def __ensure_sync(self, method: str):
+        if isinstance(self._node, AsyncNode):
+            raise TypeError(f"MemoryNode.{method}() : the node was read through the AsyncGraph, use `await MemoryNode.async_{method}()`")
+
     def update(self):
+        self.__ensure_sync("update")
         self._node.update()
     
     def create_rela(self, to: 'MemoryNode', label: str, properties: Dict[str, str | int | float]) -> Relationship:
+        self.__ensure_sync("create_rela")
         return self._node.create_rela(to._node, label, properties)
     
     def destroy(self) -> bool:
+        """ Inside a unit of work, the node leaves the vector DB only once the unit is written
+        (and stays if the unit is rolled back), True then means the deletion is scheduled
+        """
+        self.__ensure_sync("destroy")
+        unit = self._node._unit()
+        if unit is not None:
+            try:
+                self._node._destroy()
+            except Exception as e:
+                logger.error(f"MemoryNode.destroy() : an error occurred while attempting to delete the node in the graph DB: {self._node}", e)
+                return False
+            unit.after_flush(self.__delete_vector)
+            return True
         m_id = self._node.m_id
         abstract = self._node._properties["abstract"]
         try:
@@ -69,6 +101,50 @@ class MemoryNode:
             logger.info(f"MemoryNode.destroy() : rollback... successully added the node back to vector DB: {self._node}")
             return False
     
+    def __delete_vector(self):
+        try:
+            self._collection.delete([self._node.m_id])
+            logger.info(f"MemoryNode.destroy() : a node was successfully deleted in memory : {self._node}")
+        except Exception as e:
+            logger.error(f"MemoryNode.destroy() : the node was deleted in the graph DB but not in the vector DB: {self._node}", e)
+
+    async def async_update(self):
+        node = self._node
+        if not node._alive:
+            raise RuntimeError("This node was already removed from graph")
+        await self._async_graph._update_node(
+            m_id=node.m_id,
+            new_label=node.label,
+            new_properties=node._new_properties,
+            removed_properties=node._removed_properties
+        )
+        node._new_properties = {}
+        node._removed_properties = []
+
+    async def async_create_rela(self, to: 'MemoryNode', label: str, properties: Dict[str, str | int | float]) -> AsyncRelationship:
+        if not self._node._alive or not to._node._alive:
+            raise RuntimeError("This node was already removed from graph")
+        return await self._async_graph._create_rela((self._node.m_id, to._node.m_id), label, properties)
+
+    async def async_destroy(self) -> bool:
+        m_id = self._node.m_id
+        abstract = self._node._properties["abstract"]
+        try:
+            await asyncio.to_thread(self._collection.delete, [m_id])
+        except Exception as e:
+            logger.error(f"MemoryNode.async_destroy() : an error occurred while attempting to delete the node in the vector DB: {self._node}", e)
+            return False
+        try:
+            await self._async_graph._delete_node(m_id)
+            self._node._alive = False
+            logger.info(f"MemoryNode.async_destroy() : a node was successfully deleted in memory : {self._node}")
+            return True
+        except Exception as e:
+            logger.error(f"MemoryNode.async_destroy() : an error occurred while attempting to delete the node in the graph DB: {self._node}", e)
+            await asyncio.to_thread(self._collection.add, [m_id], documents=[abstract])
+            logger.info(f"MemoryNode.async_destroy() : rollback... successully added the node back to vector DB: {self._node}")
+            return False
+
     def dic(self) -> Dict[str, Any]:
         return self._node._properties
     
@@ -94,6 +170,11 @@ class MemoryManager:
             uri=uri,
             auth=(username, password)
         )
+        # for coroutines on utils.concurrency.background_loop, the async driver is bound to that loop
+        self.__async_graph = AsyncGraph(
+            uri=uri,
+            auth=(username, password)
+        )
         
         chroma_client = PersistentClient()
         self.__collection = chroma_client.get_or_create_collection("vector_db")
@@ -119,7 +200,7 @@ class MemoryManager:
         try:
             node = self.__graph.create_node(label, node_profile)
             logger.info(f"MemoryManager.add_node() : successfully added the node : {node}")
-            memory_node = MemoryNode(node, self.__collection)
+            memory_node = MemoryNode(node, self.__collection, self.__async_graph)
             return memory_node
         except Exception as e:
             # Rollback
@@ -128,6 +209,52 @@ class MemoryManager:
             logger.info(f"MemoryManager.add_node() : rollback... successfully deleted node(mid = {m_id}) in vector DB.")
             return None
     
+    def add_nodes(self, node_profiles: List[Dict[str, str | int | float]], batch_size: int | None = None) -> List[MemoryNode]:
+        """ Bulk version of `add_node`: one vector DB call and a few UNWIND batches in the graph DB.
+        Returns the nodes in the order of `node_profiles`, or [] if nothing could be added.
+        """
+        for node_profile in node_profiles:
+            for key in [
+                "label",
+                "abstract",
+                "content"
+            ]:
+                if key not in node_profile:
+                    logger.error(f"MemoryManager.add_nodes() : `{key}` not found in node profile : {node_profile}")
+                    return []
+        if len(node_profiles) == 0:
+            return []
+        nodes = []
+        for node_profile in node_profiles:
+            node_profile["m_id"] = uuid()
+            nodes.append((node_profile.pop("label"), node_profile))
+        m_ids = [node_profile["m_id"] for _, node_profile in nodes]
+        try:
+            self.__collection.add(m_ids, documents=[node_profile["abstract"] for _, node_profile in nodes])
+        except Exception as e:
+            logger.error(f"MemoryManager.add_nodes() : an error occurred while attempting to add {len(nodes)} nodes in the vector DB", e)
+            return []
+        try:
+            node_list = self.__graph.create_nodes(nodes, batch_size)
+            logger.info(f"MemoryManager.add_nodes() : successfully added {len(node_list)} nodes")
+            return [MemoryNode(node, self.__collection, self.__async_graph) for node in node_list]
+        except Exception as e:
+            # Rollback
+            logger.error(f"MemoryManager.add_nodes() : an error occurred while attempting to add {len(nodes)} nodes in the graph DB", e)
+            self.__collection.delete(m_ids)
+            logger.info(f"MemoryManager.add_nodes() : rollback... successfully deleted {len(m_ids)} nodes in vector DB.")
+            return []
+
+    def create_relas(self,
+                     relas: List[Tuple[MemoryNode, MemoryNode, str, Dict[str, str | int | float]]],
+                     batch_size: int | None = None
+                     ) -> List[Relationship]:
+        """ Bulk version of `MemoryNode.create_rela`, `relas` is a list of (from, to, label, properties) """
+        return self.__graph.create_relas(
+            [((fr._node.m_id, to._node.m_id), label, properties) for fr, to, label, properties in relas],
+            batch_size
+        )
+
     def match_node(self,
                    node_profile: Dict[str, str | int | float] = {},
                    order: Tuple[str, Literal["ASC", "DESC"]] | None = None,
@@ -138,10 +265,44 @@ class MemoryManager:
         label = node_profile.pop("label", None)
         
         node_list = self.__graph.match_node(m_id, label, node_profile, order, skip, limit)
-        memory_node_list = [MemoryNode(node, self.__collection) for node in node_list]
+        memory_node_list = [MemoryNode(node, self.__collection, self.__async_graph) for node in node_list]
         
         return memory_node_list
     
+    def page_nodes(self,
+                   node_profile: Dict[str, str | int | float] = {},
+                   order: Tuple[str, Literal["ASC", "DESC"]] | None = None,
+                   cursor: str | None = None,
+                   limit: int | None = None
+                   ) -> Tuple[List[MemoryNode], str | None]:
+        """ See Graph.page_nodes, `cursor` and the returned next cursor are opaque tokens """
+        node_profile = dict(node_profile)
+        label = node_profile.pop("label", None)
+        node_list, next_cursor = self.__graph.page_nodes(label, node_profile, order, Graph.decode_cursor(cursor), limit)
+        return [MemoryNode(node, self.__collection, self.__async_graph) for node in node_list], Graph.encode_cursor(next_cursor)
+
+    def page_rows(self,
+                  node_profile: Dict[str, str | int | float] = {},
+                  order: Tuple[str, Literal["ASC", "DESC"]] | None = None,
+                  cursor: str | None = None,
+                  limit: int | None = None
+                  ) -> Tuple[List[NodeRow], str | None]:
+        """ page_nodes for reading only, see Graph.page_rows """
+        node_profile = dict(node_profile)
+        label = node_profile.pop("label", None)
+        rows, next_cursor = self.__graph.page_rows(label, node_profile, order, Graph.decode_cursor(cursor), limit)
+        return rows, Graph.encode_cursor(next_cursor)
+
+    def iter_nodes(self,
+                   node_profile: Dict[str, str | int | float] = {},
+                   order: Tuple[str, Literal["ASC", "DESC"]] | None = None,
+                   fetch_size: int | None = None
+                   ) -> Iterator[MemoryNode]:
+        node_profile = dict(node_profile)
+        label = node_profile.pop("label", None)
+        for node in self.__graph.iter_nodes(label, node_profile, order, fetch_size):
+            yield MemoryNode(node, self.__collection, self.__async_graph)
+
     def match(self,
               from_prop: Dict[str, str | int | float],
               to_prop: Dict[str, str | int | float],
@@ -151,10 +312,106 @@ class MemoryManager:
 
         results = self.__graph.match(from_prop, to_prop, rela_prop, bidirect)
         memory_results = [
-            (MemoryNode(p, self.__collection), r, MemoryNode(q, self.__collection)) for p, r, q in results
+            (MemoryNode(p, self.__collection, self.__async_graph), r, MemoryNode(q, self.__collection, self.__async_graph)) for p, r, q in results
         ]
         return memory_results
 
+    async def async_add_node(self, node_profile: Dict[str, str | int | float]) -> MemoryNode:
+        """ `add_node` on the async driver, the node is an AsyncNode """
+        for key in [
+            "label",
+            "abstract",
+            "content"
+        ]:
+            if key not in node_profile:
+                logger.error(f"MemoryManager.async_add_node() : `{key}` not found in node profile")
+                return None
+        m_id = uuid()
+        node_profile["m_id"] = m_id
+        abstract = node_profile["abstract"]
+        label = node_profile.pop("label")
+        try:
+            await asyncio.to_thread(self.__collection.add, [m_id], documents=[abstract])
+        except Exception as e:
+            logger.error(f"MemoryManager.async_add_node() : an error occurred while attempting to add the node in the vector DB : [{label}]\n{node_profile}", e)
+            return None
+        try:
+            node = await self.__async_graph.create_node(label, node_profile)
+            logger.info(f"MemoryManager.async_add_node() : successfully added the node : {node}")
+            return MemoryNode(node, self.__collection, self.__async_graph)
+        except Exception as e:
+            # Rollback
+            logger.error(f"MemoryManager.async_add_node() : an error occurred while attempting to add the node in the graph DB : [{label}]\n{node_profile}", e)
+            await asyncio.to_thread(self.__collection.delete, [m_id])
+            logger.info(f"MemoryManager.async_add_node() : rollback... successfully deleted node(mid = {m_id}) in vector DB.")
+            return None
+
+    async def async_create_relas(self,
+                                 relas: List[Tuple[MemoryNode, MemoryNode, str, Dict[str, str | int | float]]],
+                                 batch_size: int | None = None
+                                 ) -> List[AsyncRelationship]:
+        return await self.__async_graph.create_relas(
+            [((fr._node.m_id, to._node.m_id), label, properties) for fr, to, label, properties in relas],
+            batch_size
+        )
+
+    async def async_match_node(self,
+                               node_profile: Dict[str, str | int | float] = {},
+                               order: Tuple[str, Literal["ASC", "DESC"]] | None = None,
+                               skip: int | None = None,
+                               limit: int | None = None
+                               ) -> List[MemoryNode]:
+        m_id = node_profile.pop("m_id", None)
+        label = node_profile.pop("label", None)
+        node_list = await self.__async_graph.match_node(m_id, label, node_profile, order, skip, limit)
+        return [MemoryNode(node, self.__collection, self.__async_graph) for node in node_list]
+
+    async def async_match(self,
+                          from_prop: Dict[str, str | int | float],
+                          to_prop: Dict[str, str | int | float],
+                          rela_prop: Dict[str, str | int | float],
+                          bidirect: bool = False
+                          ) -> List[Tuple[MemoryNode, AsyncRelationship, MemoryNode]]:
+        results = await self.__async_graph.match(from_prop, to_prop, rela_prop, bidirect)
+        return [
+            (MemoryNode(p, self.__collection, self.__async_graph), r, MemoryNode(q, self.__collection, self.__async_graph)) for p, r, q in results
+        ]
+
+    async def async_query(self,
+                          query_abstract: str,
+                          n_rela: int
+                          ) -> List[MemoryNode]:
+        try:
+            result = await asyncio.to_thread(self.__collection.query, query_texts=[query_abstract], n_results=n_rela)
+            memory_node_list = []
+            for m_id in result["ids"][0]:
+                memory_node = (await self.async_match_node({"m_id": m_id}))[0]
+                memory_node_list.append(memory_node)
+            return memory_node_list
+        except Exception as e:
+            logger.error(f"MemoryManager.async_query() : an error occurred while attempting to query similar nodes with query abstract: '{query_abstract}', n_rela = {n_rela}", e)
+            return []
+
+    def match_subgraph(self,
+                       m_ids: List[str],
+                       expand: Tuple[str, ...] | None = (),
+                       to_label: str | None = None,
+                       bidirect: bool = True
+                       ) -> Dict[str, Tuple[MemoryNode, List[Tuple[Relationship, MemoryNode]]]]:
+        """ See Graph.match_subgraph """
+        subgraph = self.__graph.match_subgraph(m_ids, expand, to_label, bidirect)
+        return {
+            m_id: (
+                MemoryNode(node, self.__collection, self.__async_graph),
+                [(r, MemoryNode(q, self.__collection, self.__async_graph)) for r, q in neighbours]
+            )
+            for m_id, (node, neighbours) in subgraph.items()
+        }
+
+    def unit_of_work(self):
+        """ See Graph.unit_of_work """
+        return self.__graph.unit_of_work()
+
     def query(self,
               query_abstract: str,
               n_rela: int
@@ -172,6 +429,7 @@ class MemoryManager:
     
     def close(self):
         self.__graph.close()
+        background_loop.run(self.__async_graph.close())
 
 class Retriever:
     def __init__(self, engine: LLMEngine):
@@ -226,6 +484,29 @@ class Retriever:
                    ) -> List[MemoryNode]:
         return self.memory.match_node(node_profile, order, skip, limit)
     
+    def page_nodes(self,
+                   node_profile: Dict[str, str | int | float] = {},
+                   order: Tuple[str, Literal["ASC", "DESC"]] | None = None,
+                   cursor: str | None = None,
+                   limit: int | None = None
+                   ) -> Tuple[List[MemoryNode], str | None]:
+        return self.memory.page_nodes(node_profile, order, cursor, limit)
+
+    def page_rows(self,
+                  node_profile: Dict[str, str | int | float] = {},
+                  order: Tuple[str, Literal["ASC", "DESC"]] | None = None,
+                  cursor: str | None = None,
+                  limit: int | None = None
+                  ) -> Tuple[List[NodeRow], str | None]:
+        return self.memory.page_rows(node_profile, order, cursor, limit)
+
+    def iter_nodes(self,
+                   node_profile: Dict[str, str | int | float] = {},
+                   order: Tuple[str, Literal["ASC", "DESC"]] | None = None,
+                   fetch_size: int | None = None
+                   ) -> Iterator[MemoryNode]:
+        return self.memory.iter_nodes(node_profile, order, fetch_size)
+
     def match(self,
               from_prop: Dict[str, str | int | float],
               to_prop: Dict[str, str | int | float],
@@ -233,13 +514,31 @@ class Retriever:
               bidirect: bool = False
               ) -> List[Tuple[MemoryNode, Relationship, MemoryNode]]:
         return self.memory.match(from_prop, to_prop, rela_prop, bidirect)
+
+    def match_subgraph(self,
+                       m_ids: List[str],
+                       expand: Tuple[str, ...] | None = (),
+                       to_label: str | None = None,
+                       bidirect: bool = True
+                       ) -> Dict[str, Tuple[MemoryNode, List[Tuple[Relationship, MemoryNode]]]]:
+        return self.memory.match_subgraph(m_ids, expand, to_label, bidirect)
+
+    def unit_of_work(self):
+        return self.memory.unit_of_work()
+
+    def add_nodes(self, node_profiles: List[Dict[str, str | int | float]]) -> List[MemoryNode]:
+        """ Remembers many nodes at once, without generating relationships (like `remember` with n_rela = 0) """
+        return self.memory.add_nodes(node_profiles)
+
+    def create_relas(self, relas: List[Tuple[MemoryNode, MemoryNode, str, Dict[str, str | int | float]]]) -> List[Relationship]:
+        return self.memory.create_relas(relas)
         
     def remember(self, node_profile: Dict[str, str | int | float], n_rela: int = 5) -> MemoryNode:
         async def gen_rela(fr: MemoryNode, to: MemoryNode):
             rela = await self.__gen_rela(fr, to)
             if rela is not None and "label" in rela:
                 label = rela.pop("label")
-                fr.create_rela(to, label, rela)
+                await fr.async_create_rela(to, label, rela)
         try:
             sim_nodes = self.memory.query(node_profile["abstract"], n_rela) if n_rela > 0 else []
             if len(sim_nodes) > 0 and sim_nodes[0].label == node_profile["label"] and sim_nodes[0].get_prop("abstract") == node_profile["abstract"]:
@@ -251,8 +550,7 @@ class Retriever:
                 if sim_node.label == "image":
                     continue
                 coro_list.append(gen_rela(node, sim_node))
-            if len(coro_list) > 0:
-                asyncio.run(asyncio.wait(coro_list, timeout=None))
+            background_loop.gather(coro_list)
             return node
         except Exception as e:
             logger.error(f"Retriever.remember() : an error occurred while attempting to remember the the node: {node_profile}", e)
@@ -264,7 +562,6 @@ class Retriever:
     
     @requires_superuser
     def clear_all(self):
-        nodes = self.memory.match_node()
-        for node in nodes:
+        for node in self.memory.iter_nodes():
             if node.destroy():
                 logger.info(f"Retriever.clear_all() : successfully deleted the node : {node}")
\ No newline at end of file
@@ -10,7 +10,7 @@ load_dotenv(find_dotenv())
 
 from blueprints.index import bp as index_bp
 from blueprints.learn import bp as learn_bp
-from blueprints.chat import bp as chat_bp
+from blueprints.chat import bp as chat_bp, init_agents
 from blueprints.notebook import bp as notebook_bp
 from blueprints.setting import bp as setting_bp
 
@@ -20,5 +20,7 @@ app.register_blueprint(chat_bp)
 app.register_blueprint(notebook_bp)
 app.register_blueprint(setting_bp)
 
+init_agents()
+
 if __name__ == "__main__":
     app.run(debug=False, host='0.0.0.0', port=8088)
\ No newline at end of file
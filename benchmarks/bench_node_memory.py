@@ -0,0 +1,105 @@
+""" Bytes per node held by the graph objects of a query result.
+
+    python benchmarks/bench_node_memory.py [--nodes 20000]
+
+"before" is the layout Node had before __slots__: a per-instance __dict__ and both
+change-tracking containers allocated up front. Every variant is built from the same kind
+of vocabulary properties, "overhead" is what comes on top of the property dicts themselves.
+"""
+import sys, os
+sys.path.append(os.path.abspath("."))
+
+import gc
+import argparse
+import tracemalloc
+from shortuuid import uuid
+
+from utils.neo4j_orm import Node, NodeRow, IdentityMap
+
+class DictNode:
+    """ Node as it was laid out before """
+    def __init__(self, graph, m_id, label, properties):
+        self._Node__graph = graph
+        self.m_id = m_id
+        self.label = label
+        self._properties = properties
+        self._alive = True
+        self._new_properties = {}
+        self._removed_properties = []
+
+class DictMemoryNode:
+    def __init__(self, node, collection):
+        self._node = node
+        self._collection = collection
+
+def properties(i: int) -> dict:
+    return {
+        "m_id": uuid(),
+        "abstract": f"word-{i}",
+        "content": f"word-{i} (n.) " + "an example sentence with the word in it. " * 5,
+        "familiarity": i % 100
+    }
+
+def measure(build, n: int) -> int:
+    gc.collect()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    kept = build(n)
+    gc.collect()
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return (end - start) // n
+
+def only_properties(n: int):
+    return [properties(i) for i in range(n)]
+
+def dict_nodes(wrapper):
+    def build(n: int):
+        nodes = IdentityMap(max_size=n)
+        kept = []
+        for i in range(n):
+            p = properties(i)
+            node = nodes.load(p["m_id"], "word", p, lambda: DictNode(None, p["m_id"], "word", p))
+            kept.append(wrapper(node) if wrapper is not None else node)
+        return nodes, kept
+    return build
+
+def slot_nodes(wrapper):
+    def build(n: int):
+        Node.nodes = IdentityMap(max_size=n)
+        kept = []
+        for i in range(n):
+            p = properties(i)
+            node = Node._create(None, p["m_id"], "word", p)
+            kept.append(wrapper(node) if wrapper is not None else node)
+        return Node.nodes, kept
+    return build
+
+def node_rows(n: int):
+    kept = []
+    for i in range(n):
+        p = properties(i)
+        kept.append(NodeRow(p["m_id"], "word", p))
+    return kept
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory held per node by the graph objects")
+    parser.add_argument("--nodes", type=int, default=20000)
+    args = parser.parse_args()
+    try:
+        from agent.retriever import MemoryNode
+        before_wrapper, wrapper, wrapped = lambda node: DictMemoryNode(node, None), lambda node: MemoryNode(node, None), " + MemoryNode"
+    except ImportError:
+        # agent.retriever needs chromadb, compare the nodes alone
+        before_wrapper, wrapper, wrapped = None, None, ""
+    baseline = measure(only_properties, args.nodes)
+    results = [
+        (f"before: Node (__dict__, eager changes){wrapped}", measure(dict_nodes(before_wrapper), args.nodes)),
+        (f"after: Node (__slots__, lazy changes){wrapped}", measure(slot_nodes(wrapper), args.nodes)),
+        ("NodeRow (read-only)", measure(node_rows, args.nodes))
+    ]
+    print(f"{args.nodes} nodes, the properties alone take {baseline} bytes per node\n")
+    print(f"{'':<56}{'bytes/node':>12}{'overhead':>12}")
+    for name, size in results:
+        print(f"{name:<56}{size:>12}{size - baseline:>12}")
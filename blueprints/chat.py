@@ -1,5 +1,5 @@
 import os, random, time
-from flask import Blueprint, render_template, session, request, jsonify, send_file
+from flask import Blueprint, render_template, session, request, jsonify, send_file, Response, stream_with_context
 import requests
 
 bp = Blueprint('chat', __name__, url_prefix='/chat')
@@ -9,17 +9,33 @@ from agent.generator import Generator
 from agent.planner import Planner
 
 from utils.general import (
-    gpt_4o,
-    ds_chat, ds_reasoner,
-    tts, tts_hd, tts_hd_1106
+    registry,
+    AMEngine
 )
+from utils.history import chat_histories
 from pathlib import Path
+from shortuuid import uuid
 
 import json, re
 
-retriever = Retriever(gpt_4o)
-generator = Generator(gpt_4o)
-planner = Planner(gpt_4o, retriever, generator)
+# built by init_agents() at app startup, Retriever bootstraps the graph schema
+retriever: Retriever | None = None
+generator: Generator | None = None
+planner: Planner | None = None
+
+def init_agents():
+    global retriever, generator, planner, dic
+    engine = registry.get("gpt_4o")
+    retriever = Retriever(engine)
+    generator = Generator(engine)
+    planner = Planner(engine, retriever, generator)
+    dic = LLMDictionary(registry.get("gpt_4o_lookup"))
+
+def chat_id() -> str:
+    """ Id of the chat of this session, the history itself stays in `chat_histories` """
+    if "chat_id" not in session:
+        session["chat_id"] = uuid()
+    return session["chat_id"]
 
 @bp.route("/v1", methods=["POST"])
 def chat():
@@ -27,25 +43,60 @@ def chat():
     message = data.get("message")
     if message is None:
         return jsonify({"error": "Message is empty!"}), 400
-    if "chat_history" not in session:
-        session["chat_history"] = []
-    session["chat_history"].append(
+    cid = chat_id()
+    history = chat_histories.get(cid)
+    n_history = len(history)
+    history.append(
         {
             "role": "user",
             "content": message
         }
     )
     try:
-        response = planner.chat(session["chat_history"])
-        session.modified = True
+        response = planner.chat(history)
+        chat_histories.append(cid, history[n_history:])
         
         return jsonify({"reply": response}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@bp.route("/v1/stream", methods=["POST"])
+def chat_stream():
+    """ Server-sent events version of /v1.
+    The turn (the user message, tool calls and the reply) is stored once the `done` event is reached.
+    """
+    data = request.json
+    message = data.get("message")
+    if message is None:
+        return jsonify({"error": "Message is empty!"}), 400
+    cid = chat_id()
+    history = chat_histories.get(cid)
+    n_history = len(history)
+    history.append(
+        {
+            "role": "user",
+            "content": message
+        }
+    )
+
+    def events():
+        for event in planner.chat(history, stream=True):
+            if event["type"] == "done":
+                chat_histories.append(cid, history[n_history:])
+            yield f"data: {json.dumps(event)}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
 @bp.route("/reset", methods=["POST"])
 def reset():
-    session["chat_history"] = []
+    chat_histories.clear(chat_id())
     return jsonify({"system": "chat history was cleared."}), 200
 
 from utils.dictionary import (
@@ -56,26 +107,34 @@ from utils.dictionary import (
 def query():
     data = request.json
     profile = data.get("profile", {})
-    order = tuple(data.get("order"))
+    order = tuple(data["order"]) if data.get("order") else None
     skip = data.get("skip")
     limit = data.get("limit")
     
-    try:    
-        results = retriever.match_node(
+    try:
+        if skip is not None:
+            # offset pagination, kept for old clients
+            results = retriever.match_node(
+                node_profile=profile,
+                order=order,
+                skip=skip,
+                limit=limit
+            )
+            return jsonify([result.dic() for result in results]), 200
+        rows, next_cursor = retriever.page_rows(
             node_profile=profile,
             order=order,
-            skip=skip,
+            cursor=data.get("cursor"),
             limit=limit
         )
-        response = []
-        for result in results:
-            response.append(result.dic())
-        return jsonify(response, 200)
+        return jsonify({"nodes": [row.properties for row in rows], "next_cursor": next_cursor}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
     
-dic = LLMDictionary(gpt_4o)
+dic: LLMDictionary | None = None
 
 @bp.route("/dictionary", methods=["POST"])
 def dictionary():
@@ -134,26 +193,26 @@ def image():
         response.raise_for_status()
         urls = response.json()
 
-        for i, url in enumerate(urls):
-            image_node = retriever.remember(
+        image_nodes = retriever.add_nodes(
+            [
                 {
                     "label": "image",
                     "abstract": f"image-{query}-{i}",
                     "content": url["url"]
-                },
-                n_rela=0
-            )
-            image_node.create_rela(
-                to=node,
-                label="display",
-                properties={}
-            )
+                }
+                for i, url in enumerate(urls)
+            ]
+        )
+        retriever.create_relas(
+            [(image_node, node, "display", {}) for image_node in image_nodes]
+        )
         return jsonify({"urls": urls}), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-from utils.questions import Quiz
+from utils.questions import Quiz, ListeningQuestion
+from utils.cache import AudioCache
 
 # Quiz
 cur_quiz: Quiz = None
@@ -170,8 +229,9 @@ def start():
     filepath = Path("material") / place / f"{name}.json"
     print(filepath)
     cur_quiz = Quiz.load(filepath, retriever)
-    cur_quiz.init_cards()
+    # None when the file or its nodes could not be read
     if isinstance(cur_quiz, Quiz):
+        cur_quiz.init_cards()
         return jsonify({"reply": "Successfully started the quiz!"}), 200
     return jsonify({"error": "Failed starting the quiz."}), 500
 
@@ -200,7 +260,7 @@ def mark():
 
         answer = data.get("answer", "")
         question = cur_quiz.problemset[q_type][idx]
-        score, analysis, _ = question.mark(answer, gpt_4o)
+        score, analysis, _ = question.mark(answer, registry.get("gpt_4o"))
         reply = {
             "score": score,
             "solution": question.solution,
@@ -212,15 +272,33 @@ def mark():
 
 @bp.route("/quiz/play", methods=["GET", "POST"])
 def play():
-    data = request.json
+    # GET with query parameters lets an <audio> element stream the clip directly
+    data = request.get_json(silent=True) or request.args
     content, t, voice = data.get("content"), data.get("t"), data.get("voice")
     # print(f"voice: {voice}")
     if not voice:
         voice = random.choice(['alloy', 'echo', 'fable', 'onyx', 'nova', 'shimmer'])
-    name = tts.generate(content, voice)
-    audio_path = tts_hd.cache_path / f"{name}.mp3"
-    
-    return send_file(audio_path), 200
+    response_format = data.get("format", ListeningQuestion.audio_format)
+    if response_format not in AudioCache.formats:
+        return jsonify({"error": f"unsupported audio format: {response_format}"}), 400
+    # same engine as Quiz.prewarm(), which synthesizes the formats asked for here, so the clip is normally already cached
+    ListeningQuestion.requested(response_format)
+    name, chunks = registry.get(ListeningQuestion.tts).stream(content, voice, response_format=response_format)
+    mimetype = AudioCache.mimetype(name)
+    if chunks is not None:
+        return Response(stream_with_context(chunks), mimetype=mimetype)
+    # a clip never changes once cached: content-hash ETag, long-lived Cache-Control,
+    # and send_file answers Range requests and If-None-Match with 206 / 304
+    response = send_file(
+        AMEngine.audio_cache.path(name),
+        mimetype=mimetype,
+        conditional=True,
+        etag=AMEngine.audio_cache.etag(name) or True,
+        max_age=365 * 24 * 3600
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 @bp.route("quiz/quit", methods=["GET", "POST"])
 def quit():
@@ -238,10 +316,38 @@ def end():
     
     return jsonify({"reply": "The current quiz was completed!"}), 200
 
+from utils.metrics import telemetry
+from utils.limiter import limiters
+from utils.neo4j_orm import Node
+
+@bp.route("/metrics", methods=["GET"])
+def metrics():
+    data = telemetry.export(recent=request.args.get("recent") == "1")
+    data["limiters"] = {name: limiter.stats() for name, limiter in limiters.items()}
+    cache = registry.cache
+    if cache is not None:
+        data["response_cache"] = cache.stats()
+    data["audio_cache"] = AMEngine.audio_cache.stats()
+    data["identity_map"] = Node.nodes.stats()
+
+    return jsonify(data), 200
+
 @bp.route("/clear_cache", methods=["GET", "POST"])
 def clear_cache():
-    # TODO
-    pass
+    data = request.get_json(silent=True) or {}
+    target = data.get("target", request.args.get("target", "all"))
+    if target not in ["all", "audio", "llm"]:
+        return jsonify({"error": f"unknown cache: {target}"}), 400
+    freed, stats = {}, {}
+    if target in ["all", "audio"]:
+        freed["audio_cache"] = AMEngine.audio_cache.clear()
+        stats["audio_cache"] = AMEngine.audio_cache.stats()
+    cache = registry.cache
+    if target in ["all", "llm"] and cache is not None:
+        freed["response_cache"] = cache.clear()
+        stats["response_cache"] = cache.stats()
+
+    return jsonify({"reply": "the cache was cleared!", "freed": freed, "stats": stats}), 200
 
 import yaml
 
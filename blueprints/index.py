@@ -1,11 +1,12 @@
 import re
 from flask import Blueprint, render_template, session, request
+from utils.history import chat_histories
 
 bp = Blueprint('index', __name__, url_prefix='/')
 
 @bp.route("/", methods=["GET", "POST"])
 def index():
-    chat_history = session.get("chat_history", [])
+    chat_history = chat_histories.get(session["chat_id"]) if "chat_id" in session else []
     
     return render_template(
         "index/index.html", chat_history=chat_history
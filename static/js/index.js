@@ -27,8 +27,12 @@ document.addEventListener("DOMContentLoaded", () => {
     }
     renderChatHistory(chatHistory);
 
+    function renderLinks(text) {
+        return text.replace(/\[([^\]]+)\]\(([^)]+)\)/g, '<a href="$2" target="_blank">$1</a>');
+    }
+
     function appendMessage(role, text) {
-        text = text.replace(/\[([^\]]+)\]\(([^)]+)\)/g, '<a href="$2" target="_blank">$1</a>');
+        text = renderLinks(text);
         const messageDiv = document.createElement("div");
         messageDiv.classList.add("message", role);
     
@@ -39,6 +43,7 @@ document.addEventListener("DOMContentLoaded", () => {
     
         messagesDiv.appendChild(messageDiv);
         messagesDiv.scrollTop = messagesDiv.scrollHeight;
+        return div;
     }
 
     async function sendMessage() {
@@ -53,19 +58,50 @@ document.addEventListener("DOMContentLoaded", () => {
         sendButton.appendChild(loading_icon_s);
 
         try {
-            const response = await fetch("/chat/v1", {
+            const response = await fetch("/chat/v1/stream", {
                 method: "POST",
                 headers: {
                     "Content-Type": "application/json",
                 },
                 body: JSON.stringify({ message }),
             });
-            
-            const data = await response.json();
-            if (data.reply) {
-                appendMessage("assistant", data.reply);
-            } else {
-                appendMessage("assistant", "Error: " + (data.error || "Unknown error"));
+            if (!response.ok) {
+                const data = await response.json();
+                throw new Error(data.error || "Unknown error");
+            }
+
+            const ctx = appendMessage("assistant", "");
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = "";
+            let reply = "";
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const events = buffer.split("\n\n");
+                buffer = events.pop();
+                for (const raw of events) {
+                    if (!raw.startsWith("data: ")) continue;
+                    const event = JSON.parse(raw.slice(6));
+                    if (event.type === "delta") {
+                        reply += event.content;
+                        ctx.textContent = reply;
+                    }
+                    else if (event.type === "tool_call") {
+                        ctx.appendChild(loading_icon);
+                    }
+                    else if (event.type === "tool_result") {
+                        if (ctx.contains(loading_icon)) ctx.removeChild(loading_icon);
+                    }
+                    else if (event.type === "done") {
+                        ctx.innerHTML = renderLinks(event.content);
+                    }
+                    else if (event.type === "error") {
+                        ctx.textContent = "Error: " + event.content;
+                    }
+                    messagesDiv.scrollTop = messagesDiv.scrollHeight;
+                }
             }
         } catch (error) {
             appendMessage("assistant", "Error: " + error.message);
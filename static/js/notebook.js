@@ -7,6 +7,8 @@ document.addEventListener("DOMContentLoaded", () => {
     const pageLine = 12;
 
     var pageIndex = 0;
+    // cursors[i] is where page i starts, null for the first page
+    var cursors = [null];
 
     async function render() {
         try {
@@ -21,17 +23,14 @@ document.addEventListener("DOMContentLoaded", () => {
                             label: "unfamiliar_word"
                         },
                         order: ["familiarity", "DESC"],
-                        skip: pageLine * pageIndex,
+                        cursor: cursors[pageIndex],
                         limit: pageLine
                     }
                 )
             });
-            data = (await response.json())[0];
-            if (data.length === 0) {
-                pageIndex -= 1;
-                nextButton.disabled = true;
-                return;
-            }
+            const page = await response.json();
+            data = page.nodes;
+            cursors[pageIndex + 1] = page.next_cursor;
             while (wordList.firstChild) {
                 wordList.removeChild(wordList.firstChild);
             }
@@ -52,7 +51,7 @@ document.addEventListener("DOMContentLoaded", () => {
     
                 wordList.appendChild(div);
             }
-            nextButton.disabled = false;
+            nextButton.disabled = page.next_cursor === null;
             if (pageIndex === 0) {
                 preButton.disabled = true;
             }
@@ -65,11 +64,17 @@ document.addEventListener("DOMContentLoaded", () => {
     render();
 
     async function next_page() {
+        if (!cursors[pageIndex + 1]) {
+            return;
+        }
         pageIndex += 1;
         render();
     }
 
     async function pre_page() {
+        if (pageIndex === 0) {
+            return;
+        }
         pageIndex -= 1;
         render();
     }
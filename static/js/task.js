@@ -25,6 +25,17 @@ document.addEventListener("DOMContentLoaded", () => {
     const finishButton = document.getElementById("finish");
     const player = document.getElementById("player")
 
+    // opus is what the server pre-warms, fall back for browsers that can't play it
+    function audioFormat() {
+        if (player.canPlayType('audio/ogg; codecs="opus"')) {
+            return "opus";
+        }
+        if (player.canPlayType("audio/aac")) {
+            return "aac";
+        }
+        return "mp3";
+    }
+
     const STATE = {
         START: 'start',
         CONFIRM: 'confirm',
@@ -96,19 +107,13 @@ document.addEventListener("DOMContentLoaded", () => {
                     finishButton.textContent = "";
                     finishButton.appendChild(loading_icon);
                     try {
-                        const response = await fetch("/chat/quiz/play", {
-                            method: "POST",
-                            headers: {
-                                "Content-Type": "application/json",
-                            },
-                            body: JSON.stringify({content: content, t: 2, voice: voice})
-                        });
-                        if (response.ok) {
-                            const audioBlob = await response.blob();
-                            const audioUrl = URL.createObjectURL(audioBlob);
-                            player.src = audioUrl;
-                            player.play();
+                        // the audio element starts playing while the clip is still being synthesized
+                        const params = new URLSearchParams({content: content, t: 2, format: audioFormat()});
+                        if (voice) {
+                            params.set("voice", voice);
                         }
+                        player.src = `/chat/quiz/play?${params}`;
+                        await player.play();
                     } catch (error) {
                         console.log(error)
                     }
@@ -0,0 +1,82 @@
+import sys, os
+sys.path.append(os.path.abspath("."))
+
+import json
+import pytest
+from flask import Flask
+
+from agent.planner import Planner
+from utils.replay import Cassette, ReplayEngine
+from utils.history import ChatHistories
+import blueprints.chat as chat
+
+class ToolEngine:
+    """ Answers every chat by calling get_current_time once """
+    model = "gpt-4o"
+
+    def chat(self, messages, sys_prompt="", toolset=([], {}), *args, **kwargs):
+        _, functions = toolset
+        tool_call = {"id": "call_0", "type": "function", "function": {"name": "get_current_time", "arguments": "{}"}}
+        messages.append({"role": "assistant", "content": "", "tool_calls": [tool_call]})
+        messages.append({"role": "tool", "tool_call_id": "call_0", "content": functions["get_current_time"]()})
+        reply = f"It is {messages[-1]['content']}."
+        messages.append({"role": "assistant", "content": reply})
+        return reply
+
+@pytest.fixture
+def planner(tmp_path):
+    cassette = Cassette(tmp_path / "cassette.json")
+    recorder = Planner(ReplayEngine("gpt-4o", cassette, ToolEngine(), mode="record"), None, None)
+    recorder.chat([{"role": "user", "content": "what time is it?"}])
+    return Planner(ReplayEngine("gpt-4o", Cassette(cassette.path)), None, None)
+
+@pytest.fixture
+def client(planner, monkeypatch):
+    monkeypatch.setattr(chat, "planner", planner)
+    monkeypatch.setattr(chat, "chat_histories", ChatHistories())
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.register_blueprint(chat.bp)
+    return app.test_client()
+
+def events_of(response):
+    return [json.loads(raw.removeprefix("data: ")) for raw in response.get_data(as_text=True).split("\n\n") if raw]
+
+def test_import_builds_no_agents():
+    # the agents (and the schema bootstrap of Retriever) wait for init_agents() at app startup
+    assert chat.retriever is None and chat.dic is None
+
+def test_planner_stream(planner):
+    messages = [{"role": "user", "content": "what time is it?"}]
+    events = list(planner.chat(messages, stream=True))
+    assert [event["type"] for event in events] == ["tool_call", "tool_result", "delta", "done"]
+    assert events[0]["name"] == "get_current_time"
+    assert events[1]["id"] == "call_0"
+    assert events[-1]["content"] == messages[-1]["content"]
+    assert [message["role"] for message in messages] == ["user", "assistant", "tool", "assistant"]
+
+def test_stream_keeps_history(client):
+    response = client.post("/chat/v1/stream", json={"message": "what time is it?"})
+    assert response.mimetype == "text/event-stream"
+    events = events_of(response)
+    assert [event["type"] for event in events] == ["tool_call", "tool_result", "delta", "done"]
+    with client.session_transaction() as session:
+        history = chat.chat_histories.get(session["chat_id"])
+    assert [message["role"] for message in history] == ["user", "assistant", "tool", "assistant"]
+    assert history[-1]["content"] == events[-1]["content"]
+
+    # the next turn is not recorded, a failed turn leaves the history as it was
+    events = events_of(client.post("/chat/v1/stream", json={"message": "and now?"}))
+    assert [event["type"] for event in events] == ["error"]
+    assert chat.chat_histories.get(session["chat_id"]) == history
+
+    assert client.post("/chat/v1/commit", json={"messages": []}).status_code == 404
+    client.post("/chat/reset")
+    assert chat.chat_histories.get(session["chat_id"]) == []
+
+def test_quiz_that_fails_to_load(client, monkeypatch):
+    monkeypatch.setattr(chat, "cur_quiz", None)
+    response = client.post("/chat/quiz/start", json={"name": "missing", "type": "task"})
+    assert response.status_code == 500
+    assert response.json == {"error": "Failed starting the quiz."}
+    assert chat.cur_quiz is None
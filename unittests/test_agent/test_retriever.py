@@ -3,7 +3,10 @@ sys.path.append(os.path.abspath("."))
 
 import pytest
 
-from agent.retriever import MemoryNode, Retriever
+from agent.retriever import MemoryNode, MemoryManager, Retriever
+from shortuuid import uuid
+from utils.neo4j_orm import Graph, Node
+from utils.neo4j_async import AsyncNode
 from utils.general import (
     gpt_4o
 )
@@ -35,4 +38,95 @@ def test_dup_node(retriever):
 @pytest.mark.parametrize("skip", [0, 10, 20, 30, 40])
 def test_match_node(retriever, skip):
     nodes = retriever.match_node({"label": "unfamiliar_word"}, order=("familiarity", "ASC"), skip=skip, limit=10)
-    assert len(nodes) == 10
\ No newline at end of file
+    assert len(nodes) == 10
+
+
+class FakeCollection:
+    def __init__(self):
+        self.ids = set()
+
+    def add(self, ids, documents):
+        self.ids.update(ids)
+
+    def delete(self, ids):
+        self.ids.difference_update(ids)
+
+class FakeTransaction:
+    def __init__(self, fail_on=None):
+        self.queries = []
+        self.fail_on = fail_on
+
+    def run(self, query, parameters=None):
+        self.queries.append((query, parameters))
+        if len(self.queries) == self.fail_on:
+            raise RuntimeError(f"statement {self.fail_on} failed")
+        return self
+
+    def consume(self):
+        pass
+
+class FakeDriver:
+    """ Statements are only committed when the whole transaction went through """
+    def __init__(self, fail_on=None):
+        self.committed = []
+        self.fail_on = fail_on
+
+    def session(self, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute_write(self, work):
+        tx = FakeTransaction(self.fail_on)
+        result = work(tx)
+        self.committed.extend(tx.queries)
+        return result
+
+def fake_graph(driver: FakeDriver) -> Graph:
+    graph = Graph("neo4j://127.0.0.1:7687", ("neo4j", "neo4j"), bootstrap=False)
+    graph._Graph__driver = driver
+    return graph
+
+def test_add_nodes_is_atomic():
+    # the second UNWIND batch fails
+    graph = fake_graph(FakeDriver(fail_on=2))
+    memory = MemoryManager.__new__(MemoryManager)
+    memory._MemoryManager__graph = graph
+    memory._MemoryManager__collection = FakeCollection()
+    memory._MemoryManager__async_graph = None
+    profiles = [{"label": "word", "abstract": f"word-{i}", "content": ""} for i in range(3)]
+    assert memory.add_nodes(profiles, batch_size=2) == []
+    # neither the first batch in the graph nor the vectors are left behind
+    assert graph._Graph__driver.committed == []
+    assert memory._MemoryManager__collection.ids == set()
+
+def test_destroy_in_unit_of_work():
+    graph = fake_graph(FakeDriver())
+    collection = FakeCollection()
+    m_id = uuid()
+    collection.add([m_id], documents=["apple"])
+    node = MemoryNode(Node._create(graph, m_id, "word", {"m_id": m_id, "abstract": "apple", "content": ""}), collection)
+    with pytest.raises(RuntimeError):
+        with graph.unit_of_work():
+            assert node.destroy()
+            raise RuntimeError("quiz interrupted")
+    # rolled back: still in both stores
+    assert node._node._alive
+    assert graph._Graph__driver.committed == []
+    assert collection.ids == {m_id}
+    with graph.unit_of_work():
+        assert node.destroy()
+        assert collection.ids == {m_id}
+    assert [query for query, _ in graph._Graph__driver.committed] == [Graph.DELETE_NODES]
+    assert collection.ids == set()
+
+def test_sync_writes_of_async_nodes():
+    node = MemoryNode(AsyncNode._create(None, "a", "word", {"m_id": "a", "abstract": "apple", "content": ""}), FakeCollection())
+    for write in [node.update, node.destroy, lambda: node.create_rela(node, "relative", {})]:
+        with pytest.raises(TypeError, match="async_"):
+            write()
+    AsyncNode.nodes.clear()
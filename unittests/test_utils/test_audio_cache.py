@@ -0,0 +1,109 @@
+import sys, os
+sys.path.append(os.path.abspath("."))
+
+import asyncio, hashlib, sqlite3, time
+import pytest
+from pathlib import Path
+from types import SimpleNamespace
+
+from utils.cache import AudioCache
+from utils.general import AMEngine
+
+def test_put_get(tmp_path):
+    cache = AudioCache(tmp_path, max_bytes=1024)
+    key = AudioCache.make_key("tts-1", "alloy", "apple")
+    assert cache.get(key) is None
+    path = cache.put_bytes(key, b"mp3" * 10)
+    assert cache.get(key) == path
+    assert path.read_bytes() == b"mp3" * 10
+    assert [p.name for p in tmp_path.iterdir() if p.name.endswith(".tmp")] == []
+    stats = cache.stats()
+    assert stats["entries"] == 1
+    assert stats["bytes"] == 30
+    assert stats["hits"] == 1 and stats["misses"] == 1
+
+def test_formats(tmp_path):
+    cache = AudioCache(tmp_path)
+    mp3 = AudioCache.make_key("tts-1", "alloy", "apple")
+    opus = AudioCache.make_key("tts-1", "alloy", "apple", "opus")
+    assert mp3 != opus
+    assert AudioCache.mimetype(opus) == "audio/ogg"
+    cache.put_bytes(opus, b"OggS")
+    assert cache.etag(opus) == hashlib.sha256(b"OggS").hexdigest()
+    assert cache.etag(mp3) is None
+    with pytest.raises(ValueError):
+        AudioCache.make_key("tts-1", "alloy", "apple", "midi")
+
+def test_failed_write_leaves_nothing(tmp_path):
+    cache = AudioCache(tmp_path)
+    def broken(path):
+        path.write_bytes(b"partial")
+        raise RuntimeError("connection reset")
+    with pytest.raises(RuntimeError):
+        cache.put("audio[x]", broken)
+    assert cache.get("audio[x]") is None
+    assert [p.name for p in tmp_path.iterdir() if p.name != "index.sqlite3"] == []
+
+def test_lru_eviction(tmp_path):
+    cache = AudioCache(tmp_path, max_bytes=250)
+    for word in ["apple", "banana", "cherry"]:
+        cache.put_bytes(word, b"0" * 100)
+    # "apple" was evicted to make room for "cherry"
+    assert cache.get("apple") is None
+    assert not cache.path("apple").exists()
+    cache.get("banana")
+    cache.put_bytes("durian", b"0" * 100)
+    assert cache.get("banana") is not None
+    assert cache.get("cherry") is None
+    assert cache.stats()["evictions"] == 2
+    assert cache.stats()["bytes"] == 200
+
+def test_access_times_are_batched(tmp_path):
+    cache = AudioCache(tmp_path, flush_size=2)
+    for word in ["apple", "banana"]:
+        cache.put_bytes(word, b"0" * 10)
+    def accessed():
+        with sqlite3.connect(tmp_path / "index.sqlite3") as conn:
+            return dict(conn.execute("SELECT key, accessed FROM clips").fetchall())
+    before = accessed()
+    time.sleep(0.01)
+    cache.get("apple")
+    cache.get("apple")
+    assert accessed() == before
+    cache.get("banana")
+    after = accessed()
+    assert after["apple"] > before["apple"] and after["banana"] > before["banana"]
+    time.sleep(0.01)
+    cache.get("banana")
+    cache.close()
+    assert accessed()["banana"] > after["banana"]
+
+def test_adopt_and_clear(tmp_path):
+    (tmp_path / "audio[old].mp3").write_bytes(b"0" * 10)
+    cache = AudioCache(tmp_path)
+    assert cache.get("audio[old].mp3") is not None
+    assert cache.etag("audio[old].mp3") == hashlib.sha256(b"0" * 10).hexdigest()
+    assert cache.clear() == {"entries": 1, "bytes": 10}
+    assert cache.stats()["entries"] == 0
+    assert not (tmp_path / "audio[old].mp3").exists()
+
+class FakeSpeech:
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, model, voice, input, response_format="mp3", timeout=None):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return SimpleNamespace(write_to_file=lambda path: Path(path).write_bytes(input.encode("utf-8")))
+
+def test_async_generate_coalesces(tmp_path, monkeypatch):
+    monkeypatch.setattr(AMEngine, "audio_cache", AudioCache(tmp_path))
+    engine = AMEngine("tts-1", "sk-test", "http://127.0.0.1:9/v1")
+    speech = FakeSpeech()
+    engine.async_client = SimpleNamespace(audio=SimpleNamespace(speech=speech))
+    async def main():
+        return await asyncio.gather(*[engine.async_generate("apple", "alloy") for _ in range(4)])
+    names = asyncio.run(main())
+    assert speech.calls == 1
+    assert len(set(names)) == 1
+    assert AMEngine.audio_cache.path(names[0]).read_bytes() == b"apple"
@@ -0,0 +1,75 @@
+import sys, os
+sys.path.append(os.path.abspath("."))
+
+import time
+import pytest
+
+from utils.cache import ResponseCache
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(tmp_path / "llm.sqlite3", max_memory_entries=2, max_disk_entries=3, ttl=None)
+    yield cache
+    cache.close()
+
+def test_key_is_stable():
+    messages = [{"role": "user", "content": "apple"}]
+    k1 = ResponseCache.make_key("gpt-4o", messages, {"temperature": 0, "top_p": 1})
+    k2 = ResponseCache.make_key("gpt-4o", messages, {"top_p": 1, "temperature": 0})
+    k3 = ResponseCache.make_key("gpt-4o-mini", messages, {"temperature": 0, "top_p": 1})
+    assert k1 == k2
+    assert k1 != k3
+
+def test_hit_and_miss(cache):
+    assert cache.get("a") is None
+    cache.set("a", "apple")
+    assert cache.get("a") == "apple"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_disk_fallback(cache, tmp_path):
+    for key in ["a", "b", "c"]:
+        cache.set(key, key * 2)
+    # "a" was pushed out of the memory LRU but is still on disk
+    assert cache.stats()["memory_entries"] == 2
+    assert cache.get("a") == "aa"
+    reopened = ResponseCache(tmp_path / "llm.sqlite3")
+    assert reopened.get("b") == "bb"
+    reopened.close()
+
+def test_size_eviction(cache):
+    for key in ["a", "b", "c", "d"]:
+        cache.set(key, key)
+        time.sleep(0.01)
+    cache.clear()
+    assert cache.get("a") is None
+    for key in ["a", "b", "c", "d"]:
+        cache.set(key, key)
+        time.sleep(0.01)
+    reopened = ResponseCache(cache.path)
+    assert reopened.get("a") is None
+    assert reopened.get("d") == "d"
+    reopened.close()
+
+def test_ttl(tmp_path):
+    cache = ResponseCache(tmp_path / "llm.sqlite3", ttl=0.05)
+    cache.set("a", "apple")
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    cache.close()
+
+def test_expiry_is_periodic(tmp_path):
+    cache = ResponseCache(tmp_path / "llm.sqlite3", ttl=0.05, expiry_interval=3600)
+    for key in ["a", "b"]:
+        cache.set(key, key)
+    cache.set("a", "apple")
+    assert cache.stats()["disk_entries"] == 2
+    time.sleep(0.1)
+    # expired rows stay on disk until the next purge, but are never returned
+    cache.set("c", "c")
+    assert cache.stats()["disk_entries"] == 3
+    assert cache.get("b") is None
+    cache.expiry_interval = 0
+    cache.set("d", "d")
+    assert cache.stats()["disk_entries"] == 2
+    cache.close()
@@ -0,0 +1,130 @@
+import sys, os
+sys.path.append(os.path.abspath("."))
+
+import time, asyncio
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+from utils.concurrency import SingleFlight, BackgroundLoop
+
+def test_single_flight_threads():
+    flights = SingleFlight()
+    calls = []
+    def lookup():
+        calls.append(1)
+        time.sleep(0.1)
+        return "apple"
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: flights.do("apple", lookup), range(8)))
+    assert len(calls) == 1
+    assert [result for result, _ in results] == ["apple"] * 8
+    assert sum(shared for _, shared in results) == 7
+    assert flights.in_flight() == 0
+
+def test_single_flight_error_is_shared():
+    flights = SingleFlight()
+    def broken():
+        time.sleep(0.05)
+        raise RuntimeError("down")
+    def call():
+        try:
+            flights.do("key", broken)
+        except RuntimeError as e:
+            return str(e)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert list(executor.map(lambda _: call(), range(4))) == ["down"] * 4
+
+def test_single_flight_async():
+    flights = SingleFlight()
+    calls = []
+    async def lookup():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "apple"
+    async def main():
+        return await asyncio.gather(*[flights.async_do("apple", lookup) for _ in range(5)])
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [result for result, _ in results] == ["apple"] * 5
+    # a finished call is not reused
+    asyncio.run(main())
+    assert len(calls) == 2
+
+def test_background_loop_is_reused():
+    background = BackgroundLoop()
+    async def current_loop():
+        return asyncio.get_running_loop()
+    async def broken():
+        raise RuntimeError("down")
+    loop = background.run(current_loop())
+    assert background.run(current_loop()) is loop
+    results = background.gather([current_loop(), broken()])
+    assert results[0] is loop
+    assert isinstance(results[1], RuntimeError)
+    async def nested():
+        return background.run(current_loop())
+    with pytest.raises(RuntimeError):
+        background.run(nested())
+    background.stop()
+
+def test_tool_calls_keep_order_and_time_out():
+    from utils.general import LLMEngine
+    engine = LLMEngine("gpt-4o", "sk-test", "http://127.0.0.1:9/v1")
+    def slow(word):
+        time.sleep(0.2)
+        return word
+    def fast(word):
+        return word
+    def hang():
+        time.sleep(2)
+    functions = {"slow": slow, "fast": fast, "hang": hang}
+    tool_calls = [
+        {"id": f"call_{i}", "type": "function", "function": {"name": name, "arguments": arguments}}
+        for i, (name, arguments) in enumerate([("slow", '{"word": "apple"}'), ("hang", "{}"), ("fast", '{"word": "banana"}')])
+    ]
+    started = time.monotonic()
+    results = engine._LLMEngine__call_tools(tool_calls, functions, {"hang": 0.3})
+    assert time.monotonic() - started < 1
+    assert [result["tool_call_id"] for result in results] == ["call_0", "call_1", "call_2"]
+    assert [result["content"] for result in results] == ["apple", "Function hang timed out.", "banana"]
+    assert all(result["role"] == "tool" for result in results)
+
+def test_single_flight_stream_is_released_on_close():
+    flights = SingleFlight()
+    chunks = flights.do_stream("apple", lambda: iter([b"a", b"b"]))
+    assert flights.in_flight() == 1
+    assert next(chunks) == b"a"
+    chunks.close()
+    assert flights.in_flight() == 0
+    assert list(flights.do_stream("apple", lambda: iter([b"a", b"b"]))) == [b"a", b"b"]
+    assert flights.in_flight() == 0
+
+def test_single_flight_sync_waits_for_async():
+    flights = SingleFlight()
+    background = BackgroundLoop()
+    calls = []
+    async def lookup():
+        calls.append(1)
+        await asyncio.sleep(0.2)
+        return "apple"
+    def sync_lookup():
+        calls.append(1)
+        return "banana"
+    future = background.submit(flights.async_do("apple", lookup))
+    time.sleep(0.05)
+    assert flights.in_flight() == 1
+    # a sync call and a stream that ask meanwhile wait for the coroutine
+    assert flights.do("apple", sync_lookup) == ("apple", True)
+    assert future.result() == ("apple", False)
+    assert len(calls) == 1
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        chunks = flights.do_stream("apple", lambda: iter([b"a", b"b"]))
+        waiting = executor.submit(background.run, flights.async_do("apple", lookup))
+        time.sleep(0.05)
+        assert not waiting.done()
+        assert list(chunks) == [b"a", b"b"]
+        assert waiting.result(1) == (None, True)
+    assert len(calls) == 1
+    assert flights.in_flight() == 0
+    background.stop()
@@ -0,0 +1,64 @@
+import sys, os
+sys.path.append(os.path.abspath("."))
+
+import time, asyncio
+import threading
+import httpx
+import pytest
+from openai import RateLimitError
+
+from utils.limiter import RateLimiter, get_limiter
+
+def rate_limit_error(retry_after: str) -> RateLimitError:
+    request = httpx.Request("POST", "http://provider/v1/chat/completions")
+    response = httpx.Response(429, headers={"retry-after": retry_after}, request=request)
+    return RateLimitError("rate limited", response=response, body=None)
+
+def test_shared_per_provider():
+    a = get_limiter("https://api.openai.com/v1")
+    b = get_limiter("https://api.openai.com/v1/")
+    c = get_limiter("https://api.deepseek.com")
+    assert a is b
+    assert a is not c
+
+def test_concurrency_cap():
+    limiter = RateLimiter("test", max_concurrency=2, rpm=60000, tpm=10**9)
+    peak, active = 0, 0
+    lock = threading.Lock()
+    def work():
+        nonlocal peak, active
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.05)
+        with lock:
+            active -= 1
+    threads = [threading.Thread(target=limiter.call, args=(work,)) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert peak <= 2
+    assert limiter.in_flight == 0
+    assert limiter.queue_depth == 0
+
+def test_retry_after():
+    limiter = RateLimiter("test", rpm=60000, tpm=10**9)
+    calls = []
+    def work():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise rate_limit_error("0.1")
+        return "ok"
+    assert limiter.call(work) == "ok"
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.1
+    assert limiter.scale < 1.0
+
+def test_async_retry_gives_up():
+    limiter = RateLimiter("test", rpm=60000, tpm=10**9, max_retries=1, base_delay=0.01)
+    async def work():
+        raise rate_limit_error("0.01")
+    with pytest.raises(RateLimitError):
+        asyncio.run(limiter.async_call(work))
+    assert limiter.in_flight == 0
@@ -0,0 +1,62 @@
+import sys, os
+sys.path.append(os.path.abspath("."))
+
+import json
+import pytest
+from types import SimpleNamespace
+
+from utils.metrics import Telemetry, Histogram
+
+def test_histogram_quantile():
+    histogram = Histogram([1, 2, 5])
+    for value in [0.5, 0.5, 1.5, 4, 10]:
+        histogram.observe(value)
+    assert histogram.count == 5
+    assert histogram.quantile(0.5) == 2
+    assert histogram.quantile(1.0) == float("inf")
+
+class Retriever:
+    def __init__(self, telemetry: Telemetry):
+        self.telemetry = telemetry
+
+    def gen_rela(self, fail: bool = False):
+        with self.telemetry.track("LLMEngine.generate", "gpt-4o") as span:
+            if fail:
+                raise RuntimeError("provider down")
+            usage = SimpleNamespace(prompt_tokens=100, completion_tokens=20, prompt_tokens_details=SimpleNamespace(cached_tokens=64))
+            span.add_usage(usage)
+
+def test_track_caller_and_tokens():
+    telemetry = Telemetry()
+    retriever = Retriever(telemetry)
+    retriever.gen_rela()
+    with pytest.raises(RuntimeError):
+        retriever.gen_rela(fail=True)
+    stats = telemetry.export()["stats"]
+    assert len(stats) == 1
+    stat = stats[0]
+    assert stat["caller"] == "Retriever.gen_rela"
+    assert stat["outcomes"] == {"ok": 1, "RuntimeError": 1}
+    assert stat["prompt_tokens"] == 100
+    assert stat["cached_tokens"] == 64
+    assert stat["latency"]["count"] == 2
+    assert len(json.loads(telemetry.export_json(recent=True))["recent"]) == 2
+
+class Planner:
+    def __init__(self, router):
+        self.router = router
+
+    def answer(self):
+        return self.router.generate("hi")
+
+def test_caller_of_pool_threads():
+    from utils.general import LLMEngine
+    from utils.router import RouterEngine
+    from utils.metrics import telemetry
+    engine = LLMEngine("gpt-caller-test", "sk-test", "http://127.0.0.1:9/v1")
+    completion = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="hello"))], usage=None)
+    engine.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: completion)))
+    # the engine runs on a router thread, the call is still the planner's
+    assert Planner(RouterEngine([engine], hedge_after=1.0)).answer() == "hello"
+    callers = [stat["caller"] for stat in telemetry.export()["stats"] if stat["model"] == "gpt-caller-test"]
+    assert callers == ["Planner.answer"]
@@ -0,0 +1,501 @@
+import sys, os
+sys.path.append(os.path.abspath("."))
+
+import pytest
+
+import gc, asyncio
+import neo4j
+from utils.neo4j_orm import Graph, Node, NodeRow, IdentityMap
+from utils.neo4j_async import AsyncGraph, AsyncNode, AsyncRelationship
+from utils.neo4j_schema import Schema, MIGRATIONS
+
+class Result(list):
+    def consume(self):
+        pass
+
+class FakeRecordNode(dict):
+    def __init__(self, labels, properties):
+        super().__init__(properties)
+        self.labels = frozenset(labels)
+
+class FakeRecordRelationship(dict):
+    def __init__(self, type, properties):
+        super().__init__(properties)
+        self.type = type
+
+class FakeSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        self.driver.sessions += 1
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute_read(self, work):
+        self.driver.transactions.append("read")
+        return work(FakeTransaction(self.driver.queries, self.driver.store))
+
+    def execute_write(self, work):
+        self.driver.transactions.append("write")
+        return work(FakeTransaction(self.driver.queries, self.driver.store))
+
+class FakeTransaction:
+    def __init__(self, queries, store=[]):
+        self.queries = queries
+        self.store = store
+
+    def run(self, query, parameters=None, **kwargs):
+        self.queries.append((query, parameters))
+        if "ORDER BY p.m_id ASC\nLIMIT $limit" in query:
+            # keyset page over the stored nodes
+            after = parameters.get("after_m_id", "")
+            return Result({"p": p} for p in sorted(self.store, key=lambda p: p["m_id"]) if p["m_id"] > after)[:parameters["limit"]]
+        if "RETURN r.r_id" in query:
+            return Result({"r_id": row["r_id"]} for row in parameters["rows"])
+        return Result()
+
+class FakeDriver:
+    def __init__(self):
+        self.queries = []
+        self.sessions = 0
+        self.transactions = []
+        self.store = []
+
+    def session(self, **kwargs):
+        return FakeSession(self)
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def graph():
+    graph = Graph("neo4j://127.0.0.1:7687", ("neo4j", "neo4j"), bootstrap=False)
+    graph._Graph__driver = FakeDriver()
+    yield graph
+    Node.nodes.clear()
+
+def test_values_are_parameters(graph):
+    graph.match_node(label="word", properties={"abstract": "apple"}, order=("familiarity", "ASC"), limit=10)
+    graph.match_node(label="word", properties={"abstract": "it's"}, order=("familiarity", "ASC"), limit=5)
+    (q1, p1), (q2, p2) = graph._Graph__driver.queries
+    assert q1 == q2
+    assert "apple" not in q1
+    assert p1 == {"p_abstract": "apple", "limit": 10}
+    assert p2 == {"p_abstract": "it's", "limit": 5}
+
+def test_match_template_is_shared(graph):
+    graph.match({"m_id": "a", "label": "word"}, {"label": "image"}, {}, bidirect=True)
+    graph.match({"m_id": "b", "label": "word"}, {"label": "image"}, {}, bidirect=True)
+    (q1, p1), (q2, p2) = graph._Graph__driver.queries
+    assert q1 == q2
+    assert p1 == {"p_m_id": "a"} and p2 == {"p_m_id": "b"}
+
+def test_create_and_delete(graph):
+    node = graph.create_node("word", {"abstract": "apple", "content": "a fruit"})
+    graph._create_rela((node.m_id, "other"), "synonyms", {})
+    node._destroy()
+    queries = graph._Graph__driver.queries
+    assert queries[0] == (Graph._create_node_query("memory:word"), {"properties": node._properties})
+    assert queries[1][1]["from_m_id"] == node.m_id
+    assert queries[2] == (Graph.DELETE_NODE, {"m_id": node.m_id})
+
+def test_bulk_writes(graph):
+    nodes = graph.create_nodes(
+        [("image", {"abstract": f"image-{i}", "content": ""}) for i in range(2500)] + [("word", {"abstract": "apple", "content": ""})],
+        batch_size=1000
+    )
+    queries = graph._Graph__driver.queries
+    assert [len(parameters["rows"]) for _, parameters in queries] == [1000, 1000, 500, 1]
+    assert len({query for query, _ in queries}) == 2
+    assert len(nodes) == 2501 and nodes[-1].label == "word"
+    relas = graph.create_relas([((node.m_id, nodes[-1].m_id), "display", {}) for node in nodes[:-1]], batch_size=2000)
+    assert len(relas) == 2500
+    assert relas[0].pos == (nodes[0].m_id, nodes[-1].m_id)
+    assert len(queries) == 6
+
+class FailingTransaction(FakeTransaction):
+    """ Fails on the second statement, the rows of a failed transaction are never committed """
+    def __init__(self, queries):
+        super().__init__(queries)
+        self.rows = []
+
+    def run(self, query, parameters=None, **kwargs):
+        if len(self.rows) > 0:
+            raise RuntimeError("second batch failed")
+        self.rows.extend(parameters["rows"])
+        return super().run(query, parameters, **kwargs)
+
+class FailingSession(FakeSession):
+    def execute_write(self, work):
+        self.driver.transactions.append("write")
+        tx = FailingTransaction(self.driver.queries)
+        result = work(tx)
+        self.driver.store.extend(tx.rows)
+        return result
+
+def test_bulk_writes_are_atomic(graph):
+    graph._Graph__driver.session = lambda **kwargs: FailingSession(graph._Graph__driver)
+    with pytest.raises(RuntimeError):
+        graph.create_nodes([("word", {"abstract": f"word-{i}", "content": ""}) for i in range(3)], batch_size=2)
+    # the first batch went to the same transaction as the failing one
+    assert graph._Graph__driver.transactions == ["write"]
+    assert len(graph._Graph__driver.queries) == 1
+    assert graph._Graph__driver.store == []
+
+def test_unit_of_work(graph):
+    words = graph.create_nodes([("unfamiliar_word", {"abstract": word, "content": "", "familiarity": 90}) for word in ["apple", "banana", "cherry"]])
+    queries = graph._Graph__driver.queries
+    queries.clear()
+    with graph.unit_of_work():
+        for node in words:
+            node.set_prop("familiarity", node.get_prop("familiarity") + 10)
+            node.update()
+        words[0].set_label("word")
+        words[0].update()
+        words[2]._destroy()
+        assert queries == []
+    assert [query for query, _ in queries] == [Graph.FLUSH_NODES, Graph.DELETE_NODES]
+    assert graph._Graph__driver.transactions[-1:] == ["write"]
+    rows = queries[0][1]["rows"]
+    assert [row["m_id"] for row in rows] == [words[0].m_id, words[1].m_id]
+    assert rows[0]["labels"] == ["memory", "word"]
+    assert rows[1]["new_properties"] == {"familiarity": 100}
+    assert words[1]._new_properties == {}
+
+def test_unit_of_work_rollback(graph):
+    node = graph.create_node("unfamiliar_word", {"abstract": "apple", "content": "", "familiarity": 90})
+    queries = graph._Graph__driver.queries
+    queries.clear()
+    with pytest.raises(RuntimeError):
+        with graph.unit_of_work():
+            node.set_prop("familiarity", 100)
+            node.set_label("word")
+            node.update()
+            node._destroy()
+            raise RuntimeError("quiz interrupted")
+    assert queries == []
+    assert node._alive and node.label == "unfamiliar_word"
+    assert node.get_prop("familiarity") == 90
+    assert node._new_properties == {}
+    # outside of a unit of work, update() writes right away
+    node.set_prop("familiarity", 95)
+    node.update()
+    assert queries[0] == (Graph.UPDATE_NODE, {
+        "m_id": node.m_id,
+        "new_labels": ["memory", "unfamiliar_word"],
+        "new_properties": {"familiarity": 95},
+        "removed_properties": []
+    })
+
+def test_unit_of_work_failed_flush(graph):
+    words = graph.create_nodes([("unfamiliar_word", {"abstract": word, "content": "", "familiarity": 90}) for word in ["apple", "banana"]])
+    graph._Graph__driver.session = lambda **kwargs: FailingSession(graph._Graph__driver)
+    flushed = []
+    with pytest.raises(RuntimeError):
+        with graph.unit_of_work() as unit:
+            words[0].set_prop("familiarity", 100)
+            words[0].update()
+            words[1]._destroy()
+            unit.after_flush(lambda: flushed.append(True))
+    # the write failed: the nodes are as they were before the block
+    assert graph._Graph__driver.store == []
+    assert flushed == []
+    assert words[0].get_prop("familiarity") == 90 and words[0]._new_properties == {}
+    assert words[1]._alive
+    assert graph._unit() is None
+
+def test_after_flush(graph):
+    node = graph.create_node("unfamiliar_word", {"abstract": "apple", "content": ""})
+    queries = graph._Graph__driver.queries
+    queries.clear()
+    flushed = []
+    with pytest.raises(RuntimeError):
+        with graph.unit_of_work() as unit:
+            node._destroy()
+            unit.after_flush(lambda: flushed.append(len(queries)))
+            raise RuntimeError("quiz interrupted")
+    assert flushed == []
+    with graph.unit_of_work() as unit:
+        node._destroy()
+        unit.after_flush(lambda: flushed.append(len(queries)))
+        assert flushed == []
+    # after the delete was written
+    assert flushed == [1]
+
+def test_identity_map_refreshes_in_place(graph):
+    node = graph.create_node("unfamiliar_word", {"abstract": "apple", "content": "", "familiarity": 10})
+    node.set_prop("content", "a fruit")
+    # another request changed the node in the meantime
+    again = Node._create(graph, node.m_id, "unfamiliar_word", {"m_id": node.m_id, "abstract": "apple", "content": "", "familiarity": 50})
+    assert again is node
+    assert node.get_prop("familiarity") == 50
+    assert node.get_prop("content") == "a fruit"
+    assert Node.nodes.age(node.m_id) < 1
+    # the node was deleted by someone else
+    assert not node.refresh()
+    assert not node._alive
+    assert node.m_id not in Node.nodes
+
+def test_identity_map_is_bounded(graph, monkeypatch):
+    monkeypatch.setattr(Node, "nodes", IdentityMap(max_size=10))
+    kept = graph.create_node("word", {"abstract": "kept", "content": ""})
+    graph.create_nodes([("word", {"abstract": f"word-{i}", "content": ""}) for i in range(100)])
+    gc.collect()
+    stats = Node.nodes.stats()
+    assert stats["strong_entries"] == 10
+    # nodes referenced elsewhere keep their identity after they left the LRU
+    assert stats["entries"] == 11
+    assert Node.nodes.get(kept.m_id) is kept
+    assert stats["evictions"] == 91
+    assert stats["bytes"] > 0
+    # load times are only kept for the nodes still mapped
+    for i in range(5000):
+        Node._create(graph, f"m-{i}", "word", {"m_id": f"m-{i}", "abstract": f"word-{i}", "content": ""})
+    gc.collect()
+    assert len(Node.nodes) == 11
+    assert len(Node.nodes._IdentityMap__loaded) == 11
+    assert Node.nodes.age(kept.m_id) is not None
+
+def test_session_reuse(graph):
+    driver = graph._Graph__driver
+    with graph.session():
+        node = graph.create_node("word", {"abstract": "apple", "content": ""})
+        graph.match_node(label="word", properties={"abstract": "apple"})
+        graph.match({"m_id": node.m_id}, {}, {})
+        node._destroy()
+    assert driver.sessions == 1
+    assert driver.transactions == ["write", "read", "read", "write"]
+    # outside of the block every call gets its own session
+    graph.match_node(label="word")
+    assert driver.sessions == 2
+
+def test_driver_config(monkeypatch):
+    monkeypatch.setenv("NEO4J_MAX_POOL_SIZE", "16")
+    monkeypatch.setenv("NEO4J_ACQUISITION_TIMEOUT", "5")
+    config = Graph.driver_config()
+    assert config["max_connection_pool_size"] == 16
+    assert config["connection_acquisition_timeout"] == 5.0
+
+def test_page_nodes_statement():
+    cursor = {"order": ["familiarity", "DESC"], "value": 50, "m_id": "x"}
+    query, parameters, order, limit = Graph._page_nodes_statement("unfamiliar_word", {}, ("familiarity", "DESC"), cursor, 10)
+    assert "SKIP" not in query
+    assert "p.`familiarity` < $after_value OR (p.`familiarity` = $after_value AND p.m_id > $after_m_id)" in query
+    assert parameters == {"after_value": 50, "after_m_id": "x", "limit": 11}
+    # the template doesn't depend on how deep the page is
+    assert Graph._page_nodes_statement("unfamiliar_word", {}, ("familiarity", "DESC"), {**cursor, "value": 3}, 10)[0] == query
+    assert Graph.decode_cursor(Graph.encode_cursor(cursor)) == cursor
+    with pytest.raises(ValueError):
+        Graph._page_nodes_statement("unfamiliar_word", {}, ("familiarity", "ASC"), cursor, 10)
+    with pytest.raises(ValueError):
+        Graph.decode_cursor("not a cursor")
+
+def test_iter_nodes(graph):
+    driver = graph._Graph__driver
+    driver.store = [FakeRecordNode(["memory", "word"], {"m_id": f"{i:04d}", "abstract": f"word-{i}", "content": ""}) for i in range(25)]
+    nodes, cursor = graph.page_nodes(label="word", limit=10)
+    assert [node.m_id for node in nodes] == [f"{i:04d}" for i in range(10)]
+    assert cursor == {"order": ["m_id", "ASC"], "value": "0009", "m_id": "0009"}
+    driver.queries.clear()
+    assert [node.m_id for node in graph.iter_nodes(label="word", fetch_size=10)] == [f"{i:04d}" for i in range(25)]
+    assert [parameters["limit"] for _, parameters in driver.queries] == [11, 11, 11]
+    assert all(node._alive for node in nodes)
+
+def test_match_subgraph(graph, monkeypatch):
+    word = FakeRecordNode(["memory", "word"], {"m_id": "w", "abstract": "apple", "content": ""})
+    mistake = FakeRecordNode(["memory", "mistake"], {"m_id": "m", "abstract": "aple", "content": ""})
+    image = FakeRecordNode(["memory", "image"], {"m_id": "i", "abstract": "an apple", "content": "https://example.com/apple.png"})
+    display = FakeRecordRelationship("display", {"r_id": "r", "from": "i", "to": "w"})
+    records = [{"p": word, "expanded": [[display, image]]}, {"p": mistake, "expanded": []}]
+    reads = []
+    monkeypatch.setattr(graph, "_read", lambda work: reads.append(work) or records)
+    subgraph = graph.match_subgraph(["w", "m", "w", "gone"], expand=("display",), to_label="image")
+    assert len(reads) == 1
+    assert set(subgraph) == {"w", "m"}
+    node, [(rela, neighbour)] = subgraph["w"]
+    assert node.label == "word" and neighbour.label == "image" and rela.pos == ("i", "w")
+    assert subgraph["m"][1] == []
+    query, parameters = Graph._subgraph_statement(["w", "m", "w"], ("display",), "image", True)
+    assert parameters == {"m_ids": ["w", "m"]}
+    assert "WHERE p.m_id IN $m_ids" in query and "[r:display]-(q:memory:image)" in query
+    # no labels to expand through, or any label
+    assert "[] AS expanded" in Graph._subgraph_statement(["w"], (), "image", True)[0]
+    assert "[(p)-[r]-(q:memory:image) | [r, q]]" in Graph._subgraph_statement(["w"], None, "image", True)[0]
+    with pytest.raises(ValueError):
+        graph.match_subgraph(["w"], expand=("knows",))
+
+def test_compact_nodes(graph):
+    node = graph.create_node("word", {"abstract": "apple", "content": ""})
+    assert not hasattr(node, "__dict__")
+    # nothing is allocated for changes until there is one
+    assert node._new is None and node._removed is None
+    assert node._new_properties == {} and node._removed_properties == []
+    node.set_prop("familiarity", 10)
+    node.remove_prop("content")
+    assert node._new == {"familiarity": 10} and node._removed == ["content"]
+    node.update()
+    assert node._new is None and node._removed is None
+    rela = graph._create_rela((node.m_id, "other"), "synonyms", {})
+    assert not hasattr(rela, "__dict__") and rela._new is None
+
+def test_page_rows(graph):
+    graph._Graph__driver.store = [FakeRecordNode(["memory", "word"], {"m_id": f"{i:04d}", "abstract": f"word-{i}", "content": ""}) for i in range(5)]
+    rows, cursor = graph.page_rows(label="word", limit=3)
+    assert rows[0] == NodeRow("0000", "word", {"m_id": "0000", "abstract": "word-0", "content": ""})
+    assert cursor["m_id"] == "0002"
+    # rows are not mapped
+    assert len(Node.nodes) == 0
+    rows, cursor = graph.page_rows(label="word", cursor=cursor, limit=3)
+    assert [row.m_id for row in rows] == ["0003", "0004"] and cursor is None
+
+def test_allow_list(graph):
+    with pytest.raises(ValueError):
+        graph.create_node("word) DETACH DELETE (n", {"abstract": "apple"})
+    with pytest.raises(ValueError):
+        graph._create_rela(("a", "b"), "knows", {})
+    with pytest.raises(ValueError):
+        graph.match_node(label="word", properties={"abstract}) RETURN 1 //": "apple"})
+    with pytest.raises(ValueError):
+        graph.match_node(label="word", order=("familiarity", "ASC; DROP"))
+    assert graph._Graph__driver.queries == []
+
+class AsyncResult:
+    def __init__(self, records):
+        self.records = records
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if len(self.records) == 0:
+            raise StopAsyncIteration
+        return self.records.pop(0)
+
+    async def consume(self):
+        pass
+
+class AsyncFakeDriver(FakeDriver):
+    """ FakeDriver behind the async API, the records of MATCH queries come from `rows` """
+    def __init__(self, rows=[]):
+        super().__init__()
+        self.rows = rows
+
+    def session(self, **kwargs):
+        return AsyncFakeSession(self)
+
+    async def close(self):
+        pass
+
+class AsyncFakeSession(FakeSession):
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def execute_read(self, work):
+        self.driver.transactions.append("read")
+        return await work(AsyncFakeTransaction(self.driver))
+
+    async def execute_write(self, work):
+        self.driver.transactions.append("write")
+        return await work(AsyncFakeTransaction(self.driver))
+
+class AsyncFakeTransaction:
+    def __init__(self, driver):
+        self.driver = driver
+
+    async def run(self, query, parameters=None):
+        self.driver.queries.append((query, parameters))
+        if query.startswith("MATCH"):
+            return AsyncResult(list(self.driver.rows))
+        return AsyncResult(FakeTransaction([]).run(query, parameters))
+
+def test_async_graph():
+    graph = AsyncGraph("neo4j://127.0.0.1:7687", ("neo4j", "neo4j"))
+    driver = AsyncFakeDriver([{"p": FakeRecordNode(["memory", "word"], {"m_id": "a", "abstract": "apple", "content": ""})}])
+    graph._AsyncGraph__driver = driver
+    async def main():
+        async with graph.session():
+            node = await graph.create_node("word", {"abstract": "banana", "content": ""})
+            [apple] = await graph.match_node(label="word", properties={"abstract": "apple"})
+            rela = await node.create_rela(apple, "relative", {})
+        apple.set_prop("familiarity", 10)
+        await apple.update()
+        await rela.destroy()
+        await node._destroy()
+        return node, apple, rela
+    node, apple, rela = asyncio.run(main())
+    assert driver.sessions == 4
+    assert driver.transactions == ["write", "read", "write", "write", "write", "write"]
+    assert isinstance(apple, AsyncNode) and isinstance(rela, AsyncRelationship)
+    assert apple.label == "word" and AsyncNode.nodes.get("a") is apple and Node.nodes.get("a") is None
+    # same statements as the sync Graph
+    assert driver.queries[1] == Graph._match_node_statement(None, "word", {"abstract": "apple"}, None, None, None)
+    assert driver.queries[3] == (Graph.UPDATE_NODE, Graph._update_node_parameters("a", "word", {"familiarity": 10}, []))
+    assert rela.pos == (node.m_id, "a") and not rela._alive and not node._alive
+    with pytest.raises(RuntimeError):
+        asyncio.run(node.update())
+    AsyncNode.nodes.clear()
+
+def test_async_session_per_task():
+    graph = AsyncGraph("neo4j://127.0.0.1:7687", ("neo4j", "neo4j"))
+    driver = AsyncFakeDriver()
+    graph._AsyncGraph__driver = driver
+    async def main():
+        async with graph.session() as session:
+            async with graph.session() as again:
+                assert again is session
+            # tasks started inside the block don't share the session
+            await asyncio.gather(graph.match_node(label="word"), graph.match_node(label="image"))
+            await graph.match_node(label="word")
+    asyncio.run(main())
+    assert driver.sessions == 3
+    AsyncNode.nodes.clear()
+
+class SchemaDriver:
+    def __init__(self):
+        self.statements = []
+        self.versions = set()
+        self.databases = set()
+
+    def session(self, **kwargs):
+        self.databases.add(kwargs.get("database"))
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def run(self, query, parameters=None, **kwargs):
+        if query.startswith("MATCH (m:_SchemaMigration)"):
+            return Result({"version": version} for version in sorted(self.versions))
+        if query.startswith("MERGE (m:_SchemaMigration"):
+            self.versions.add(kwargs["version"])
+        else:
+            self.statements.append(query)
+        return Result()
+
+def test_schema_migrations():
+    driver = SchemaDriver()
+    schema = Schema(driver)
+    assert schema.migrate() == [version for version, _, _ in MIGRATIONS]
+    assert any("REQUIRE p.m_id IS UNIQUE" in statement for statement in driver.statements)
+    assert all("IF NOT EXISTS" in statement for statement in driver.statements)
+    count = len(driver.statements)
+    assert schema.migrate() == []
+    assert len(driver.statements) == count
+    # every relationship label gets its r_id index
+    assert all(any(f"[r:{label}]" in statement for statement in driver.statements) for label in Graph.rela_labels)
+
+def test_schema_bootstrap_uses_the_graph_database(monkeypatch):
+    driver = SchemaDriver()
+    monkeypatch.setattr(neo4j.GraphDatabase, "driver", lambda **kwargs: driver)
+    Graph("neo4j://127.0.0.1:7687", ("neo4j", "neo4j"), database="clara")
+    assert driver.databases == {"clara"}
+    assert len(driver.versions) == len(MIGRATIONS)
@@ -3,6 +3,28 @@ sys.path.append(os.path.abspath("."))
 
 from pathlib import Path
 
-from utils.questions import Quiz
+from utils.questions import Quiz, ListeningQuestion
+from utils.general import registry
 
-import pytest
\ No newline at end of file
+import pytest
+
+class FakeTTS:
+    def __init__(self):
+        self.clips = []
+
+    async def async_generate(self, text, voice, timeout=None, response_format="mp3"):
+        self.clips.append((text, voice, response_format))
+
+def test_prewarm_requested_formats(monkeypatch):
+    tts = FakeTTS()
+    monkeypatch.setattr(registry, "get", lambda name: tts)
+    monkeypatch.setattr(ListeningQuestion, "audio_formats", {ListeningQuestion.audio_format})
+    quiz = Quiz()
+    quiz.addq(ListeningQuestion("Listen and write down the word.", "apple", [], voice="alloy"))
+    # a client that can't play opus asked for aac
+    ListeningQuestion.requested("aac")
+    quiz.prewarm().result(timeout=5)
+    assert sorted(tts.clips) == [("apple", "alloy", "aac"), ("apple", "alloy", "opus")]
+    tts.clips.clear()
+    quiz.prewarm(["mp3"]).result(timeout=5)
+    assert tts.clips == [("apple", "alloy", "mp3")]
@@ -0,0 +1,93 @@
+import sys, os
+sys.path.append(os.path.abspath("."))
+
+import pytest
+
+from utils.general import EngineRegistry, LLMEngine, AMEngine
+from utils.router import RouterEngine
+from utils.replay import ReplayEngine, ReplayAMEngine
+
+CONFIG = """
+providers:
+  openai:
+    api_key: TEST_OPENAI_API_KEY
+    base_url: TEST_OPENAI_BASE_URL
+  deepseek:
+    api_key: TEST_DEEPSEEK_API_KEY
+    base_url: TEST_DEEPSEEK_BASE_URL
+engines:
+  gpt_4o:
+    type: llm
+    model: gpt-4o
+    provider: openai
+  gpt_4o_lookup:
+    type: llm
+    model: gpt-4o
+    provider: openai
+    cache: true
+  ds_chat:
+    type: llm
+    model: deepseek-chat
+    provider: deepseek
+  auto:
+    type: router
+    engines: [gpt_4o, ds_chat]
+    options:
+      hedge_after: 2.0
+  tts:
+    type: tts
+    model: tts-1
+    provider: openai
+engine_list:
+  gpt-4o: gpt_4o
+"""
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    config_path = tmp_path / "engines.yml"
+    config_path.write_text(CONFIG)
+    monkeypatch.setenv("TEST_OPENAI_API_KEY", "sk-test")
+    monkeypatch.setenv("TEST_OPENAI_BASE_URL", "http://127.0.0.1:9/v1")
+    monkeypatch.setenv("TEST_DEEPSEEK_API_KEY", "sk-test")
+    monkeypatch.setenv("TEST_DEEPSEEK_BASE_URL", "http://127.0.0.1:9/v1")
+    monkeypatch.delenv("LLM_CASSETTE", raising=False)
+    return EngineRegistry(config_path)
+
+def test_engines_are_built_lazily(registry, monkeypatch):
+    # ds_chat could not be built, it is never asked for
+    monkeypatch.delenv("TEST_DEEPSEEK_API_KEY")
+    engine = registry.get("gpt_4o")
+    assert isinstance(engine, LLMEngine)
+    assert engine.model == "gpt-4o"
+    assert registry.get("gpt_4o") is engine
+    assert isinstance(registry.get("tts"), AMEngine)
+
+def test_router(registry):
+    router = registry.get("auto")
+    assert isinstance(router, RouterEngine)
+    assert router.engines == [registry.get("gpt_4o"), registry.get("ds_chat")]
+    assert router.hedge_after == 2.0
+
+def test_unknown_engine(registry):
+    with pytest.raises(KeyError, match="unknown engine 'gpt_5'"):
+        registry.get("gpt_5")
+
+def test_missing_environment_variable(registry, monkeypatch):
+    monkeypatch.delenv("TEST_DEEPSEEK_API_KEY")
+    with pytest.raises(RuntimeError, match="TEST_DEEPSEEK_API_KEY"):
+        registry.get("ds_chat")
+    # a router fails the same way and is not kept half-built
+    with pytest.raises(RuntimeError):
+        registry.get("auto")
+    monkeypatch.setenv("TEST_DEEPSEEK_API_KEY", "sk-test")
+    assert isinstance(registry.get("auto"), RouterEngine)
+
+def test_cassette_swaps_in_replay_engines(registry, tmp_path, monkeypatch):
+    monkeypatch.setenv("LLM_CASSETTE", str(tmp_path / "cassette.json"))
+    # replay mode never talks to a provider, its variables are not needed
+    monkeypatch.delenv("TEST_OPENAI_API_KEY")
+    engine = registry.get("gpt_4o")
+    assert isinstance(engine, ReplayEngine)
+    assert engine.mode == "replay" and engine.engine is None
+    assert isinstance(registry.get("tts"), ReplayAMEngine)
+    assert registry.get("gpt_4o_lookup").cassette is engine.cassette
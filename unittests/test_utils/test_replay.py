@@ -0,0 +1,101 @@
+import sys, os
+sys.path.append(os.path.abspath("."))
+
+import time, asyncio
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+from utils.general import LLMEngine, AMEngine
+from utils.cache import AudioCache
+from utils.replay import (
+    Cassette,
+    ReplayEngine,
+    ReplayMissError,
+    CassetteServer
+)
+
+class FakeEngine:
+    model = "gpt-4o"
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate(self, prompt=None, sys_prompt=None, few_shots=[], *args, **kwargs):
+        self.calls += 1
+        return f"answer to {prompt}"
+
+    async def async_generate(self, prompt=None, sys_prompt=None, few_shots=[], *args, **kwargs):
+        return self.generate(prompt, sys_prompt, few_shots, *args, **kwargs)
+
+@pytest.fixture
+def cassette(tmp_path):
+    cassette = Cassette(tmp_path / "cassette.json")
+    recorder = ReplayEngine("gpt-4o", cassette, FakeEngine(), mode="record")
+    recorder.generate("apple", sys_prompt="dictionary", temperature=0)
+    asyncio.run(recorder.async_generate("banana", sys_prompt="dictionary"))
+    return cassette
+
+def test_replay(cassette):
+    engine = ReplayEngine("gpt-4o", Cassette(cassette.path), latency=0.05)
+    started = time.monotonic()
+    assert engine.generate("apple", sys_prompt="dictionary", temperature=0, use_cache=False) == "answer to apple"
+    assert time.monotonic() - started >= 0.05
+    assert asyncio.run(engine.async_generate("banana", sys_prompt="dictionary")) == "answer to banana"
+    with pytest.raises(ReplayMissError):
+        engine.generate("apple", sys_prompt="dictionary", temperature=1)
+
+def test_auto_records_misses(cassette):
+    fake = FakeEngine()
+    engine = ReplayEngine("gpt-4o", cassette, fake, mode="auto")
+    engine.generate("apple", sys_prompt="dictionary", temperature=0)
+    engine.generate("cherry")
+    assert fake.calls == 1
+    assert ReplayEngine("gpt-4o", Cassette(cassette.path)).generate("cherry") == "answer to cherry"
+
+def test_server(cassette):
+    server = CassetteServer(cassette, port=0).start()
+    try:
+        engine = LLMEngine("gpt-4o", "sk-replay", server.base_url)
+        assert engine.generate("apple", sys_prompt="dictionary", temperature=0) == "answer to apple"
+        assert asyncio.run(engine.async_client.chat.completions.create(
+            model="gpt-4o",
+            messages=[{"role": "system", "content": "dictionary"}, {"role": "user", "content": "banana"}]
+        )).choices[0].message.content == "answer to banana"
+    finally:
+        server.stop()
+
+def test_stream_speech(cassette, tmp_path, monkeypatch):
+    monkeypatch.setattr(AMEngine, "audio_cache", AudioCache(tmp_path / "audio"))
+    audio = bytes(range(256)) * 64
+    cassette.put_speech(Cassette.speech_key("tts-1", "alloy", "apple"), audio)
+    server = CassetteServer(cassette, port=0).start()
+    try:
+        engine = AMEngine("tts-1", "sk-replay", server.base_url)
+        name, chunks = engine.stream("apple", "alloy", chunk_size=1024)
+        assert b"".join(chunks) == audio
+        # the streamed clip is served from the cache afterwards
+        assert engine.stream("apple", "alloy") == (name, None)
+        assert AMEngine.audio_cache.path(name).read_bytes() == audio
+    finally:
+        server.stop()
+
+def test_stream_speech_single_flight(cassette, tmp_path, monkeypatch):
+    monkeypatch.setattr(AMEngine, "audio_cache", AudioCache(tmp_path / "audio"))
+    audio = bytes(range(256)) * 64
+    cassette.put_speech(Cassette.speech_key("tts-1", "alloy", "apple"), audio)
+    requests = []
+    get_speech = cassette.get_speech
+    monkeypatch.setattr(cassette, "get_speech", lambda key: requests.append(key) or get_speech(key))
+    server = CassetteServer(cassette, port=0).start()
+    try:
+        engine = AMEngine("tts-1", "sk-replay", server.base_url)
+        name, chunks = engine.stream("apple", "alloy", chunk_size=1024)
+        follower = ThreadPoolExecutor(max_workers=1).submit(engine.stream, "apple", "alloy")
+        time.sleep(0.1)
+        # the follower waits for the leader's stream instead of asking the provider again
+        assert not follower.done()
+        assert b"".join(chunks) == audio
+        assert follower.result(timeout=1) == (name, None)
+        assert len(requests) == 1
+    finally:
+        server.stop()
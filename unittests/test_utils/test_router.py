@@ -0,0 +1,94 @@
+import sys, os
+sys.path.append(os.path.abspath("."))
+
+import time, asyncio
+import pytest
+
+from utils.router import RouterEngine, CircuitBreaker
+
+class FakeEngine:
+    def __init__(self, model: str, delay: float, response: str | Exception):
+        self.model = model
+        self.delay = delay
+        self.response = response
+        self.calls = 0
+
+    def __answer(self):
+        self.calls += 1
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+    def generate(self, prompt=None, sys_prompt=None, few_shots=[], *args, **kwargs):
+        time.sleep(self.delay)
+        return self.__answer()
+
+    async def async_generate(self, prompt=None, sys_prompt=None, few_shots=[], *args, **kwargs):
+        await asyncio.sleep(self.delay)
+        return self.__answer()
+
+    def close(self):
+        pass
+
+def test_primary_answers():
+    fast = FakeEngine("fast", 0.01, "fast")
+    backup = FakeEngine("backup", 0.01, "backup")
+    router = RouterEngine([fast, backup], hedge_after=1.0)
+    assert router.generate("hi") == "fast"
+    assert backup.calls == 0
+
+def test_hedge_on_slow_primary():
+    slow = FakeEngine("slow", 1.0, "slow")
+    backup = FakeEngine("backup", 0.01, "backup")
+    router = RouterEngine([slow, backup], hedge_after=0.05)
+    started = time.monotonic()
+    assert router.generate("hi") == "backup"
+    assert time.monotonic() - started < 0.5
+    assert asyncio.run(router.async_generate("hi")) == "backup"
+
+def test_fallback_and_breaker():
+    broken = FakeEngine("broken", 0, RuntimeError("down"))
+    backup = FakeEngine("backup", 0, "backup")
+    router = RouterEngine([broken, backup], hedge_after=1.0, failure_threshold=2, cooldown=60)
+    for _ in range(2):
+        assert router.generate("hi") == "backup"
+    assert router.stats()["broken"]["breaker"] == "open"
+    assert router.generate("hi") == "backup"
+    assert broken.calls == 2
+
+def test_invalid_answer_is_skipped():
+    empty = FakeEngine("empty", 0, "")
+    backup = FakeEngine("backup", 0, "backup")
+    router = RouterEngine([empty, backup], hedge_after=1.0)
+    assert asyncio.run(router.async_generate("hi")) == "backup"
+
+def test_timeout():
+    slow = FakeEngine("slow", 0.5, "slow")
+    router = RouterEngine([slow], timeout=0.05)
+    with pytest.raises(TimeoutError):
+        router.generate("hi")
+
+def test_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker(threshold=1, cooldown=0.05)
+    breaker.failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open"
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.allow() and breaker.allow()
+
+def test_unused_probe_is_released():
+    recovered = FakeEngine("recovered", 0, "recovered")
+    backup = FakeEngine("backup", 0, "backup")
+    router = RouterEngine([backup, recovered], hedge_after=1.0, failure_threshold=1, cooldown=0.05)
+    router.breakers[id(recovered)].failure()
+    time.sleep(0.06)
+    assert router.generate("hi") == "backup"
+    # the backup answered, recovered was never asked and can still be probed
+    assert router.breakers[id(recovered)].allow()
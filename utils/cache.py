@@ -0,0 +1,456 @@
+import os
+import json, time
+import sqlite3, hashlib
+import uuid
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import (
+    Dict, List, Iterable, Iterator, Callable, Any
+)
+from .logger import logger
+
+class ResponseCache:
+    """ Two level cache for LLM responses: an in-memory LRU in front of an on-disk SQLite table.
+    Entries are evicted when they are older than `ttl` seconds or when a level exceeds its size.
+    Expired rows are purged every `expiry_interval` seconds (or when the disk level is full),
+    not on every write, expired entries in between are never returned by `get`.
+    """
+    def __init__(self,
+                 path: str | Path = Path("cache") / "llm.sqlite3",
+                 max_memory_entries: int = 1024,
+                 max_disk_entries: int = 100000,
+                 ttl: float | None = 7 * 24 * 3600,
+                 expiry_interval: float = 600
+                 ):
+        self.path = Path(path)
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.expiry_interval = expiry_interval
+        self.hits = 0
+        self.misses = 0
+        self.__memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__conn = None
+        # rows on disk, counted once on connect and kept up to date by every write
+        self.__entries = 0
+        self.__expired_at = 0.0
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict], params: Dict[str, Any]) -> str:
+        payload = json.dumps(
+            {
+                "model": model,
+                "messages": messages,
+                "params": params
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def __connect(self) -> sqlite3.Connection:
+        if self.__conn is None:
+            if not os.path.exists(self.path.parent):
+                os.makedirs(self.path.parent)
+            self.__conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.__conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self.__conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self.__conn.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+            self.__entries = self.__conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            self.__conn.commit()
+        return self.__conn
+
+    def __expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def __remember(self, key: str, created: float, value: str):
+        self.__memory[key] = (created, value)
+        self.__memory.move_to_end(key)
+        while len(self.__memory) > self.max_memory_entries:
+            self.__memory.popitem(last=False)
+
+    def get(self, key: str) -> str | None:
+        with self.__lock:
+            entry = self.__memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if not self.__expired(created):
+                    self.__memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self.__memory.pop(key)
+            try:
+                conn = self.__connect()
+                row = conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value, created = row
+                    if not self.__expired(created):
+                        conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+                        conn.commit()
+                        self.__remember(key, created, value)
+                        self.hits += 1
+                        return value
+                    self.__entries -= conn.execute("DELETE FROM responses WHERE key = ?", (key,)).rowcount
+                    conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"ResponseCache.get() : an error occurred while attempting to read the disk cache: {self.path}", e)
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str):
+        if value is None:
+            return
+        now = time.time()
+        with self.__lock:
+            self.__remember(key, now, value)
+            try:
+                conn = self.__connect()
+                exists = conn.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now)
+                )
+                if not exists:
+                    self.__entries += 1
+                self.__evict(conn, now)
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"ResponseCache.set() : an error occurred while attempting to write the disk cache: {self.path}", e)
+
+    def __evict(self, conn: sqlite3.Connection, now: float):
+        full = self.__entries > self.max_disk_entries
+        if self.ttl is not None and (full or now - self.__expired_at > self.expiry_interval):
+            self.__entries -= conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,)).rowcount
+            self.__expired_at = now
+        if self.__entries > self.max_disk_entries:
+            self.__entries -= conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed ASC LIMIT ?)",
+                (self.__entries - self.max_disk_entries,)
+            ).rowcount
+
+    def clear(self) -> Dict[str, int]:
+        """ Removes every response, returns how many entries were freed """
+        with self.__lock:
+            self.__memory.clear()
+            freed = {"entries": 0}
+            try:
+                conn = self.__connect()
+                freed["entries"] = conn.execute("DELETE FROM responses").rowcount
+                conn.commit()
+                self.__entries = 0
+            except sqlite3.Error as e:
+                logger.error(f"ResponseCache.clear() : an error occurred while attempting to clear the disk cache: {self.path}", e)
+            return freed
+
+    def stats(self) -> Dict[str, int | float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+            "memory_entries": len(self.__memory),
+            "disk_entries": self.__entries
+        }
+
+    def close(self):
+        with self.__lock:
+            if self.__conn is not None:
+                self.__conn.close()
+                self.__conn = None
+
+
+class AudioCache:
+    """ Size-bounded cache of generated audio clips.
+    The clips live as files under `root`, a SQLite index maps each clip to its size and last access,
+    so lookups never scan the directory and the least recently played clips are evicted first
+    once the cache grows past `max_bytes` or `max_entries`.
+    Access times of hits are kept in memory and written in batches (every `flush_interval` seconds,
+    once `flush_size` clips were played, and before evicting), so a hit doesn't cost a write to the index.
+    A key is the file name of the clip, its extension is the audio format.
+    """
+    # response formats of the speech endpoint -> content types
+    formats = {
+        "mp3": "audio/mpeg",
+        "opus": "audio/ogg",
+        "aac": "audio/aac"
+    }
+
+    def __init__(self,
+                 root: str | Path = Path("cache") / "audio",
+                 max_bytes: int = 1024 * 1024 * 1024,
+                 max_entries: int = 50000,
+                 flush_interval: float = 60,
+                 flush_size: int = 256
+                 ):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__lock = threading.Lock()
+        self.__conn = None
+        self.__entries = 0
+        self.__bytes = 0
+        # key -> last access not written to the index yet
+        self.__accessed: Dict[str, float] = {}
+        self.__flushed_at = time.monotonic()
+
+    @staticmethod
+    def make_key(model: str, voice: str, text: str, response_format: str = "mp3") -> str:
+        if response_format not in AudioCache.formats:
+            raise ValueError(f"AudioCache : unsupported audio format: {response_format}")
+        tag = f"[{model}] [{voice}] : {text}".encode("utf-8")
+        return f"audio[{hashlib.md5(tag).hexdigest()}].{response_format}"
+
+    @staticmethod
+    def mimetype(key: str) -> str:
+        return AudioCache.formats.get(key.rsplit(".", 1)[-1], "application/octet-stream")
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+    def __connect(self) -> sqlite3.Connection:
+        if self.__conn is None:
+            if not os.path.exists(self.root):
+                os.makedirs(self.root)
+            self.__conn = sqlite3.connect(self.root / "index.sqlite3", check_same_thread=False)
+            self.__conn.execute(
+                "CREATE TABLE IF NOT EXISTS clips ("
+                "key TEXT PRIMARY KEY, size INTEGER NOT NULL, etag TEXT, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self.__conn.execute("CREATE INDEX IF NOT EXISTS clips_accessed ON clips (accessed)")
+            self.__entries, self.__bytes = self.__conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM clips").fetchone()
+            if self.__entries == 0:
+                self.__adopt(self.__conn)
+            self.__conn.commit()
+        return self.__conn
+
+    def __adopt(self, conn: sqlite3.Connection):
+        # clips written before the index existed
+        rows = []
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith(".") and entry.name.rsplit(".", 1)[-1] in AudioCache.formats:
+                    stat = entry.stat()
+                    rows.append((entry.name, stat.st_size, stat.st_mtime, stat.st_atime))
+        if len(rows) > 0:
+            conn.executemany("INSERT OR REPLACE INTO clips (key, size, created, accessed) VALUES (?, ?, ?, ?)", rows)
+            self.__entries = len(rows)
+            self.__bytes = sum(row[1] for row in rows)
+            logger.info(f"AudioCache : indexed {len(rows)} existing clips in {self.root}")
+
+    def get(self, key: str) -> Path | None:
+        """ Returns the path of the cached clip, or None on a miss """
+        path = self.path(key)
+        with self.__lock:
+            try:
+                conn = self.__connect()
+                row = conn.execute("SELECT size FROM clips WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    if os.path.exists(path):
+                        self.__accessed[key] = time.time()
+                        if len(self.__accessed) >= self.flush_size or time.monotonic() - self.__flushed_at >= self.flush_interval:
+                            self.__flush(conn)
+                            conn.commit()
+                        self.hits += 1
+                        return path
+                    # the file was removed behind our back
+                    self.__drop(conn, key, row[0])
+                    conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"AudioCache.get() : an error occurred while attempting to read the index: {self.root}", e)
+            self.misses += 1
+            return None
+
+    def __flush(self, conn: sqlite3.Connection):
+        if len(self.__accessed) > 0:
+            conn.executemany("UPDATE clips SET accessed = ? WHERE key = ?", [(accessed, key) for key, accessed in self.__accessed.items()])
+            self.__accessed.clear()
+        self.__flushed_at = time.monotonic()
+
+    def __temp(self, key: str) -> Path:
+        with self.__lock:
+            self.__connect()
+        return self.root / f".{key}.{uuid.uuid4().hex}.tmp"
+
+    @staticmethod
+    def __digest(path: Path) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 16), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def __commit(self, key: str, tmp: Path) -> Path:
+        path = self.path(key)
+        size = os.path.getsize(tmp)
+        etag = AudioCache.__digest(tmp)
+        os.replace(tmp, path)
+        now = time.time()
+        with self.__lock:
+            try:
+                conn = self.__connect()
+                row = conn.execute("SELECT size FROM clips WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self.__entries -= 1
+                    self.__bytes -= row[0]
+                conn.execute(
+                    "INSERT OR REPLACE INTO clips (key, size, etag, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, size, etag, now, now)
+                )
+                self.__entries += 1
+                self.__bytes += size
+                self.__accessed.pop(key, None)
+                if self.__bytes > self.max_bytes or self.__entries > self.max_entries:
+                    # evict by up-to-date access times
+                    self.__flush(conn)
+                self.__evict(conn, keep=key)
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"AudioCache.put() : an error occurred while attempting to write the index: {self.root}", e)
+        return path
+
+    def put(self, key: str, write: Callable[[Path], Any]) -> Path:
+        """ `write(tmp_path)` writes the clip to a temporary file, which is then renamed into place,
+        so readers never see a partially written clip.
+        """
+        tmp = self.__temp(key)
+        try:
+            write(tmp)
+            return self.__commit(key, tmp)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def tee(self, key: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """ Yields `chunks` while writing them to the cache.
+        The clip is only committed once the whole stream went through, an interrupted stream leaves nothing behind.
+        """
+        tmp = self.__temp(key)
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            self.__commit(key, tmp)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def etag(self, key: str) -> str | None:
+        """ Hash of the clip's content, None if the clip is not cached """
+        with self.__lock:
+            try:
+                conn = self.__connect()
+                row = conn.execute("SELECT etag FROM clips WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                if row[0] is None:
+                    # clips adopted from before the index existed are hashed on first use
+                    etag = AudioCache.__digest(self.path(key))
+                    conn.execute("UPDATE clips SET etag = ? WHERE key = ?", (etag, key))
+                    conn.commit()
+                    return etag
+                return row[0]
+            except (sqlite3.Error, OSError) as e:
+                logger.error(f"AudioCache.etag() : an error occurred while attempting to read the index: {self.root}", e)
+                return None
+
+    def put_bytes(self, key: str, data: bytes) -> Path:
+        def write(tmp: Path):
+            with open(tmp, "wb") as f:
+                f.write(data)
+        return self.put(key, write)
+
+    def __drop(self, conn: sqlite3.Connection, key: str, size: int):
+        conn.execute("DELETE FROM clips WHERE key = ?", (key,))
+        self.__accessed.pop(key, None)
+        self.__entries -= 1
+        self.__bytes -= size
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def __evict(self, conn: sqlite3.Connection, keep: str):
+        while self.__bytes > self.max_bytes or self.__entries > self.max_entries:
+            rows = conn.execute(
+                "SELECT key, size FROM clips WHERE key != ? ORDER BY accessed ASC LIMIT 64", (keep,)
+            ).fetchall()
+            if len(rows) == 0:
+                break
+            for key, size in rows:
+                if self.__bytes <= self.max_bytes and self.__entries <= self.max_entries:
+                    break
+                self.__drop(conn, key, size)
+                self.evictions += 1
+
+    def remove(self, key: str):
+        with self.__lock:
+            try:
+                conn = self.__connect()
+                row = conn.execute("SELECT size FROM clips WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self.__drop(conn, key, row[0])
+                    conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"AudioCache.remove() : an error occurred while attempting to write the index: {self.root}", e)
+
+    def clear(self) -> Dict[str, int]:
+        """ Removes every clip, returns how many clips and bytes were freed """
+        with self.__lock:
+            freed = {"entries": 0, "bytes": 0}
+            try:
+                conn = self.__connect()
+                freed = {"entries": self.__entries, "bytes": self.__bytes}
+                for (key, ) in conn.execute("SELECT key FROM clips").fetchall():
+                    try:
+                        os.remove(self.path(key))
+                    except FileNotFoundError:
+                        pass
+                conn.execute("DELETE FROM clips")
+                conn.commit()
+                self.__accessed.clear()
+                self.__entries = 0
+                self.__bytes = 0
+            except sqlite3.Error as e:
+                logger.error(f"AudioCache.clear() : an error occurred while attempting to clear the cache: {self.root}", e)
+            return freed
+
+    def stats(self) -> Dict[str, int | float]:
+        with self.__lock:
+            try:
+                self.__connect()
+            except sqlite3.Error:
+                pass
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total > 0 else 0.0,
+                "evictions": self.evictions,
+                "entries": self.__entries,
+                "bytes": self.__bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries
+            }
+
+    def close(self):
+        with self.__lock:
+            if self.__conn is not None:
+                try:
+                    self.__flush(self.__conn)
+                    self.__conn.commit()
+                except sqlite3.Error as e:
+                    logger.error(f"AudioCache.close() : an error occurred while attempting to write the index: {self.root}", e)
+                self.__conn.close()
+                self.__conn = None
@@ -0,0 +1,196 @@
+import asyncio, threading
+from concurrent.futures import Future
+from typing import (
+    List, Dict, Tuple, Callable, Awaitable, Iterator, Any
+)
+
+class _Call:
+    def __init__(self, future: asyncio.Future | None = None):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        # set when the leader is a coroutine, callers on its loop await it instead of blocking a thread
+        self.future = future
+
+
+class _Stream:
+    """ Iterator over `chunks` that calls `done` once, when it is exhausted, fails or is closed """
+    def __init__(self, chunks: Iterator[Any], done: Callable[[], None]):
+        self.__chunks = chunks
+        self.__done = done
+
+    def __iter__(self) -> '_Stream':
+        return self
+
+    def __next__(self) -> Any:
+        try:
+            return next(self.__chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self.__done is None:
+            return
+        try:
+            if hasattr(self.__chunks, "close"):
+                self.__chunks.close()
+        finally:
+            done, self.__done = self.__done, None
+            done()
+
+
+class SingleFlight:
+    """ Coalesces identical calls that are in flight at the same time.
+    The first caller of a key runs the function, everyone who asks for the same key
+    before it finishes waits and gets the same result (or exception).
+    `do`, `do_stream` and `async_do` share one table, a key is in flight once whichever of them leads it.
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__calls: Dict[str, _Call] = {}
+
+    def in_flight(self) -> int:
+        with self.__lock:
+            return len(self.__calls)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """ Returns (result, shared), `shared` is True if the result came from another caller.
+        The shared result is None when the key was led by `do_stream`.
+        """
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.__calls[key] = call
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.__lock:
+                self.__calls.pop(key, None)
+            call.event.set()
+
+    def do_stream(self, key: str, fn: Callable[[], Iterator[Any]]) -> Iterator[Any] | None:
+        """ `do` for a stream: the first caller gets the iterator of `fn()` and the key stays in flight
+        until it is exhausted or closed. Callers that ask meanwhile wait for that and get None,
+        whether the stream went through or not is for them to check.
+        """
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.__calls[key] = call
+        if not leader:
+            call.event.wait()
+            return None
+        def done():
+            with self.__lock:
+                self.__calls.pop(key, None)
+            call.event.set()
+        try:
+            return _Stream(fn(), done)
+        except BaseException:
+            done()
+            raise
+
+    async def async_do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        loop = asyncio.get_running_loop()
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call(loop.create_future())
+                self.__calls[key] = call
+        if not leader:
+            # futures can only be awaited from the loop they belong to,
+            # a leader on another loop or thread is waited for off the loop
+            if call.future is not None and call.future.get_loop() is loop:
+                return await asyncio.shield(call.future), True
+            await asyncio.to_thread(call.event.wait)
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = await fn()
+            call.future.set_result(call.result)
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            if isinstance(e, asyncio.CancelledError):
+                call.future.cancel()
+            else:
+                call.future.set_exception(e)
+                # nobody may be waiting, don't let asyncio complain about an unretrieved exception
+                call.future.exception()
+            raise
+        finally:
+            with self.__lock:
+                self.__calls.pop(key, None)
+            call.event.set()
+
+
+class BackgroundLoop:
+    """ One long-lived event loop on a daemon thread.
+    All async engine work is submitted here, so the AsyncClient connection pools
+    stay bound to a single loop and keep-alive connections are reused across requests.
+    """
+    def __init__(self, name: str = "clara-loop"):
+        self.name = name
+        self.__loop: asyncio.AbstractEventLoop | None = None
+        self.__thread: threading.Thread | None = None
+        self.__lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self.__lock:
+            if self.__loop is None or self.__loop.is_closed():
+                self.__loop = asyncio.new_event_loop()
+                self.__thread = threading.Thread(target=self.__loop.run_forever, name=self.name, daemon=True)
+                self.__thread.start()
+            return self.__loop
+
+    def in_loop(self) -> bool:
+        return self.__thread is not None and threading.current_thread() is self.__thread
+
+    def submit(self, coro: Awaitable[Any]) -> Future:
+        """ Thread-safe, returns a concurrent.futures.Future """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Awaitable[Any], timeout: float | None = None) -> Any:
+        """ Blocks the calling thread until `coro` is done on the background loop """
+        if self.in_loop():
+            coro.close()
+            raise RuntimeError("BackgroundLoop.run() : can't block the background loop on itself, await the coroutine instead")
+        return self.submit(coro).result(timeout)
+
+    def gather(self, coros: List[Awaitable[Any]], timeout: float | None = None) -> List[Any]:
+        """ Runs `coros` concurrently, exceptions are returned in place of results like asyncio.gather(return_exceptions=True) """
+        if len(coros) == 0:
+            return []
+        async def _gather():
+            return await asyncio.gather(*coros, return_exceptions=True)
+        return self.run(_gather(), timeout)
+
+    def stop(self):
+        with self.__lock:
+            if self.__loop is None:
+                return
+            self.__loop.call_soon_threadsafe(self.__loop.stop)
+            self.__thread.join()
+            self.__loop.close()
+            self.__loop = None
+            self.__thread = None
+
+
+background_loop = BackgroundLoop()
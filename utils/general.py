@@ -1,14 +1,24 @@
 import os
-import json
+import json, time
+import asyncio, inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+import yaml
 from pathlib import Path
+from collections.abc import Mapping
 from dotenv import load_dotenv, find_dotenv
 from openai import (
     Client, AsyncClient
 )
 from typing_extensions import (
-    List, Dict, Tuple
+    List, Dict, Tuple, Iterator
 )
 from .logger import logger
+from .cache import ResponseCache, AudioCache
+from .limiter import get_limiter, estimate_tokens
+from .router import RouterEngine
+from .metrics import telemetry, Telemetry, Span
+from .concurrency import SingleFlight, background_loop
 
 class Prompt:
     def __init__(self, template: str, parameters: dict):
@@ -28,18 +38,31 @@ class Prompt:
         return result
 
 class LLMEngine:
-    def __init__(self, model: str, api_key: str, base_url: str):
+    # tool calls of every chat share one bounded pool
+    tool_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="tool")
+    # seconds a tool call may take, a sync tool that runs over keeps its worker until it returns
+    tool_timeout = 120.0
+    # identical requests in flight at the same time share one provider call
+    flights = SingleFlight()
+
+    def __init__(self, model: str, api_key: str, base_url: str, cache: ResponseCache | None = None):
         self.model = model
+        self.cache = cache
+        # retries are handled by the limiter shared with every engine of the same provider
+        self.limiter = get_limiter(base_url)
         self.client = Client(
             api_key=api_key,
-            base_url=base_url
+            base_url=base_url,
+            max_retries=0
         )
         self.async_client = AsyncClient(
             api_key=api_key,
-            base_url=base_url
+            base_url=base_url,
+            max_retries=0
         )
         
-    def __pack_message(self, prompt: str | Prompt | None = None, sys_prompt: str | Prompt | None = None, few_shots: List[Dict] = []) -> List[Dict]:
+    @staticmethod
+    def pack_message(prompt: str | Prompt | None = None, sys_prompt: str | Prompt | None = None, few_shots: List[Dict] = []) -> List[Dict]:
         messages = []
         if sys_prompt:
             messages.append(
@@ -65,31 +88,118 @@ class LLMEngine:
         
         return messages
         
+    @staticmethod
+    def request_key(model: str, messages: List[Dict], params: Dict) -> str:
+        params = {k: v for k, v in params.items() if k not in ["timeout", "stream", "stream_options"]}
+        return ResponseCache.make_key(model, messages, params)
+
     def generate(self, prompt: str | Prompt | None = None, sys_prompt: str | Prompt | None = None, few_shots: List[Dict] = [],
-                 *args, **kwargs) -> str:
-        messages = self.__pack_message(
+                 *args, use_cache: bool = True, coalesce: bool = True, **kwargs) -> str:
+        """ `use_cache=False` skips the response cache, `coalesce=False` always sends a request of its own
+        instead of sharing the answer of an identical request in flight.
+        """
+        messages = LLMEngine.pack_message(
             prompt=prompt,
             sys_prompt=sys_prompt,
             few_shots=few_shots
         )
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            *args, **kwargs
-        ).choices[0].message.content
+        key = LLMEngine.request_key(self.model, messages, kwargs)
+        use_cache = use_cache and self.cache is not None
+        with telemetry.track("LLMEngine.generate", self.model) as span:
+            if use_cache:
+                response = self.cache.get(key)
+                if response is not None:
+                    span.outcome = "cache_hit"
+                    logger.info(f"LLMEngine.generate() [{self.model}] : cache hit : {response}")
+                    return response
+            request = lambda: self.limiter.call(
+                lambda: self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    *args, **kwargs
+                ),
+                tokens=estimate_tokens(messages, kwargs.get("max_tokens"))
+            )
+            if coalesce:
+                completion, shared = LLMEngine.flights.do(key, request)
+            else:
+                completion, shared = request(), False
+            if shared:
+                span.outcome = "coalesced"
+            else:
+                span.add_usage(completion.usage)
+        response = completion.choices[0].message.content
         logger.info(f"LLMEngine.generate() [{self.model}] : {response}")
+        if use_cache and not shared:
+            self.cache.set(key, response)
         return response
     
-    def chat(self, messages: List[Dict], sys_prompt: str | Prompt | None = "", toolset: Tuple[List, Dict] = ([], {}), *args, **kwargs) -> str:
-        sys_prompt = sys_prompt.value() if isinstance(sys_prompt, Prompt) else sys_prompt
+    def __run_tool(self, functions: Dict, name: str, arguments: str, timeout: float) -> str:
+        try:
+            logger.info(f"LLMEngine.chat() [{self.model}] : function call : {name}, parameters : {arguments}")
+            func = functions[name]
+            params = json.loads(arguments or "{}")
+            if inspect.iscoroutinefunction(func):
+                result = background_loop.run(asyncio.wait_for(func(**params), timeout))
+            else:
+                result = func(**params)
+            logger.info(f"Result : {result}")
+        except Exception as e:
+            result = str(e)
+            logger.error(f"LLMEngine.chat() [{self.model}] : one error occurred while attempting to call function {name}", e)
+        return str(result)
+
+    def __call_tools(self, tool_calls: List[Dict], functions: Dict, timeouts: Dict[str, float] = {}) -> List[Dict]:
+        """ Runs the tool calls of one turn concurrently, results keep the order of `tool_calls` """
+        futures = []
+        for tool_call in tool_calls:
+            func = tool_call["function"]
+            timeout = timeouts.get(func["name"], LLMEngine.tool_timeout)
+            future = Telemetry.submit(LLMEngine.tool_executor, self.__run_tool, functions, func["name"], func["arguments"], timeout)
+            futures.append((tool_call, future, time.monotonic() + timeout))
+        results = []
+        for tool_call, future, deadline in futures:
+            try:
+                result = future.result(timeout=max(0, deadline - time.monotonic()))
+            except FuturesTimeoutError:
+                future.cancel()
+                result = f"Function {tool_call['function']['name']} timed out."
+                logger.error(f"LLMEngine.chat() [{self.model}] : function call {tool_call['function']['name']} timed out")
+            results.append(
+                {
+                    "role": "tool",
+                    "tool_call_id": tool_call["id"],
+                    "content": result
+                }
+            )
+        return results
+
+    def __complete(self, messages: List[Dict], tools: List, *args, **kwargs):
+        return self.limiter.call(
+            lambda: self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                tools=tools,
+                *args, **kwargs
+            ),
+            tokens=estimate_tokens(messages, kwargs.get("max_tokens"))
+        )
+
+    def chat(self, messages: List[Dict], sys_prompt: str | Prompt | None = "", toolset: Tuple[List, Dict] = ([], {}),
+             *args, stream: bool = False, tool_timeouts: Dict[str, float] = {}, **kwargs) -> str | Iterator[Dict]:
+        sys_prompt = sys_prompt.value if isinstance(sys_prompt, Prompt) else sys_prompt
+        if stream:
+            return self.__chat_stream(messages, sys_prompt, toolset, tool_timeouts, *args, **kwargs)
+        with telemetry.track("LLMEngine.chat", self.model) as span:
+            return self.__chat(messages, sys_prompt, toolset, tool_timeouts, span, *args, **kwargs)
+
+    def __chat(self, messages: List[Dict], sys_prompt: str | None, toolset: Tuple[List, Dict], tool_timeouts: Dict[str, float],
+               span: Span, *args, **kwargs) -> str:
         tools, functions = toolset
         prefix = [{"role": "system", "content": sys_prompt}]
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=prefix + messages,
-            tools=tools,
-            *args, **kwargs
-        ).choices[0].message
+        completion = self.__complete(prefix + messages, tools, *args, **kwargs)
+        span.add_usage(completion.usage)
+        response = completion.choices[0].message
         while response.tool_calls:
             tool_calls = [
                 {
@@ -108,29 +218,10 @@ class LLMEngine:
                     "tool_calls": tool_calls
                 }
             )
-            for tool_call in response.tool_calls:
-                call_id = tool_call.id
-                func = tool_call.function
-                try:
-                    logger.info(f"LLMEngine.chat() [{self.model}] : function call : {func.name}, parameters : {func.arguments}")
-                    result = functions[func.name](**json.loads(func.arguments))
-                    logger.info(f"Result : {result}")
-                except Exception as e:
-                    result = str(e)
-                    logger.error(f"LLMEngine.chat() [{self.model}] : one error occurred while attempting to call function {func}", e)
-                messages.append(
-                    {
-                        "role": "tool",
-                        "tool_call_id": call_id,
-                        "content": str(result)
-                    }
-                )
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=prefix + messages,
-                tools=tools,
-                *args, **kwargs
-            ).choices[0].message
+            messages.extend(self.__call_tools(tool_calls, functions, tool_timeouts))
+            completion = self.__complete(prefix + messages, tools, *args, **kwargs)
+            span.add_usage(completion.usage)
+            response = completion.choices[0].message
         messages.append(
             {
                 "role": "assistant",
@@ -140,157 +231,364 @@ class LLMEngine:
         
         logger.info(f"LLMEngine.chat() [{self.model}] : {response.content}")
         return response.content
+
+    def __chat_stream(self, messages: List[Dict], sys_prompt: str | None, toolset: Tuple[List, Dict], tool_timeouts: Dict[str, float],
+                      *args, **kwargs) -> Iterator[Dict]:
+        """ Streaming version of `chat`, yields events:
+            {"type": "delta", "content": str}                      a piece of the assistant's reply
+            {"type": "tool_call", "id": str, "name": str, "arguments": str}
+            {"type": "tool_result", "id": str, "content": str}
+            {"type": "done", "content": str}                       the whole final reply
+        `messages` is extended exactly as in the blocking mode.
+        """
+        with telemetry.track("LLMEngine.chat", self.model) as span:
+            yield from self.__chat_events(messages, sys_prompt, toolset, tool_timeouts, span, *args, **kwargs)
+
+    def __chat_events(self, messages: List[Dict], sys_prompt: str | None, toolset: Tuple[List, Dict], tool_timeouts: Dict[str, float],
+                      span: Span, *args, **kwargs) -> Iterator[Dict]:
+        tools, functions = toolset
+        prefix = [{"role": "system", "content": sys_prompt}]
+        while True:
+            chunks = self.__complete(prefix + messages, tools, *args, stream=True, stream_options={"include_usage": True}, **kwargs)
+            content = ""
+            pending = {}
+            for chunk in chunks:
+                span.mark_first_byte()
+                span.add_usage(chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content += delta.content
+                    yield {"type": "delta", "content": delta.content}
+                for tool_call in delta.tool_calls or []:
+                    call = pending.setdefault(
+                        tool_call.index,
+                        {"id": "", "type": "function", "function": {"name": "", "arguments": ""}}
+                    )
+                    if tool_call.id:
+                        call["id"] = tool_call.id
+                    if tool_call.function is not None:
+                        call["function"]["name"] += tool_call.function.name or ""
+                        call["function"]["arguments"] += tool_call.function.arguments or ""
+            if len(pending) == 0:
+                break
+            tool_calls = [pending[idx] for idx in sorted(pending)]
+            messages.append(
+                {
+                    "role": "assistant",
+                    "content": content,
+                    "tool_calls": tool_calls
+                }
+            )
+            for tool_call in tool_calls:
+                yield {
+                    "type": "tool_call",
+                    "id": tool_call["id"],
+                    "name": tool_call["function"]["name"],
+                    "arguments": tool_call["function"]["arguments"]
+                }
+            results = self.__call_tools(tool_calls, functions, tool_timeouts)
+            messages.extend(results)
+            for result in results:
+                yield {"type": "tool_result", "id": result["tool_call_id"], "content": result["content"]}
+        messages.append(
+            {
+                "role": "assistant",
+                "content": content
+            }
+        )
+        logger.info(f"LLMEngine.chat() [{self.model}] : {content}")
+        yield {"type": "done", "content": content}
     
     async def async_generate(self, prompt: str | Prompt | None = None, sys_prompt: str | Prompt | None = None, few_shots: List[Dict] = [],
-                             *args, **kwargs) -> str:
-        messages = self.__pack_message(
+                             *args, use_cache: bool = True, coalesce: bool = True, **kwargs) -> str:
+        messages = LLMEngine.pack_message(
             prompt=prompt,
             sys_prompt=sys_prompt,
             few_shots=few_shots
         )
-        response = (await self.async_client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            *args, **kwargs
-        )).choices[0].message.content
+        key = LLMEngine.request_key(self.model, messages, kwargs)
+        use_cache = use_cache and self.cache is not None
+        with telemetry.track("LLMEngine.async_generate", self.model) as span:
+            if use_cache:
+                response = self.cache.get(key)
+                if response is not None:
+                    span.outcome = "cache_hit"
+                    logger.info(f"LLMEngine.async_generate() [{self.model}] : cache hit : {response}")
+                    return response
+            request = lambda: self.limiter.async_call(
+                lambda: self.async_client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    *args, **kwargs
+                ),
+                tokens=estimate_tokens(messages, kwargs.get("max_tokens"))
+            )
+            if coalesce:
+                completion, shared = await LLMEngine.flights.async_do(key, request)
+            else:
+                completion, shared = await request(), False
+            if shared:
+                span.outcome = "coalesced"
+            else:
+                span.add_usage(completion.usage)
+        response = completion.choices[0].message.content
         logger.info(f"LLMEngine.async_generate() [{self.model}] : {response}")
+        if use_cache and not shared:
+            self.cache.set(key, response)
         return response
 
     def close(self):
         self.client.close()
-        self.async_client.close()
+        # the async connection pool lives on the background loop, it has to be closed there
+        background_loop.run(self.async_client.close())
 
-from playsound import playsound
-import hashlib
+load_dotenv(find_dotenv())
 
 class AMEngine:
     cache_path = Path("cache") / "audio"
+    audio_cache = AudioCache(
+        cache_path,
+        max_bytes=int(os.getenv("AUDIO_CACHE_MAX_MB", 1024)) * 1024 * 1024,
+        max_entries=int(os.getenv("AUDIO_CACHE_MAX_ENTRIES", 50000))
+    )
+    flights = SingleFlight()
 
     def __init__(self, model: str, api_kay: str, base_url):
+        self.limiter = get_limiter(base_url)
         self.client = Client(
             api_key=api_kay,
-            base_url=base_url
+            base_url=base_url,
+            max_retries=0
         )
         self.async_client = AsyncClient(
             api_key=api_kay,
-            base_url=base_url
+            base_url=base_url,
+            max_retries=0
         )
         self.model = model
 
-    def generate(self, text: str, voice: str) -> str:
+    def generate(self, text: str, voice: str, response_format: str = "mp3") -> str:
         logger.info(f"text: {text}, voice: {voice}")
-        tag = f"[{voice}] : {text}".encode('utf-8')
-        name = f"audio[{hashlib.md5(tag).hexdigest()}]"
-        filename = f"{name}.mp3"
-        if not os.path.exists(AMEngine.cache_path):
-            os.makedirs(AMEngine.cache_path)
-        path = self.cache_path / filename
-        if os.path.exists(path):
-            return name
-        response = self.client.audio.speech.create(
-            model=self.model,
-            voice=voice,
-            input=text
-        )
-        response.write_to_file(path)
+        name = AudioCache.make_key(self.model, voice, text, response_format)
+        with telemetry.track("AMEngine.generate", self.model) as span:
+            if AMEngine.audio_cache.get(name) is not None:
+                span.outcome = "cache_hit"
+                return name
+            def synthesize():
+                response = self.limiter.call(
+                    lambda: self.client.audio.speech.create(
+                        model=self.model,
+                        voice=voice,
+                        input=text,
+                        response_format=response_format
+                    )
+                )
+                span.mark_first_byte()
+                return AMEngine.audio_cache.put(name, response.write_to_file)
+            # concurrent requests for the same clip share one provider call,
+            # whether it was started by generate, async_generate or stream
+            path, shared = AMEngine.flights.do(name, synthesize)
+            if shared:
+                span.outcome = "coalesced"
+                if path is None and AMEngine.audio_cache.get(name) is None:
+                    # the clip was streamed to someone else and the stream was interrupted
+                    path, _ = AMEngine.flights.do(name, synthesize)
         logger.info(f"AMEngine.generate() : an audio file was successfully generated: {str(path)}")
         
         return name
 
-    async def async_generate(self, text: str, voice: str, timeout: int = None) -> str:
+    async def async_generate(self, text: str, voice: str, timeout: int = None, response_format: str = "mp3") -> str:
         logger.info(f"text: {text}, voice: {voice}")
-        tag = f"[{voice}] : {text}".encode('utf-8')
-        name = f"audio[{hashlib.md5(tag).hexdigest()}]"
-        filename = f"{name}.mp3"
-        if not os.path.exists(AMEngine.cache_path):
-            os.makedirs(AMEngine.cache_path)
-        path = self.cache_path / filename
-        if os.path.exists(path):
-            return name
-        response = await self.async_client.audio.speech.create(
-            model=self.model,
-            voice=voice,
-            input=text,
-            timeout=timeout
-        )
-        response.write_to_file(path)
+        name = AudioCache.make_key(self.model, voice, text, response_format)
+        with telemetry.track("AMEngine.async_generate", self.model) as span:
+            if AMEngine.audio_cache.get(name) is not None:
+                span.outcome = "cache_hit"
+                return name
+            async def synthesize():
+                response = await self.limiter.async_call(
+                    lambda: self.async_client.audio.speech.create(
+                        model=self.model,
+                        voice=voice,
+                        input=text,
+                        response_format=response_format,
+                        timeout=timeout
+                    )
+                )
+                span.mark_first_byte()
+                # writing the file would block every other coroutine on the loop
+                return await asyncio.to_thread(AMEngine.audio_cache.put, name, response.write_to_file)
+            path, shared = await AMEngine.flights.async_do(name, synthesize)
+            if shared:
+                span.outcome = "coalesced"
+                if path is None and AMEngine.audio_cache.get(name) is None:
+                    # the clip was streamed to someone else and the stream was interrupted
+                    path, _ = await AMEngine.flights.async_do(name, synthesize)
         logger.info(f"AMEngine.async_generate() : an audio file was successfully generated: {str(path)}")
         
         return name
-        
+
+    def stream(self, text: str, voice: str, chunk_size: int = 4096, response_format: str = "mp3") -> Tuple[str, Iterator[bytes] | None]:
+        """ Returns (name, chunks), `chunks` is None when the clip is already cached.
+        Otherwise the audio is passed on chunk by chunk as the provider synthesizes it,
+        and the clip is added to the cache once the stream is complete.
+        Requests for a clip that is being streamed or generated for someone else wait for it and get the cached clip.
+        """
+        logger.info(f"text: {text}, voice: {voice}")
+        name = AudioCache.make_key(self.model, voice, text, response_format)
+        if AMEngine.audio_cache.get(name) is not None:
+            with telemetry.track("AMEngine.stream", self.model) as span:
+                span.outcome = "cache_hit"
+            return name, None
+        chunks = AMEngine.flights.do_stream(
+            name,
+            lambda: AMEngine.audio_cache.tee(name, self.__stream(text, voice, chunk_size, response_format))
+        )
+        if chunks is not None:
+            return name, chunks
+        with telemetry.track("AMEngine.stream", self.model) as span:
+            span.outcome = "coalesced"
+        if AMEngine.audio_cache.get(name) is None:
+            # the leader's stream was interrupted or its generation failed
+            self.generate(text, voice, response_format)
+        return name, None
+
+    def __stream(self, text: str, voice: str, chunk_size: int, response_format: str) -> Iterator[bytes]:
+        with telemetry.track("AMEngine.stream", self.model) as span:
+            manager = self.client.audio.speech.with_streaming_response.create(
+                model=self.model,
+                voice=voice,
+                input=text,
+                response_format=response_format
+            )
+            response = self.limiter.call(manager.__enter__)
+            try:
+                for chunk in response.iter_bytes(chunk_size):
+                    span.mark_first_byte()
+                    yield chunk
+            finally:
+                manager.__exit__(None, None, None)
+        logger.info(f"AMEngine.stream() : an audio stream was successfully delivered, voice: {voice}, text: {text}")
+
     @staticmethod
     def play(name: str):
-        path = AMEngine.cache_path / f"{name}.mp3"
+        path = AMEngine.audio_cache.path(name)
         try:
+            from playsound import playsound
             playsound(path)
         except Exception as e:
             logger.error(f"AMEgine : An error occurred when play the mp3 file: {path}")
 
-load_dotenv(find_dotenv())
+class EngineRegistry:
+    """ Builds the engines declared in `config/setting/engines.yml` the first time they are requested """
+    def __init__(self, config_path: str | Path = Path("config") / "setting" / "engines.yml"):
+        self.config_path = Path(config_path)
+        self.__config = None
+        self.__engines = {}
+        self.__lock = threading.RLock()
+        self.__cache = None
+        self.__cassette = None
 
-openai_api_key = os.environ["OPENAI_API_KEY"]
-base_url = os.environ["OPENAI_BASE_URL"]
+    @property
+    def config(self) -> Dict:
+        if self.__config is None:
+            with open(self.config_path) as f:
+                self.__config = yaml.safe_load(f)
+        return self.__config
 
-deepseek_api_kay = os.environ["DEEPSEEK_API_KEY"]
-deepseek_base_url = os.environ["DEEPSEEK_BASE_URL"]
+    @property
+    def cache(self) -> ResponseCache | None:
+        # set LLM_CACHE=off to send every request to the provider
+        if os.environ.get("LLM_CACHE", "on").lower() in ["off", "0", "false"]:
+            return None
+        if self.__cache is None:
+            self.__cache = ResponseCache()
+        return self.__cache
 
-gpt_3_5 = LLMEngine(
-    model="gpt-3.5-turbo",
-    api_key=openai_api_key,
-    base_url=base_url
-)
+    def names(self) -> List[str]:
+        return list(self.config["engines"])
 
-gpt_4o = LLMEngine(
-    model="gpt-4o",
-    api_key=openai_api_key,
-    base_url=base_url
-)
+    def __provider(self, name: str) -> Tuple[str, str]:
+        provider = self.config["providers"][name]
+        values = []
+        for key in ["api_key", "base_url"]:
+            value = os.environ.get(provider[key])
+            if value is None:
+                raise RuntimeError(f"EngineRegistry : environment variable {provider[key]} of provider '{name}' is not set")
+            values.append(value)
+        return tuple(values)
 
-gpt_4o_mini = LLMEngine(
-    model="gpt-4o-mini",
-    api_key=openai_api_key,
-    base_url=base_url
-)
+    def __build(self, name: str) -> 'LLMEngine | AMEngine | RouterEngine':
+        if name not in self.config["engines"]:
+            raise KeyError(f"EngineRegistry : unknown engine '{name}'")
+        spec = self.config["engines"][name]
+        if spec["type"] == "router":
+            return RouterEngine([self.get(sub) for sub in spec["engines"]], **spec.get("options", {}))
+        if os.environ.get("LLM_CASSETTE"):
+            return self.__build_replay(spec)
+        return self.__build_real(spec)
 
-o1_mini = LLMEngine(
-    model="o1-mini",
-    api_key=openai_api_key,
-    base_url=base_url
-)
+    def __build_replay(self, spec: Dict) -> 'ReplayEngine | ReplayAMEngine':
+        """ LLM_CASSETTE=<path> swaps every engine for a record/replay one, LLM_REPLAY_MODE is replay, record or auto """
+        from .replay import Cassette, ReplayEngine, ReplayAMEngine
+        if self.__cassette is None:
+            self.__cassette = Cassette(os.environ["LLM_CASSETTE"])
+        mode = os.environ.get("LLM_REPLAY_MODE", "replay")
+        latency = float(os.environ.get("LLM_REPLAY_LATENCY", 0))
+        engine = self.__build_real(spec) if mode != "replay" else None
+        replay_class = ReplayEngine if spec["type"] == "llm" else ReplayAMEngine
+        return replay_class(spec["model"], self.__cassette, engine, mode, latency)
 
-ds_chat = LLMEngine(
-    model="deepseek-chat",
-    api_key=deepseek_api_kay,
-    base_url=deepseek_base_url
-)
+    def __build_real(self, spec: Dict) -> 'LLMEngine | AMEngine':
+        api_key, base_url = self.__provider(spec["provider"])
+        if spec["type"] == "llm":
+            return LLMEngine(
+                model=spec["model"],
+                api_key=api_key,
+                base_url=base_url,
+                cache=self.cache if spec.get("cache", False) else None
+            )
+        if spec["type"] == "tts":
+            return AMEngine(
+                model=spec["model"],
+                api_kay=api_key,
+                base_url=base_url
+            )
+        raise RuntimeError(f"EngineRegistry : unknown engine type '{spec['type']}' of model '{spec['model']}'")
 
-ds_reasoner = LLMEngine(
-    model="deepseek-reasoner",
-    api_key=deepseek_api_kay,
-    base_url=deepseek_base_url
-)
+    def get(self, name: str) -> 'LLMEngine | AMEngine | RouterEngine':
+        with self.__lock:
+            if name not in self.__engines:
+                self.__engines[name] = self.__build(name)
+                logger.info(f"EngineRegistry.get() : engine '{name}' was built")
+            return self.__engines[name]
 
-tts = AMEngine(
-    model="tts-1",
-    api_kay=openai_api_key,
-    base_url=base_url
-)
+    def warm(self, names: List[str] | None = None):
+        for name in names if names is not None else self.names():
+            self.get(name)
 
-tts_hd = AMEngine(
-    model="tts-1-hd",
-    api_kay=openai_api_key,
-    base_url=base_url
-)
 
-tts_hd_1106 = AMEngine(
-    model="tts-1-hd-1106",
-    api_kay=openai_api_key,
-    base_url=base_url
-)
+class EngineList(Mapping):
+    """ Read-only view of the `engine_list` section, engines are built on access """
+    def __init__(self, registry: EngineRegistry):
+        self.__registry = registry
+
+    def __getitem__(self, key: str):
+        return self.__registry.get(self.__registry.config["engine_list"][key])
+
+    def __iter__(self):
+        return iter(self.__registry.config["engine_list"])
+
+    def __len__(self):
+        return len(self.__registry.config["engine_list"])
+
+
+registry = EngineRegistry()
+engine_list = EngineList(registry)
 
-engine_list = {
-    "gpt-3.5-turbo": gpt_3_5,
-    "gpt-4o": gpt_4o,
-    "deepseek-v3": ds_chat,
-    "deepseek-r1": ds_reasoner
-}
\ No newline at end of file
+def __getattr__(name: str):
+    # keeps `from utils.general import gpt_4o` working without building every engine on import
+    if not name.startswith("__") and name in registry.config["engines"]:
+        return registry.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
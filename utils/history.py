@@ -0,0 +1,43 @@
+import os, threading
+from collections import OrderedDict
+from typing import (
+    List, Dict
+)
+
+class ChatHistories:
+    """ Chat histories kept on the server, keyed by the chat id stored in the session cookie.
+    The cookie only carries the id, so a client can't rewrite what the planner sees,
+    and a streamed reply can be stored after the response headers are gone.
+    The least recently used histories are dropped past `max_chats`.
+    """
+    def __init__(self, max_chats: int = 1024):
+        self.max_chats = max_chats
+        self.__lock = threading.Lock()
+        self.__histories: OrderedDict[str, List[Dict]] = OrderedDict()
+
+    def get(self, chat_id: str) -> List[Dict]:
+        """ A copy of the history, the planner appends to it while answering """
+        with self.__lock:
+            history = self.__histories.get(chat_id)
+            if history is None:
+                return []
+            self.__histories.move_to_end(chat_id)
+            return list(history)
+
+    def append(self, chat_id: str, messages: List[Dict]):
+        with self.__lock:
+            self.__histories.setdefault(chat_id, []).extend(messages)
+            self.__histories.move_to_end(chat_id)
+            while len(self.__histories) > self.max_chats:
+                self.__histories.popitem(last=False)
+
+    def clear(self, chat_id: str):
+        with self.__lock:
+            self.__histories.pop(chat_id, None)
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return len(self.__histories)
+
+
+chat_histories = ChatHistories(int(os.environ.get("CHAT_MAX_HISTORIES", 1024)))
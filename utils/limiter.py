@@ -0,0 +1,207 @@
+import os
+import time, random
+import asyncio, threading
+from urllib.parse import urlparse
+from typing import (
+    Dict, Callable, Awaitable, Any
+)
+from openai import RateLimitError
+from .logger import logger
+
+class RateLimiter:
+    """ Concurrency cap plus request/token buckets shared by every engine talking to one provider.
+    The effective rate shrinks by half on every 429 and slowly grows back on success (AIMD),
+    and all callers pause until the provider's `Retry-After` has passed.
+    """
+    def __init__(self,
+                 name: str,
+                 max_concurrency: int = 8,
+                 rpm: float = 500,
+                 tpm: float = 200000,
+                 max_retries: int = 5,
+                 base_delay: float = 1.0,
+                 max_delay: float = 60.0
+                 ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.scale = 1.0
+        self.in_flight = 0
+        self.waiting = 0
+        self.__requests = float(max_concurrency)
+        self.__tokens = float(tpm) / 60
+        self.__refilled = time.monotonic()
+        self.__blocked_until = 0.0
+        self.__cond = threading.Condition()
+
+    @property
+    def queue_depth(self) -> int:
+        return self.waiting
+
+    def __refill(self, now: float):
+        elapsed = now - self.__refilled
+        self.__refilled = now
+        # bursts are capped at one second of traffic, the buckets never fill beyond that
+        rps = self.rpm * self.scale / 60
+        tps = self.tpm * self.scale / 60
+        self.__requests = min(max(rps, 1.0), self.__requests + elapsed * rps)
+        self.__tokens = min(max(tps, 1.0), self.__tokens + elapsed * tps)
+
+    def __try_acquire(self, tokens: int) -> float:
+        """ Returns 0 if a slot was taken, otherwise the number of seconds to wait before trying again """
+        now = time.monotonic()
+        self.__refill(now)
+        if now < self.__blocked_until:
+            return self.__blocked_until - now
+        if self.in_flight >= self.max_concurrency:
+            return 0.05
+        rps = self.rpm * self.scale / 60
+        tps = self.tpm * self.scale / 60
+        # a single request may be larger than the bucket, it only has to wait for a full bucket
+        tokens = min(tokens, max(tps, 1.0))
+        if self.__requests < 1:
+            return (1 - self.__requests) / rps
+        if self.__tokens < tokens:
+            return (tokens - self.__tokens) / tps
+        self.__requests -= 1
+        self.__tokens -= tokens
+        self.in_flight += 1
+        return 0
+
+    def acquire(self, tokens: int = 0):
+        with self.__cond:
+            self.waiting += 1
+            try:
+                while True:
+                    wait = self.__try_acquire(tokens)
+                    if wait == 0:
+                        return
+                    self.__cond.wait(timeout=wait)
+            finally:
+                self.waiting -= 1
+
+    async def async_acquire(self, tokens: int = 0):
+        with self.__cond:
+            self.waiting += 1
+        try:
+            while True:
+                with self.__cond:
+                    wait = self.__try_acquire(tokens)
+                if wait == 0:
+                    return
+                await asyncio.sleep(wait)
+        finally:
+            with self.__cond:
+                self.waiting -= 1
+
+    def release(self, estimated: int = 0, used: int | None = None):
+        with self.__cond:
+            self.in_flight -= 1
+            if used is not None:
+                # give back (or take) the difference between the estimate and the real usage
+                self.__tokens += estimated - used
+            self.__cond.notify_all()
+
+    def on_success(self):
+        with self.__cond:
+            self.scale = min(1.0, self.scale + 0.05)
+
+    def on_rate_limited(self, attempt: int, retry_after: float | None) -> float:
+        with self.__cond:
+            self.scale = max(0.1, self.scale / 2)
+            delay = retry_after if retry_after is not None else min(self.max_delay, self.base_delay * 2 ** attempt)
+            delay *= random.uniform(1.0, 1.5)
+            self.__blocked_until = max(self.__blocked_until, time.monotonic() + delay)
+            self.__cond.notify_all()
+        logger.warning(f"RateLimiter [{self.name}] : rate limited, retry in {delay:.2f}s (scale = {self.scale:.2f})")
+        return delay
+
+    @staticmethod
+    def __retry_after(e: RateLimitError) -> float | None:
+        try:
+            return float(e.response.headers.get("retry-after"))
+        except Exception:
+            return None
+
+    @staticmethod
+    def __usage(result: Any) -> int | None:
+        usage = getattr(result, "usage", None)
+        return getattr(usage, "total_tokens", None)
+
+    def call(self, fn: Callable[[], Any], tokens: int = 0) -> Any:
+        attempt = 0
+        while True:
+            self.acquire(tokens)
+            try:
+                result = fn()
+            except RateLimitError as e:
+                self.release(tokens)
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self.on_rate_limited(attempt, RateLimiter.__retry_after(e)))
+                attempt += 1
+                continue
+            except Exception:
+                self.release(tokens)
+                raise
+            self.release(tokens, RateLimiter.__usage(result))
+            self.on_success()
+            return result
+
+    async def async_call(self, fn: Callable[[], Awaitable[Any]], tokens: int = 0) -> Any:
+        attempt = 0
+        while True:
+            await self.async_acquire(tokens)
+            try:
+                result = await fn()
+            except RateLimitError as e:
+                self.release(tokens)
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self.on_rate_limited(attempt, RateLimiter.__retry_after(e)))
+                attempt += 1
+                continue
+            except Exception:
+                self.release(tokens)
+                raise
+            self.release(tokens, RateLimiter.__usage(result))
+            self.on_success()
+            return result
+
+    def stats(self) -> Dict[str, int | float]:
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "scale": self.scale,
+            "rpm": self.rpm * self.scale,
+            "tpm": self.tpm * self.scale
+        }
+
+
+def estimate_tokens(messages: list, max_tokens: int | None = None) -> int:
+    # ~4 characters per token for English, plus the completion budget
+    chars = sum(len(str(message.get("content") or "")) for message in messages)
+    return chars // 4 + (max_tokens if max_tokens is not None else 256)
+
+
+limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(base_url: str | None) -> RateLimiter:
+    """ One limiter per provider host, shared by every engine that uses it.
+    Limits can be tuned with LLM_MAX_CONCURRENCY, LLM_RPM and LLM_TPM.
+    """
+    host = urlparse(base_url or "").netloc or "default"
+    with _limiters_lock:
+        if host not in limiters:
+            limiters[host] = RateLimiter(
+                name=host,
+                max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", 8)),
+                rpm=float(os.environ.get("LLM_RPM", 500)),
+                tpm=float(os.environ.get("LLM_TPM", 200000))
+            )
+        return limiters[host]
@@ -0,0 +1,220 @@
+import os, sys
+import json, time
+import threading, contextvars
+from pathlib import Path
+from concurrent.futures import Executor, Future
+from collections import deque, Counter
+from typing import (
+    Dict, List, Tuple, Callable, Any
+)
+
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+TOKEN_BUCKETS = [64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768]
+
+class Histogram:
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        idx = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                idx = i
+                break
+        self.counts[idx] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float | None:
+        """ Upper bound of the bucket holding the q-quantile """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, cnt in enumerate(self.counts):
+            seen += cnt
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count > 0 else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": {
+                str(bound): cnt for bound, cnt in zip(self.buckets + ["+Inf"], self.counts)
+            }
+        }
+
+
+class Stat:
+    """ Aggregate of all the calls sharing one (operation, model, caller) """
+    def __init__(self):
+        self.outcomes = Counter()
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.ttfb = Histogram(LATENCY_BUCKETS)
+        self.tokens = Histogram(TOKEN_BUCKETS)
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "outcomes": dict(self.outcomes),
+            "latency": self.latency.to_dict(),
+            "ttfb": self.ttfb.to_dict(),
+            "tokens": self.tokens.to_dict(),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens
+        }
+
+
+class Span:
+    """ One LLM or TTS call, see Telemetry.track """
+    def __init__(self, telemetry: 'Telemetry', operation: str, model: str, caller: str):
+        self.telemetry = telemetry
+        self.operation = operation
+        self.model = model
+        self.caller = caller
+        self.outcome = "ok"
+        self.started = time.perf_counter()
+        self.first_byte = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+
+    def mark_first_byte(self):
+        if self.first_byte is None:
+            self.first_byte = time.perf_counter() - self.started
+
+    def add_usage(self, usage: Any):
+        if usage is None:
+            return
+        self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+        self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.cached_tokens += getattr(details, "cached_tokens", 0) or 0
+
+    def __enter__(self) -> 'Span':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        latency = time.perf_counter() - self.started
+        if exc_type is not None:
+            self.outcome = exc_type.__name__
+        # a non-streaming response arrives all at once
+        ttfb = self.first_byte if self.first_byte is not None else latency
+        self.telemetry.record(self, latency, ttfb)
+        return False
+
+
+class Telemetry:
+    """ In-process aggregation of the latency and token usage of every engine call """
+    # frames from these files are engine plumbing, not callers
+    internal = [
+        str(Path(__file__).parent / name)
+        for name in ["general.py", "metrics.py", "router.py", "limiter.py", "cache.py", "replay.py", "concurrency.py"]
+    ]
+    # caller of the thread that handed the work to a pool, see Telemetry.submit
+    submitter: contextvars.ContextVar[str | None] = contextvars.ContextVar("submitter", default=None)
+
+    def __init__(self, recent: int = 1000):
+        self.__stats: Dict[Tuple[str, str, str], Stat] = {}
+        self.__recent = deque(maxlen=recent)
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def find_caller() -> str:
+        frame = sys._getframe(1)
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if (filename not in Telemetry.internal and "asyncio" not in filename
+                    and "concurrent" not in filename and "threading" not in filename):
+                owner = frame.f_locals.get("self", None)
+                name = frame.f_code.co_name
+                if owner is not None:
+                    return f"{type(owner).__name__}.{name}"
+                module = os.path.splitext(os.path.basename(filename))[0]
+                return f"{module}.{name}"
+            frame = frame.f_back
+        # only plumbing on the stack, the call runs on a pool thread
+        return Telemetry.submitter.get() or "unknown"
+
+    @staticmethod
+    def submit(executor: Executor, fn: Callable, *args, **kwargs) -> Future:
+        """ `executor.submit`, the spans of `fn` are attributed to the caller of the submitting thread """
+        context = contextvars.copy_context()
+        context.run(Telemetry.submitter.set, Telemetry.find_caller())
+        return executor.submit(context.run, fn, *args, **kwargs)
+
+    def track(self, operation: str, model: str) -> Span:
+        return Span(self, operation, model, Telemetry.find_caller())
+
+    def record(self, span: Span, latency: float, ttfb: float):
+        with self.__lock:
+            key = (span.operation, span.model, span.caller)
+            if key not in self.__stats:
+                self.__stats[key] = Stat()
+            stat = self.__stats[key]
+            stat.outcomes[span.outcome] += 1
+            stat.latency.observe(latency)
+            stat.ttfb.observe(ttfb)
+            total = span.prompt_tokens + span.completion_tokens
+            if total > 0:
+                stat.tokens.observe(total)
+            stat.prompt_tokens += span.prompt_tokens
+            stat.completion_tokens += span.completion_tokens
+            stat.cached_tokens += span.cached_tokens
+            self.__recent.append(
+                {
+                    "time": time.time(),
+                    "operation": span.operation,
+                    "model": span.model,
+                    "caller": span.caller,
+                    "outcome": span.outcome,
+                    "latency": latency,
+                    "ttfb": ttfb,
+                    "prompt_tokens": span.prompt_tokens,
+                    "completion_tokens": span.completion_tokens,
+                    "cached_tokens": span.cached_tokens
+                }
+            )
+
+    def export(self, recent: bool = False) -> Dict[str, Any]:
+        with self.__lock:
+            data = {
+                "stats": [
+                    {
+                        "operation": operation,
+                        "model": model,
+                        "caller": caller,
+                        **stat.to_dict()
+                    } for (operation, model, caller), stat in self.__stats.items()
+                ]
+            }
+            if recent:
+                data["recent"] = list(self.__recent)
+        return data
+
+    def export_json(self, path: str | Path | None = None, recent: bool = False) -> str:
+        json_str = json.dumps(self.export(recent), indent=2)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(json_str)
+        return json_str
+
+    def reset(self):
+        with self.__lock:
+            self.__stats.clear()
+            self.__recent.clear()
+
+
+telemetry = Telemetry()
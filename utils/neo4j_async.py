@@ -0,0 +1,312 @@
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import (
+    List, Tuple, Dict,
+    Literal, Callable, Awaitable, AsyncIterator, Any
+)
+import neo4j
+from shortuuid import uuid
+from .neo4j_orm import (
+    Graph, Node, Relationship, IdentityMap
+)
+from .logger import logger
+
+class AsyncGraph:
+    """ Mirror of Graph on the asyncio Neo4j driver, every query method is a coroutine.
+    Queries, allow-lists and pool settings are the ones of Graph, the schema is bootstrapped by Graph.
+    The driver belongs to the event loop it is first used on, use one AsyncGraph per loop
+    (in this app, the one of utils.concurrency.background_loop).
+    There is no unit of work here, `update()` and `destroy()` write right away.
+    """
+    def __init__(
+            self,
+            uri: str,
+            auth: Tuple[str, str],
+            database: str | None = None,
+            **config
+        ):
+        self.database = database or os.environ.get("NEO4J_DATABASE")
+        self.__driver = neo4j.AsyncGraphDatabase.driver(
+            uri=uri,
+            auth=auth,
+            **{**Graph.driver_config(), **config}
+        )
+        # (task, session) of the running task, like Graph's per-thread session.
+        # Child tasks inherit the context, the task tells them the session isn't theirs
+        self.__session: ContextVar[Tuple[asyncio.Task, neo4j.AsyncSession] | None] = ContextVar(f"neo4j_session_{id(self)}", default=None)
+
+    async def close(self):
+        await self.__driver.close()
+
+    @asynccontextmanager
+    async def session(self):
+        """ See Graph.session, an AsyncSession can't be used by concurrent tasks:
+        tasks started inside the block (e.g. by asyncio.gather) open their own
+        """
+        task = asyncio.current_task()
+        current = self.__session.get()
+        if current is not None and current[0] is task:
+            yield current[1]
+            return
+        async with self.__driver.session(database=self.database) as session:
+            token = self.__session.set((task, session))
+            try:
+                yield session
+            finally:
+                self.__session.reset(token)
+
+    @staticmethod
+    def _run(query: str, parameters: Dict[str, Any] = {}) -> Callable[[neo4j.AsyncManagedTransaction], Awaitable[List[neo4j.Record]]]:
+        async def work(tx: neo4j.AsyncManagedTransaction) -> List[neo4j.Record]:
+            result = await tx.run(query, parameters)
+            return [record async for record in result]
+        return work
+
+    async def _read(self, work: Callable[[neo4j.AsyncManagedTransaction], Awaitable[Any]]) -> Any:
+        async with self.session() as session:
+            return await session.execute_read(work)
+
+    async def _write(self, work: Callable[[neo4j.AsyncManagedTransaction], Awaitable[Any]]) -> Any:
+        async with self.session() as session:
+            return await session.execute_write(work)
+
+    def _unit(self) -> None:
+        return None
+
+    async def create_node(
+            self,
+            label: str | None = None,
+            properties: Dict[str, str | int | float] = {},
+        ) -> 'AsyncNode':
+        query = Graph._create_node_query(Graph.node_labels_of(label))
+        if "m_id" not in properties:
+            properties["m_id"] = uuid()
+        await self._write(AsyncGraph._run(query, {"properties": properties}))
+        return AsyncNode._create(graph=self, m_id=properties["m_id"], label=label, properties=properties)
+
+    async def match_node(
+            self,
+            m_id: str | None = None,
+            label: str | None = None,
+            properties: Dict = {},
+            order: Tuple[str, Literal["ASC", "DESC"]] | None = None,
+            skip: int | None = None,
+            limit: int | None = None
+        ) -> List['AsyncNode']:
+        query, parameters = Graph._match_node_statement(m_id, label, properties, order, skip, limit)
+        try:
+            return [AsyncNode._load(self, record["p"]) for record in await self._read(AsyncGraph._run(query, parameters))]
+        except Exception as e:
+            logger.error(f"AsyncGraph.match_node() : an error occurred while attempting to match nodes : {parameters}", e)
+        return []
+
+    async def page_nodes(
+            self,
+            label: str | None = None,
+            properties: Dict = {},
+            order: Tuple[str, Literal["ASC", "DESC"]] | None = None,
+            cursor: Dict[str, Any] | None = None,
+            limit: int | None = None
+        ) -> Tuple[List['AsyncNode'], Dict[str, Any] | None]:
+        query, parameters, order, limit = Graph._page_nodes_statement(label, properties, order, cursor, limit)
+        nodes = [AsyncNode._load(self, record["p"]) for record in await self._read(AsyncGraph._run(query, parameters))]
+        return nodes[:limit], Graph._next_cursor(nodes, order, limit)
+
+    async def iter_nodes(
+            self,
+            label: str | None = None,
+            properties: Dict = {},
+            order: Tuple[str, Literal["ASC", "DESC"]] | None = None,
+            fetch_size: int | None = None
+        ) -> AsyncIterator['AsyncNode']:
+        cursor = None
+        while True:
+            nodes, cursor = await self.page_nodes(label, properties, order, cursor, fetch_size)
+            for node in nodes:
+                yield node
+            if cursor is None:
+                return
+
+    async def refresh(self, node: 'AsyncNode') -> bool:
+        records = await self._read(AsyncGraph._run(Graph.MATCH_NODE_BY_ID, {"m_id": node.m_id}))
+        if len(records) == 0:
+            AsyncNode.nodes.evict(node.m_id)
+            node._alive = False
+            return False
+        AsyncNode._load(self, records[0]["p"])
+        return True
+
+    async def _update_node(
+            self,
+            m_id: str,
+            new_label: str,
+            new_properties: Dict = {},
+            removed_properties: List[str] = []
+        ):
+        await self._write(AsyncGraph._run(Graph.UPDATE_NODE, Graph._update_node_parameters(m_id, new_label, new_properties, removed_properties)))
+
+    async def _delete_node(
+            self,
+            m_id: str
+        ):
+        await self._write(AsyncGraph._run(Graph.DELETE_NODE, {"m_id": m_id}))
+
+    async def create_nodes(
+            self,
+            nodes: List[Tuple[str | None, Dict[str, str | int | float]]],
+            batch_size: int | None = None
+        ) -> List['AsyncNode']:
+        """ See Graph.create_nodes, all the batches are written in one transaction """
+        batch_size = batch_size or Graph.batch_size
+        groups = [(Graph._create_nodes_query(labels), rows) for labels, rows in Graph._node_groups(nodes).items()]
+        async def work(tx: neo4j.AsyncManagedTransaction):
+            for query, rows in groups:
+                for batch in Graph._batches(rows, batch_size):
+                    await (await tx.run(query, {"rows": batch})).consume()
+        await self._write(work)
+        return [
+            AsyncNode._create(graph=self, m_id=properties["m_id"], label=label, properties=properties)
+            for label, properties in nodes
+        ]
+
+    async def create_relas(
+            self,
+            relas: List[Tuple[Tuple[str, str], str, Dict[str, str | int | float]]],
+            batch_size: int | None = None
+        ) -> List['AsyncRelationship']:
+        batch_size = batch_size or Graph.batch_size
+        created = set()
+        async with self.session():
+            for label, rows in Graph._rela_groups(relas).items():
+                query = Graph._create_relas_query(label)
+                for batch in Graph._batches(rows, batch_size):
+                    records = await self._write(AsyncGraph._run(query, {"rows": batch}))
+                    created.update(record["r_id"] for record in records)
+        return [
+            AsyncRelationship._create(graph=self, r_id=properties["r_id"], pos=pos, label=label, properties=properties)
+            for pos, label, properties in relas if properties["r_id"] in created
+        ]
+
+    async def _create_rela(
+            self,
+            pos: Tuple[str, str],
+            label: str,
+            properties: Dict[str, str | int | float]
+        ) -> 'AsyncRelationship':
+        query, parameters = Graph._create_rela_statement(pos, label, properties)
+        await self._write(AsyncGraph._run(query, parameters))
+        return AsyncRelationship._create(graph=self, r_id=properties["r_id"], pos=pos, label=label, properties=properties)
+
+    async def match(
+            self,
+            from_prop: Dict[str, str | int | float] = {},
+            to_prop: Dict[str, str | int | float] = {},
+            rela_prop: Dict[str, str | int | float] = {},
+            bidirect: bool = False
+        ) -> List[Tuple['AsyncNode', 'AsyncRelationship', 'AsyncNode']]:
+        query, parameters = Graph._match_statement(from_prop, to_prop, rela_prop, bidirect)
+        return [
+            (AsyncNode._load(self, record["p"]), AsyncRelationship._load(self, record["r"]), AsyncNode._load(self, record["q"]))
+            for record in await self._read(AsyncGraph._run(query, parameters))
+        ]
+
+    async def match_subgraph(
+            self,
+            m_ids: List[str],
+            expand: Tuple[str, ...] | None = (),
+            to_label: str | None = None,
+            bidirect: bool = True
+        ) -> Dict[str, Tuple['AsyncNode', List[Tuple['AsyncRelationship', 'AsyncNode']]]]:
+        query, parameters = Graph._subgraph_statement(m_ids, expand, to_label, bidirect)
+        subgraph = {}
+        for record in await self._read(AsyncGraph._run(query, parameters)):
+            node = AsyncNode._load(self, record["p"])
+            subgraph[node.m_id] = (node, [(AsyncRelationship._load(self, r), AsyncNode._load(self, q)) for r, q in record["expanded"]])
+        return subgraph
+
+    async def update_rela(
+            self,
+            r_id: str,
+            pos: Tuple[str, str],
+            new_properties: Dict[str, str | int | float]
+        ):
+        from_m_id, to_m_id = pos
+        parameters = {
+            "r_id": r_id,
+            "from_m_id": from_m_id,
+            "to_m_id": to_m_id,
+            "new_properties": new_properties
+        }
+        await self._write(AsyncGraph._run(Graph.UPDATE_RELA, parameters))
+
+    async def _delete_rela(
+            self,
+            r_id: str,
+            pos: Tuple[str, str]
+        ):
+        from_m_id, to_m_id = pos
+        parameters = {
+            "r_id": r_id,
+            "from_m_id": from_m_id,
+            "to_m_id": to_m_id
+        }
+        await self._write(AsyncGraph._run(Graph.DELETE_RELA, parameters))
+
+
+class AsyncNode(Node):
+    """ Node of an AsyncGraph, reading and changing properties is the same as Node,
+    the methods that talk to the graph are coroutines
+    """
+    __slots__ = ()
+    # separate from Node.nodes, an m_id may be loaded by both graphs
+    nodes = IdentityMap(int(os.environ.get("NEO4J_IDENTITY_MAP_SIZE", 10000)))
+
+    async def refresh(self) -> bool:
+        return await self._graph.refresh(self)
+
+    @Node.ensure_alive
+    async def update(self):
+        await self._graph._update_node(
+            m_id=self.m_id,
+            new_label=self.label,
+            new_properties=self._new_properties,
+            removed_properties=self._removed_properties
+        )
+        self._new_properties = {}
+        self._removed_properties = []
+
+    @Node.ensure_alive
+    async def create_rela(self, to: Node, label: str, properties: Dict[str, str | int | float]) -> 'AsyncRelationship':
+        assert to._alive
+        return await self._graph._create_rela(
+            pos=(self.m_id, to.m_id),
+            label=label,
+            properties=properties
+        )
+
+    @Node.ensure_alive
+    async def _destroy(self):
+        await self._graph._delete_node(self.m_id)
+        self._alive = False
+
+
+class AsyncRelationship(Relationship):
+    __slots__ = ()
+
+    @Relationship.ensure_alive
+    async def update(self):
+        await self._graph.update_rela(
+            r_id=self.r_id,
+            pos=self.pos,
+            new_properties=self._new_properties
+        )
+
+    @Relationship.ensure_alive
+    async def destroy(self):
+        await self._graph._delete_rela(
+            r_id=self.r_id,
+            pos=self.pos
+        )
+        self._alive = False
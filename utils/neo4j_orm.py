@@ -1,51 +1,408 @@
-import json, re
+import os, sys
+import json, re, base64
+import time, threading, weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
 from typing import (
-    List, Tuple, Dict,
-    Literal
+    List, Tuple, Dict, NamedTuple,
+    Literal, Callable, Iterator, Any
 )
 import neo4j
 from shortuuid import uuid
+from .logger import logger
 
 class Graph:
+    # rows per UNWIND statement (and transaction) of the bulk writes
+    batch_size = int(os.environ.get("NEO4J_BATCH_SIZE", 1000))
+    # upper bound of the nodes read per page by page_nodes / iter_nodes
+    page_size = int(os.environ.get("NEO4J_PAGE_SIZE", 500))
+    # labels and keys are the only things spliced into the query text, they are checked against these allow-lists,
+    # every value is passed as a parameter, so the number of distinct queries is bounded and Neo4j reuses their plans
+    node_labels = {"memory", "word", "unfamiliar_word", "grammar", "image", "mistake", "topic", "weakness"}
+    rela_labels = {"relative", "synonyms", "antonyms", "derived", "display", "belong"}
+    identifier = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
     def __init__(
             self,
             uri: str,
-            auth: Tuple[str, str]
+            auth: Tuple[str, str],
+            bootstrap: bool = True,
+            database: str | None = None,
+            **config
         ):
+        """ `config` overrides the driver settings of Graph.driver_config() """
+        self.database = database or os.environ.get("NEO4J_DATABASE")
         self.__driver = neo4j.GraphDatabase.driver(
             uri=uri,
-            auth=auth
+            auth=auth,
+            **{**Graph.driver_config(), **config}
         )
+        self.__local = threading.local()
+        if bootstrap:
+            # constraints and indexes, see utils/neo4j_schema.py
+            from .neo4j_schema import bootstrap as _bootstrap
+            _bootstrap(self.__driver, database=self.database)
     
+    @staticmethod
+    def driver_config() -> Dict[str, int | float]:
+        """ Connection pool and timeout settings, from NEO4J_* environment variables """
+        return {
+            "max_connection_pool_size": int(os.environ.get("NEO4J_MAX_POOL_SIZE", 100)),
+            "max_connection_lifetime": float(os.environ.get("NEO4J_MAX_CONNECTION_LIFETIME", 3600)),
+            "connection_acquisition_timeout": float(os.environ.get("NEO4J_ACQUISITION_TIMEOUT", 60)),
+            "connection_timeout": float(os.environ.get("NEO4J_CONNECTION_TIMEOUT", 30)),
+            # how long execute_read / execute_write keep retrying transient errors
+            "max_transaction_retry_time": float(os.environ.get("NEO4J_MAX_RETRY_TIME", 30))
+        }
+
     @staticmethod
     def json_dumps(data: Dict[str, str | int | float]) -> str:
         json_str = json.dumps(data)
         json_str = re.sub(r'"\s*([^"]+)\s*"\s*:', r'\1:', json_str)
 
         return json_str
+
+    @staticmethod
+    def node_labels_of(label: str | None) -> str:
+        """ `label` -> "memory:label", the label has to be in Graph.node_labels """
+        if label is None or label == "memory":
+            return "memory"
+        if label not in Graph.node_labels:
+            raise ValueError(f"Graph : unknown node label '{label}', allowed labels: {sorted(Graph.node_labels)}")
+        return f"memory:{label}"
+
+    @staticmethod
+    def rela_label_of(label: str) -> str:
+        if label not in Graph.rela_labels:
+            raise ValueError(f"Graph : unknown relationship label '{label}', allowed labels: {sorted(Graph.rela_labels)}")
+        return label
+
+    @staticmethod
+    def key_of(key: str) -> str:
+        if not isinstance(key, str) or Graph.identifier.match(key) is None:
+            raise ValueError(f"Graph : invalid property key '{key}'")
+        return f"`{key}`"
+
+    @staticmethod
+    def _pattern(prefix: str, properties: Dict[str, str | int | float]) -> Tuple[Tuple[str, ...], Dict[str, str | int | float]]:
+        """ Splits a property filter into its (sorted) keys, which are part of the query template, and its parameters """
+        keys = tuple(sorted(properties))
+        for key in keys:
+            Graph.key_of(key)
+        return keys, {f"{prefix}_{key}": properties[key] for key in keys}
+
+    @staticmethod
+    def _map(prefix: str, keys: Tuple[str, ...]) -> str:
+        if len(keys) == 0:
+            return ""
+        return "{ " + ", ".join(f"{Graph.key_of(key)}: ${prefix}_{key}" for key in keys) + " }"
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _create_node_query(labels: str) -> str:
+        return (
+            f"CREATE (p:{labels} $properties)\n"
+        )
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _match_node_query(
+            labels: str,
+            keys: Tuple[str, ...],
+            order: Tuple[str, Literal["ASC", "DESC"]] | None,
+            skip: bool,
+            limit: bool
+        ) -> str:
+        query = (
+            f"MATCH (p:{labels} {Graph._map('p', keys)})\n"
+            f"RETURN p\n"
+        )
+        if order is not None:
+            _k, _m = order
+            if _m not in ["ASC", "DESC"]:
+                raise ValueError(f"Graph : invalid order '{_m}'")
+            query += f"ORDER BY p.{Graph.key_of(_k)} {_m}\n"
+        if skip:
+            query += "SKIP $skip\n"
+        if limit:
+            query += "LIMIT $limit\n"
+        return query
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _page_nodes_query(
+            labels: str,
+            keys: Tuple[str, ...],
+            order: Tuple[str, Literal["ASC", "DESC"]],
+            after: bool
+        ) -> str:
+        """ One page of a keyset pagination over (order key, m_id), m_id breaks the ties.
+        With `after`, the page starts right behind the node ($after_value, $after_m_id),
+        so the database seeks to it instead of counting the skipped rows.
+        """
+        _k, _m = order
+        if _m not in ["ASC", "DESC"]:
+            raise ValueError(f"Graph : invalid order '{_m}'")
+        key = Graph.key_of(_k)
+        op = "<" if _m == "DESC" else ">"
+        query = f"MATCH (p:{labels} {Graph._map('p', keys)})\n"
+        if _k == "m_id":
+            if after:
+                query += f"WHERE p.m_id {op} $after_m_id\n"
+            return query + f"RETURN p\nORDER BY p.m_id {_m}\nLIMIT $limit\n"
+        # nodes without the order key have no place in the order, they are left out
+        query += f"WHERE p.{key} IS NOT NULL\n"
+        if after:
+            query += f"AND (p.{key} {op} $after_value OR (p.{key} = $after_value AND p.m_id > $after_m_id))\n"
+        return query + f"RETURN p\nORDER BY p.{key} {_m}, p.m_id ASC\nLIMIT $limit\n"
+
+    @staticmethod
+    def encode_cursor(cursor: Dict[str, Any] | None) -> str | None:
+        """ Opaque continuation token of a page_nodes cursor """
+        if cursor is None:
+            return None
+        return base64.urlsafe_b64encode(json.dumps(cursor, separators=(",", ":")).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(token: str | None) -> Dict[str, Any] | None:
+        if token is None or token == "":
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(token.encode()))
+        except Exception:
+            raise ValueError(f"Graph : invalid cursor '{token}'")
+        if not isinstance(cursor, dict) or not {"order", "value", "m_id"} <= cursor.keys():
+            raise ValueError(f"Graph : invalid cursor '{token}'")
+        return cursor
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _match_query(
+            from_labels: str,
+            from_keys: Tuple[str, ...],
+            to_labels: str,
+            to_keys: Tuple[str, ...],
+            rela_label: str | None,
+            rela_keys: Tuple[str, ...],
+            bidirect: bool
+        ) -> str:
+        _r_label = f":{rela_label}" if rela_label is not None else ""
+        arrow = "->" if not bidirect else "-"
+        return (
+            f"MATCH (p:{from_labels} {Graph._map('p', from_keys)})\n"
+            f"MATCH (q:{to_labels} {Graph._map('q', to_keys)})\n"
+            f"MATCH (p)-[r{_r_label} {Graph._map('r', rela_keys)}]{arrow}(q)\n"
+            f"RETURN p, r, q\n"
+        )
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _subgraph_query(rela_labels: Tuple[str, ...] | None, to_labels: str, bidirect: bool) -> str:
+        """ The nodes of $m_ids, each with its [relationship, neighbour] pairs, one row per node,
+        `rela_labels` None follows relationships of any label
+        """
+        query = "MATCH (p:memory) WHERE p.m_id IN $m_ids\n"
+        if rela_labels is not None and len(rela_labels) == 0:
+            return query + "RETURN p, [] AS expanded\n"
+        _r_label = f":{'|'.join(rela_labels)}" if rela_labels is not None else ""
+        arrow = "->" if not bidirect else "-"
+        return query + f"RETURN p, [(p)-[r{_r_label}]{arrow}(q:{to_labels}) | [r, q]] AS expanded\n"
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _create_rela_query(label: str) -> str:
+        return (
+            f"MATCH (p:memory {{ m_id: $from_m_id }})\n"
+            f"MATCH (q:memory {{ m_id: $to_m_id }})\n"
+            f"CREATE (p)-[r:{label}]->(q)\n"
+            f"SET r += $properties\n"
+        )
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _create_nodes_query(labels: str) -> str:
+        return (
+            f"UNWIND $rows AS row\n"
+            f"CREATE (p:{labels})\n"
+            f"SET p = row\n"
+        )
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _create_relas_query(label: str) -> str:
+        return (
+            f"UNWIND $rows AS row\n"
+            f"MATCH (p:memory {{ m_id: row.from }})\n"
+            f"MATCH (q:memory {{ m_id: row.to }})\n"
+            f"CREATE (p)-[r:{label}]->(q)\n"
+            f"SET r = row\n"
+            f"RETURN r.r_id AS r_id\n"
+        )
+
+    FLUSH_NODES = (
+        "UNWIND $rows AS row\n"
+        "MATCH (p:memory { m_id: row.m_id })\n"
+        "FOREACH (label IN labels(p) | REMOVE p:$(label))\n"
+        "FOREACH (label IN row.labels | SET p:$(label))\n"
+        "SET p += row.new_properties\n"
+        "FOREACH (rkey IN row.removed_properties | REMOVE p[rkey])\n"
+    )
+    FLUSH_RELAS = (
+        "UNWIND $rows AS row\n"
+        "MATCH (p:memory { m_id: row.from })\n"
+        "MATCH (q:memory { m_id: row.to })\n"
+        "MATCH (p)-[r { r_id: row.r_id }]->(q)\n"
+        "SET r += row.new_properties\n"
+        "FOREACH (rkey IN row.removed_properties | REMOVE r[rkey])\n"
+    )
+    DELETE_RELAS = (
+        "UNWIND $rows AS row\n"
+        "MATCH (p:memory { m_id: row.from })\n"
+        "MATCH (q:memory { m_id: row.to })\n"
+        "MATCH (p)-[r { r_id: row.r_id }]->(q)\n"
+        "DELETE r\n"
+    )
+    DELETE_NODES = (
+        "UNWIND $m_ids AS m_id\n"
+        "MATCH (p:memory { m_id: m_id })\n"
+        "DETACH DELETE p\n"
+    )
+
+    MATCH_NODE_BY_ID = (
+        "MATCH (p:memory { m_id: $m_id })\n"
+        "RETURN p\n"
+    )
+    UPDATE_NODE = (
+        "MATCH (p:memory { m_id: $m_id })\n"
+        "FOREACH (label IN labels(p) | REMOVE p:$(label))\n"
+        "FOREACH (label IN $new_labels | SET p:$(label))\n"
+        "SET p += $new_properties\n"
+        "FOREACH (rkey IN $removed_properties | REMOVE p[rkey])\n"
+    )
+    DELETE_NODE = (
+        "MATCH (p:memory { m_id: $m_id })\n"
+        "DETACH DELETE p\n"
+    )
+    UPDATE_RELA = (
+        "MATCH (p:memory { m_id: $from_m_id })\n"
+        "MATCH (q:memory { m_id: $to_m_id })\n"
+        "MATCH (p)-[r { r_id: $r_id }]->(q)\n"
+        "SET r += $new_properties\n"
+    )
+    DELETE_RELA = (
+        "MATCH (p:memory { m_id: $from_m_id })\n"
+        "MATCH (q:memory { m_id: $to_m_id })\n"
+        "MATCH (p)-[r { r_id: $r_id }]->(q)\n"
+        "DELETE r\n"
+    )
     
     def close(self):
         self.__driver.close()
+
+    @contextmanager
+    def session(self):
+        """ Every graph operation of this thread inside the block runs on the same session,
+        instead of borrowing a connection from the pool for each of them
+        """
+        session = getattr(self.__local, "session", None)
+        if session is not None:
+            yield session
+            return
+        with self.__driver.session(database=self.database) as session:
+            self.__local.session = session
+            try:
+                yield session
+            finally:
+                self.__local.session = None
+
+    @staticmethod
+    def _run(query: str, parameters: Dict[str, Any] = {}) -> Callable[[neo4j.ManagedTransaction], List[neo4j.Record]]:
+        def work(tx: neo4j.ManagedTransaction) -> List[neo4j.Record]:
+            return list(tx.run(query, parameters))
+        return work
+
+    def _read(self, work: Callable[[neo4j.ManagedTransaction], Any]) -> Any:
+        """ Runs `work` in a managed read transaction, retried on transient errors and routed to a reader in a cluster """
+        with self.session() as session:
+            return session.execute_read(work)
+
+    def _write(self, work: Callable[[neo4j.ManagedTransaction], Any]) -> Any:
+        """ Runs `work` in a managed write transaction, retried on transient errors, `work` may run more than once """
+        with self.session() as session:
+            return session.execute_write(work)
+
+    @contextmanager
+    def unit_of_work(self):
+        """ Defers `update()` and `destroy()` of Nodes and Relationships made in this thread until the block exits,
+        then writes all of them in one transaction. If the block or the write raises, nothing is written
+        and the tracked objects get their labels, properties and liveness back.
+        A nested unit of work joins the outer one.
+        """
+        unit = getattr(self.__local, "unit", None)
+        if unit is not None:
+            yield unit
+            return
+        unit = UnitOfWork(self)
+        self.__local.unit = unit
+        try:
+            yield unit
+            self.__local.unit = None
+            unit.flush()
+        except BaseException:
+            unit.rollback()
+            raise
+        finally:
+            self.__local.unit = None
+
+    def _unit(self) -> 'UnitOfWork | None':
+        return getattr(self.__local, "unit", None)
+
+    def _flush(self, unit: 'UnitOfWork'):
+        node_rows = [
+            {
+                "m_id": node.m_id,
+                "labels": Graph.node_labels_of(node.label).split(":"),
+                "new_properties": node._new_properties,
+                "removed_properties": node._removed_properties
+            }
+            for node in unit.nodes.values() if node._alive
+        ]
+        rela_rows = [
+            {
+                "r_id": rela.r_id,
+                "from": rela.pos[0],
+                "to": rela.pos[1],
+                "new_properties": rela._new_properties,
+                "removed_properties": rela._removed_properties
+            }
+            for rela in unit.relas.values() if rela._alive
+        ]
+        deleted_relas = [
+            {"r_id": rela.r_id, "from": rela.pos[0], "to": rela.pos[1]}
+            for rela in unit.relas.values() if not rela._alive
+        ]
+        deleted_nodes = [node.m_id for node in unit.nodes.values() if not node._alive]
+        def work(tx: neo4j.ManagedTransaction):
+            for batch in Graph._batches(node_rows, Graph.batch_size):
+                tx.run(Graph.FLUSH_NODES, {"rows": batch}).consume()
+            for batch in Graph._batches(rela_rows, Graph.batch_size):
+                tx.run(Graph.FLUSH_RELAS, {"rows": batch}).consume()
+            for batch in Graph._batches(deleted_relas, Graph.batch_size):
+                tx.run(Graph.DELETE_RELAS, {"rows": batch}).consume()
+            for batch in Graph._batches(deleted_nodes, Graph.batch_size):
+                tx.run(Graph.DELETE_NODES, {"m_ids": batch}).consume()
+        self._write(work)
     
     def create_node(
             self,
             label: str | None = None,
             properties: Dict[str, str | int | float] = {},
         ) -> 'Node':
-        labels = ["memory"]
-        if label is not None and label != "memory":
-            labels.append(label)
-        _labels = ":".join(labels)
+        query = Graph._create_node_query(Graph.node_labels_of(label))
         if "m_id" not in properties:
             properties["m_id"] = uuid()
-        _properties = Graph.json_dumps(properties)
-        query = (
-            f"CREATE (p:{_labels} {_properties})\n"
-        )
-        with self.__driver.session() as session:
-            session.run(
-                query=query
-            )
+        self._write(Graph._run(query, {"properties": properties}))
         node = Node._create(graph=self, m_id=properties["m_id"], label=label, properties=properties)
         return node
 
@@ -58,47 +415,126 @@ class Graph:
             skip: int | None = None,
             limit: int | None = None
         ) -> List['Node']:
-        labels = ["memory"]
-        if label is not None and label != "memory":
-            labels.append(label)
-        if m_id is not None:
-            query = (
-                f"MATCH (p:memory {{ m_id: '{m_id}' }})\n"
-                f"RETURN p\n"
-            )
-        else:
-            _labels = ":".join(labels)
-            _properties = Graph.json_dumps(properties) if len(properties) > 0 else ""
-            query = (
-                f"MATCH (p:{_labels} {_properties})\n"
-                f"RETURN p\n"
-            )
-            if order is not None:
-                _k, _m = order
-                query += f"ORDER BY p.{_k} {_m}\n"
-            if skip is not None:
-                query += f"SKIP {skip}\n"
-            if limit is not None:
-                query += f"LIMIT {limit}"
+        query, parameters = Graph._match_node_statement(m_id, label, properties, order, skip, limit)
         try:
-            with self.__driver.session() as session:
-                nodes = []
-                results = session.run(
-                    query=query
-                )
-                for record in results:
-                    p = record["p"]
-                    m_id = p["m_id"]
-                    p_labels = list(p.labels)
-                    p_label = p_labels[1] if p_labels[1] != "memory" else p_labels[0]
-                    p_props = dict(p)
-                    node = Node._create(graph=self, m_id=m_id, label=p_label, properties=p_props)
-                    nodes.append(node)
-                return nodes      
+            return [Node._load(self, record["p"]) for record in self._read(Graph._run(query, parameters))]
         except Exception as e:
-            print(e)
+            logger.error(f"Graph.match_node() : an error occurred while attempting to match nodes : {parameters}", e)
         return []
+
+    @staticmethod
+    def _match_node_statement(
+            m_id: str | None,
+            label: str | None,
+            properties: Dict,
+            order: Tuple[str, Literal["ASC", "DESC"]] | None,
+            skip: int | None,
+            limit: int | None
+        ) -> Tuple[str, Dict[str, Any]]:
+        if m_id is not None:
+            return Graph.MATCH_NODE_BY_ID, {"m_id": m_id}
+        keys, parameters = Graph._pattern("p", properties)
+        query = Graph._match_node_query(
+            Graph.node_labels_of(label),
+            keys,
+            tuple(order) if order is not None else None,
+            skip is not None,
+            limit is not None
+        )
+        if skip is not None:
+            parameters["skip"] = int(skip)
+        if limit is not None:
+            parameters["limit"] = int(limit)
+        return query, parameters
     
+    @staticmethod
+    def _page_nodes_statement(
+            label: str | None,
+            properties: Dict,
+            order: Tuple[str, Literal["ASC", "DESC"]] | None,
+            cursor: Dict[str, Any] | None,
+            limit: int | None
+        ) -> Tuple[str, Dict[str, Any], Tuple[str, str], int]:
+        order = tuple(order) if order is not None else ("m_id", "ASC")
+        limit = min(int(limit), Graph.page_size) if limit is not None else Graph.page_size
+        if limit < 1:
+            raise ValueError(f"Graph : invalid limit {limit}")
+        keys, parameters = Graph._pattern("p", properties)
+        query = Graph._page_nodes_query(Graph.node_labels_of(label), keys, order, cursor is not None)
+        if cursor is not None:
+            if tuple(cursor["order"]) != order:
+                raise ValueError(f"Graph : the cursor belongs to the order {cursor['order']}, not {list(order)}")
+            parameters["after_value"] = cursor["value"]
+            parameters["after_m_id"] = cursor["m_id"]
+        # one more than asked, to know whether there is a next page
+        parameters["limit"] = limit + 1
+        return query, parameters, order, limit
+
+    @staticmethod
+    def _next_cursor(nodes: List['Node | NodeRow'], order: Tuple[str, str], limit: int) -> Dict[str, Any] | None:
+        if len(nodes) <= limit:
+            return None
+        last = nodes[limit - 1]
+        return {"order": list(order), "value": last.get_prop(order[0]), "m_id": last.m_id}
+
+    def page_nodes(
+            self,
+            label: str | None = None,
+            properties: Dict = {},
+            order: Tuple[str, Literal["ASC", "DESC"]] | None = None,
+            cursor: Dict[str, Any] | None = None,
+            limit: int | None = None
+        ) -> Tuple[List['Node'], Dict[str, Any] | None]:
+        """ Returns (nodes, next cursor), at most `limit` (and Graph.page_size) nodes ordered by `order` then m_id,
+        starting behind `cursor`. The next cursor is None on the last page.
+        Unlike SKIP, a deep page costs the same as the first one as long as the order key is indexed.
+        """
+        query, parameters, order, limit = Graph._page_nodes_statement(label, properties, order, cursor, limit)
+        nodes = [Node._load(self, record["p"]) for record in self._read(Graph._run(query, parameters))]
+        return nodes[:limit], Graph._next_cursor(nodes, order, limit)
+
+    def page_rows(
+            self,
+            label: str | None = None,
+            properties: Dict = {},
+            order: Tuple[str, Literal["ASC", "DESC"]] | None = None,
+            cursor: Dict[str, Any] | None = None,
+            limit: int | None = None
+        ) -> Tuple[List['NodeRow'], Dict[str, Any] | None]:
+        """ page_nodes for reading only, the rows skip the identity map and the change tracking """
+        query, parameters, order, limit = Graph._page_nodes_statement(label, properties, order, cursor, limit)
+        rows = [NodeRow._load(record["p"]) for record in self._read(Graph._run(query, parameters))]
+        return rows[:limit], Graph._next_cursor(rows, order, limit)
+
+    def iter_nodes(
+            self,
+            label: str | None = None,
+            properties: Dict = {},
+            order: Tuple[str, Literal["ASC", "DESC"]] | None = None,
+            fetch_size: int | None = None
+        ) -> Iterator['Node']:
+        """ Every matching node, read `fetch_size` at a time with page_nodes, so a full scan holds one page in memory.
+        Nodes deleted while iterating are fine, the next page starts behind the last node seen.
+        """
+        cursor = None
+        while True:
+            nodes, cursor = self.page_nodes(label, properties, order, cursor, fetch_size)
+            yield from nodes
+            if cursor is None:
+                return
+
+    def refresh(self, node: 'Node') -> bool:
+        """ Re-reads `node` from the graph. A node that no longer exists is evicted from the identity map
+        and marked as removed, returns whether it still exists
+        """
+        records = self._read(Graph._run(Graph.MATCH_NODE_BY_ID, {"m_id": node.m_id}))
+        if len(records) == 0:
+            type(node).nodes.evict(node.m_id)
+            node._alive = False
+            return False
+        type(node)._load(self, records[0]["p"])
+        return True
+
     def _update_node(
             self,
             m_id: str,
@@ -106,61 +542,97 @@ class Graph:
             new_properties: Dict = {},
             removed_properties: List[str] = []
         ):
-        query = (
-            f"MATCH (p {{ m_id: '{m_id}' }})\n"
-            f"FOREACH (label IN labels(p) | REMOVE p:$(label))\n"
-            f"FOREACH (label IN $new_labels | SET p:$(label))\n"
-            f"FOREACH (key IN keys($new_properties) | SET p[key] = $new_properties[key])\n"
-            f"FOREACH (rkey IN $removed_properties | REMOVE p[rkey])\n"
-        )
-        parameters = {
-            "new_labels": ["memory", new_label],
+        self._write(Graph._run(Graph.UPDATE_NODE, Graph._update_node_parameters(m_id, new_label, new_properties, removed_properties)))
+
+    @staticmethod
+    def _update_node_parameters(m_id: str, new_label: str, new_properties: Dict, removed_properties: List[str]) -> Dict[str, Any]:
+        return {
+            "m_id": m_id,
+            "new_labels": Graph.node_labels_of(new_label).split(":"),
             "new_properties" : new_properties,
             "removed_properties": removed_properties
         }
-        with self.__driver.session() as session:
-            session.run(
-                query=query,
-                parameters=parameters
-            )
 
     def _delete_node(
             self,
             m_id: str
         ):
-        query = (
-            f"MATCH (p:memory {{ m_id: '{m_id}' }})\n"
-            f"DETACH DELETE p\n"
-        )
-        with self.__driver.session() as session:
-            session.run(
-                query=query
-            )
+        self._write(Graph._run(Graph.DELETE_NODE, {"m_id": m_id}))
     
+    @staticmethod
+    def _batches(rows: List, batch_size: int) -> List[List]:
+        return [rows[i : i + batch_size] for i in range(0, len(rows), batch_size)]
+
+    @staticmethod
+    def _node_groups(nodes: List[Tuple[str | None, Dict[str, str | int | float]]]) -> Dict[str, List[Dict]]:
+        """ Properties of `nodes` grouped by their labels, every node gets its m_id """
+        groups: Dict[str, List[Dict]] = {}
+        for label, properties in nodes:
+            if "m_id" not in properties:
+                properties["m_id"] = uuid()
+            groups.setdefault(Graph.node_labels_of(label), []).append(properties)
+        return groups
+
+    @staticmethod
+    def _rela_groups(relas: List[Tuple[Tuple[str, str], str, Dict[str, str | int | float]]]) -> Dict[str, List[Dict]]:
+        """ Properties of `relas` grouped by their label, every relationship gets its r_id and endpoints """
+        groups: Dict[str, List[Dict]] = {}
+        for pos, label, properties in relas:
+            properties["from"], properties["to"] = pos
+            properties["r_id"] = uuid()
+            groups.setdefault(Graph.rela_label_of(label), []).append(properties)
+        return groups
+
+    def create_nodes(
+            self,
+            nodes: List[Tuple[str | None, Dict[str, str | int | float]]],
+            batch_size: int | None = None
+        ) -> List['Node']:
+        """ Bulk version of `create_node`, `nodes` is a list of (label, properties).
+        Nodes of the same label are written `batch_size` at a time with one UNWIND statement per batch,
+        all the batches in one transaction: if one fails, none of the nodes is created.
+        """
+        batch_size = batch_size or Graph.batch_size
+        groups = [(Graph._create_nodes_query(labels), rows) for labels, rows in Graph._node_groups(nodes).items()]
+        def work(tx: neo4j.ManagedTransaction):
+            for query, rows in groups:
+                for batch in Graph._batches(rows, batch_size):
+                    tx.run(query, {"rows": batch}).consume()
+        self._write(work)
+        return [
+            Node._create(graph=self, m_id=properties["m_id"], label=label, properties=properties)
+            for label, properties in nodes
+        ]
+
+    def create_relas(
+            self,
+            relas: List[Tuple[Tuple[str, str], str, Dict[str, str | int | float]]],
+            batch_size: int | None = None
+        ) -> List['Relationship']:
+        """ Bulk version of `_create_rela`, `relas` is a list of ((from_m_id, to_m_id), label, properties).
+        Relationships whose endpoints don't exist are skipped, like in `_create_rela`.
+        """
+        batch_size = batch_size or Graph.batch_size
+        created = set()
+        with self.session():
+            for label, rows in Graph._rela_groups(relas).items():
+                query = Graph._create_relas_query(label)
+                for batch in Graph._batches(rows, batch_size):
+                    records = self._write(Graph._run(query, {"rows": batch}))
+                    created.update(record["r_id"] for record in records)
+        return [
+            Relationship._create(graph=self, r_id=properties["r_id"], pos=pos, label=label, properties=properties)
+            for pos, label, properties in relas if properties["r_id"] in created
+        ]
+
     def _create_rela(
             self,
             pos: Tuple[str, str],
             label: str,
             properties: Dict[str, str | int | float]
         ) -> 'Relationship':
-        from_m_id, to_m_id = pos
-        properties["from"] = from_m_id
-        properties["to"] = to_m_id
-        properties["r_id"] = uuid()
-        query = (
-            f"MATCH (p:memory {{ m_id: '{from_m_id}' }})\n"
-            f"MATCH (q:memory {{ m_id: '{to_m_id}' }})\n"
-            f"CREATE (p)-[r:{label}]->(q)\n"
-            f"FOREACH (key IN keys($properties) | SET r[key] = $properties[key])\n"
-        )
-        parameters = {
-            "properties": properties
-        }
-        with self.__driver.session() as session:
-            session.run(
-                query=query,
-                parameters=parameters
-            )
+        query, parameters = Graph._create_rela_statement(pos, label, properties)
+        self._write(Graph._run(query, parameters))
         rela = Relationship._create(
             graph=self,
             r_id=properties["r_id"],
@@ -170,6 +642,20 @@ class Graph:
         )
         return rela
 
+    @staticmethod
+    def _create_rela_statement(pos: Tuple[str, str], label: str, properties: Dict[str, str | int | float]) -> Tuple[str, Dict[str, Any]]:
+        query = Graph._create_rela_query(Graph.rela_label_of(label))
+        from_m_id, to_m_id = pos
+        properties["from"] = from_m_id
+        properties["to"] = to_m_id
+        properties["r_id"] = uuid()
+        parameters = {
+            "from_m_id": from_m_id,
+            "to_m_id": to_m_id,
+            "properties": properties
+        }
+        return query, parameters
+
     def match(
             self,
             from_prop: Dict[str, str | int | float] = {},
@@ -177,68 +663,58 @@ class Graph:
             rela_prop: Dict[str, str | int | float] = {},
             bidirect: bool = False
         ) -> List[Tuple['Node', 'Relationship', 'Node']]:
-        from_labels = ["memory"]
-        to_labels = ["memory"]
-        if "label" in from_prop:
-            from_labels.append(from_prop.pop("label"))
-        if "label" in to_prop:
-            to_labels.append(to_prop.pop("label"))
-        _from_labels = ":".join(from_labels)
-        _from_prop = Graph.json_dumps(from_prop)
-        _to_labels = ":".join(to_labels)
-        _to_prop = Graph.json_dumps(to_prop)
-        _r_label = ":" + rela_prop.pop("label") if "label" in rela_prop else ""
-        _rela_prop = Graph.json_dumps(rela_prop)
-        arrow = "->" if not bidirect else "-"
-        query = (
-            f"MATCH (p:{_from_labels} {_from_prop})\n"
-            f"MATCH (q:{_to_labels} {_to_prop})\n"
-            f"MATCH (p)-[r{_r_label} {_rela_prop}]{arrow}(q)\n"
-            f"RETURN p, r, q\n"
-        )
-        with self.__driver.session() as session:
-            ans = []
-            result = session.run(
-                query=query
-            )
-            for record in result:
-                p, q = record['p'], record['q']
-                p_labels, q_labels = p.labels, q.labels
-                for label in p_labels:
-                    if label != "memory":
-                        p_label = label
-                for label in q_labels:
-                    if label != "memory":
-                        q_label = label
-                p_prop, q_prop = dict(p), dict(q)
-                node_p = Node._create(
-                    graph=self,
-                    m_id=p_prop["m_id"],
-                    label=p_label,
-                    properties=p_prop
-                )
-                node_q = Node._create(
-                    graph=self,
-                    m_id=q_prop["m_id"],
-                    label=q_label,
-                    properties=q_prop
-                )
-                r = record['r']
-                r_label = r.type
-                r_prop = dict(r)
-                r_id = r_prop["r_id"]
-                from_m_id = r_prop["from"]
-                to_m_id = r_prop["to"]
-                rela = Relationship._create(
-                    graph=self,
-                    r_id=r_id,
-                    pos=(from_m_id, to_m_id),
-                    label=r_label,
-                    properties=r_prop
-                )
-                ans.append((node_p, rela, node_q))
-            return ans
+        query, parameters = Graph._match_statement(from_prop, to_prop, rela_prop, bidirect)
+        return [
+            (Node._load(self, record["p"]), Relationship._load(self, record["r"]), Node._load(self, record["q"]))
+            for record in self._read(Graph._run(query, parameters))
+        ]
+
+    @staticmethod
+    def _match_statement(
+            from_prop: Dict[str, str | int | float],
+            to_prop: Dict[str, str | int | float],
+            rela_prop: Dict[str, str | int | float],
+            bidirect: bool
+        ) -> Tuple[str, Dict[str, Any]]:
+        from_prop, to_prop, rela_prop = dict(from_prop), dict(to_prop), dict(rela_prop)
+        from_labels = Graph.node_labels_of(from_prop.pop("label", None))
+        to_labels = Graph.node_labels_of(to_prop.pop("label", None))
+        rela_label = Graph.rela_label_of(rela_prop.pop("label")) if "label" in rela_prop else None
+        from_keys, from_params = Graph._pattern("p", from_prop)
+        to_keys, to_params = Graph._pattern("q", to_prop)
+        rela_keys, rela_params = Graph._pattern("r", rela_prop)
+        query = Graph._match_query(from_labels, from_keys, to_labels, to_keys, rela_label, rela_keys, bidirect)
+        return query, {**from_params, **to_params, **rela_params}
     
+    @staticmethod
+    def _subgraph_statement(
+            m_ids: List[str],
+            expand: Tuple[str, ...] | None,
+            to_label: str | None,
+            bidirect: bool
+        ) -> Tuple[str, Dict[str, Any]]:
+        rela_labels = tuple(sorted({Graph.rela_label_of(label) for label in expand})) if expand is not None else None
+        query = Graph._subgraph_query(rela_labels, Graph.node_labels_of(to_label), bidirect)
+        return query, {"m_ids": list(dict.fromkeys(m_ids))}
+
+    def match_subgraph(
+            self,
+            m_ids: List[str],
+            expand: Tuple[str, ...] | None = (),
+            to_label: str | None = None,
+            bidirect: bool = True
+        ) -> Dict[str, Tuple['Node', List[Tuple['Relationship', 'Node']]]]:
+        """ Loads the nodes of `m_ids` and their neighbours (of label `to_label`) through relationships
+        of the labels in `expand` (of any label if it is None), all in one query.
+        Returns m_id -> (node, [(relationship, neighbour), ...]), m_ids that don't exist are missing from it.
+        """
+        query, parameters = Graph._subgraph_statement(m_ids, expand, to_label, bidirect)
+        subgraph = {}
+        for record in self._read(Graph._run(query, parameters)):
+            node = Node._load(self, record["p"])
+            subgraph[node.m_id] = (node, [(Relationship._load(self, r), Node._load(self, q)) for r, q in record["expanded"]])
+        return subgraph
+
     def update_rela(
             self,
             r_id: str,
@@ -246,20 +722,13 @@ class Graph:
             new_properties: Dict[str, str | int | float]
         ):
         from_m_id, to_m_id = pos
-        query = (
-            f"MATCH (p:memory {{ m_id: '{from_m_id}' }})\n"
-            f"MATCH (q:memory {{ m_id: '{to_m_id}' }})\n"
-            f"MATCH (p)-[r {{ r_id: '{r_id}' }}]->(q)\n"
-            f"FOREACH (key IN KEYS($new_properties) | SET r[key] = $new_properties[key])\n"
-        )
         parameters = {
+            "r_id": r_id,
+            "from_m_id": from_m_id,
+            "to_m_id": to_m_id,
             "new_properties": new_properties
         }
-        with self.__driver.session() as session:
-            session.run(
-                query=query,
-                parameters=parameters
-            )
+        self._write(Graph._run(Graph.UPDATE_RELA, parameters))
     
     def _delete_rela(
             self,
@@ -267,45 +736,290 @@ class Graph:
             pos: Tuple[str, str]
         ):
         from_m_id, to_m_id = pos
-        query = (
-            f"MATCH (p:memory {{ m_id: '{from_m_id}' }})\n"
-            f"MATCH (q:memory {{ m_id: '{to_m_id}' }})\n"
-            f"MATCH (p)-[r {{ r_id: '{r_id}' }}]->(q)\n"
-            f"DELETE r\n"
+        parameters = {
+            "r_id": r_id,
+            "from_m_id": from_m_id,
+            "to_m_id": to_m_id
+        }
+        self._write(Graph._run(Graph.DELETE_RELA, parameters))
+
+class UnitOfWork:
+    """ Nodes and Relationships changed inside Graph.unit_of_work(), see there """
+    def __init__(self, graph: Graph):
+        self.graph = graph
+        # m_id / r_id -> object, in the order they were first changed
+        self.nodes: Dict[str, 'Node'] = {}
+        self.relas: Dict[str, 'Relationship'] = {}
+        self.__snapshots: Dict[int, Tuple] = {}
+        self.__after_flush: List[Callable[[], None]] = []
+
+    def after_flush(self, fn: Callable[[], None]):
+        """ Runs `fn` once the changes are written, it is dropped if the unit is rolled back """
+        self.__after_flush.append(fn)
+
+    def track(self, entity: 'Node | Relationship'):
+        """ Remembers the state of `entity` before its first change """
+        if id(entity) in self.__snapshots:
+            return
+        self.__snapshots[id(entity)] = (
+            entity,
+            entity.label,
+            dict(entity._properties),
+            dict(entity._new_properties),
+            list(entity._removed_properties),
+            entity._alive
         )
-        with self.__driver.session() as session:
-            session.run(
-                query=query
-            )
+        if isinstance(entity, Node):
+            self.nodes[entity.m_id] = entity
+        else:
+            self.relas[entity.r_id] = entity
+
+    def rollback(self):
+        for entity, label, properties, new_properties, removed_properties, alive in self.__snapshots.values():
+            entity.label = label
+            entity._properties.clear()
+            entity._properties.update(properties)
+            entity._new_properties = new_properties
+            entity._removed_properties = removed_properties
+            entity._alive = alive
+        self.__snapshots.clear()
+        self.__after_flush.clear()
+        self.nodes.clear()
+        self.relas.clear()
+
+    def flush(self):
+        if len(self.nodes) + len(self.relas) > 0:
+            self.graph._flush(self)
+        for entity in list(self.nodes.values()) + list(self.relas.values()):
+            entity._new_properties = {}
+            entity._removed_properties = []
+        self.__snapshots.clear()
+        self.nodes.clear()
+        self.relas.clear()
+        callbacks, self.__after_flush = self.__after_flush, []
+        for fn in callbacks:
+            fn()
 
-class Node:
-    nodes = {}
+
+class IdentityMap:
+    """ m_id -> the Node instance loaded for it, so every part of the app sees the same object.
+    The `max_size` most recently used nodes are held strongly, older ones stay mapped only as long as
+    something else still references them. Every time a node is read from the graph again its
+    properties are refreshed in place, `age(m_id)` tells how long ago that last happened.
+    """
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__lock = threading.RLock()
+        self.__recent: OrderedDict[str, 'Node'] = OrderedDict()
+        self.__all: weakref.WeakValueDictionary[str, 'Node'] = weakref.WeakValueDictionary()
+        self.__loaded: Dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self.__all)
+
+    def __contains__(self, m_id: str) -> bool:
+        return m_id in self.__all
+
+    def get(self, m_id: str) -> 'Node | None':
+        with self.__lock:
+            node = self.__all.get(m_id)
+            if node is not None:
+                self.__touch(m_id, node)
+            return node
+
+    def __touch(self, m_id: str, node: 'Node'):
+        self.__recent[m_id] = node
+        self.__recent.move_to_end(m_id)
+        while len(self.__recent) > self.max_size:
+            # nothing may keep the evicted node alive here, `__forget` runs once it is collected
+            self.__recent.popitem(last=False)
+            self.evictions += 1
+
+    def __forget(self, m_id: str):
+        # the node of `m_id` was collected, unless it was loaded again since
+        if self.__all.get(m_id) is None:
+            self.__loaded.pop(m_id, None)
+
+    def load(self, m_id: str, label: str, properties: Dict[str, Any], factory: Callable[[], 'Node']) -> 'Node':
+        """ Returns the mapped node refreshed with `label` and `properties` read from the graph,
+        or maps the node built by `factory()`
+        """
+        with self.__lock:
+            node = self.__all.get(m_id)
+            if node is not None:
+                self.hits += 1
+                node._sync(label, properties)
+            else:
+                self.misses += 1
+                node = factory()
+                self.__all[m_id] = node
+                weakref.finalize(node, self.__forget, m_id)
+            self.__loaded[m_id] = time.monotonic()
+            self.__touch(m_id, node)
+            return node
+
+    def age(self, m_id: str) -> float | None:
+        """ Seconds since the node was last read from the graph """
+        with self.__lock:
+            loaded = self.__loaded.get(m_id)
+            return time.monotonic() - loaded if loaded is not None and m_id in self.__all else None
+
+    def evict(self, m_id: str):
+        with self.__lock:
+            self.__recent.pop(m_id, None)
+            self.__all.pop(m_id, None)
+            self.__loaded.pop(m_id, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__recent.clear()
+            self.__all.clear()
+            self.__loaded.clear()
+
+    def footprint(self) -> Dict[str, int]:
+        """ Approximate memory held by the mapped nodes, in bytes (shallow sizes of the nodes and their properties) """
+        with self.__lock:
+            nodes = list(self.__all.values())
+            strong = len(self.__recent)
+        size = 0
+        for node in nodes:
+            size += sys.getsizeof(node)
+            if hasattr(node, "__dict__"):
+                size += sys.getsizeof(node.__dict__)
+            for container in [node._properties, node._new, node._removed]:
+                if container is None:
+                    continue
+                size += sys.getsizeof(container)
+                items = container.items() if isinstance(container, dict) else [(key, None) for key in container]
+                for key, value in items:
+                    size += sys.getsizeof(key) + (sys.getsizeof(value) if value is not None else 0)
+        return {
+            "entries": len(nodes),
+            "strong_entries": strong,
+            "bytes": size
+        }
+
+    def stats(self) -> Dict[str, int | float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+            "evictions": self.evictions,
+            "max_size": self.max_size,
+            **self.footprint()
+        }
+
+
+class _Changes:
+    """ `_new_properties` / `_removed_properties` of Node and Relationship.
+    The containers are only allocated on the first change (`_new` / `_removed` stay None until then),
+    reading them before that gives an empty one.
+    """
+    __slots__ = ()
+
+    @property
+    def _new_properties(self) -> Dict[str, str | int | float]:
+        return self._new if self._new is not None else {}
+
+    @_new_properties.setter
+    def _new_properties(self, value: Dict[str, str | int | float]):
+        self._new = value if len(value) > 0 else None
+
+    @property
+    def _removed_properties(self) -> List[str]:
+        return self._removed if self._removed is not None else []
+
+    @_removed_properties.setter
+    def _removed_properties(self, value: List[str]):
+        self._removed = value if len(value) > 0 else None
+
+    def _set_new(self, key: str, value: str | int | float):
+        if self._new is None:
+            self._new = {}
+        self._new[key] = value
+
+    def _add_removed(self, key: str):
+        if self._removed is None:
+            self._removed = []
+        if key not in self._removed:
+            self._removed.append(key)
+
+
+class NodeRow(NamedTuple):
+    """ Read-only snapshot of a node, for bulk reads that don't change what they read """
+    m_id: str
+    label: str
+    properties: Dict[str, str | int | float]
+
+    @classmethod
+    def _load(cls, p: neo4j.graph.Node) -> 'NodeRow':
+        labels = [label for label in p.labels if label != "memory"]
+        properties = dict(p)
+        return cls(properties["m_id"], labels[0] if len(labels) > 0 else "memory", properties)
+
+    def get_prop(self, key: str) -> str | int | float:
+        return self.properties.get(key)
+
+
+class Node(_Changes):
+    # no per-instance __dict__, __weakref__ is for the identity map
+    __slots__ = ("_graph", "m_id", "label", "_properties", "_alive", "_new", "_removed", "__weakref__")
+    nodes = IdentityMap(int(os.environ.get("NEO4J_IDENTITY_MAP_SIZE", 10000)))
     
     def __init__(self):
-        self.__graph: Graph = None
+        self._graph: Graph = None
         self.m_id = None
         self.label = None
         self._properties = None
         self._alive = False
-        self._new_properties = {}
-        self._removed_properties = []
+        self._new = None
+        self._removed = None
         raise RuntimeError("Use Graph.create_node or Graph.match_node to get a Node instance")
 
     @classmethod
     def _create(cls, graph: Graph, m_id: int, label: str, properties: Dict[str, str | int | float]) -> 'Node':
-        if m_id in Node.nodes:
-            return Node.nodes[m_id]
-        instance = cls.__new__(cls)
-        instance.__graph = graph
-        instance.m_id = m_id
-        instance.label = label
-        instance._properties = properties
-        instance._alive = True
-        instance._new_properties = {}
-        instance._removed_properties = []
-        Node.nodes[m_id] = instance
+        def factory():
+            instance = cls.__new__(cls)
+            instance._graph = graph
+            instance.m_id = m_id
+            instance.label = label
+            instance._properties = properties
+            instance._alive = True
+            instance._new = None
+            instance._removed = None
+            return instance
 
-        return instance
+        return cls.nodes.load(m_id, label, properties, factory)
+
+    @classmethod
+    def _load(cls, graph: Graph, p: neo4j.graph.Node) -> 'Node':
+        """ The node of a record read from the graph """
+        labels = [label for label in p.labels if label != "memory"]
+        properties = dict(p)
+        return cls._create(graph=graph, m_id=properties["m_id"], label=labels[0] if len(labels) > 0 else "memory", properties=properties)
+
+    def _sync(self, label: str, properties: Dict[str, str | int | float]):
+        """ Takes the state read from the graph, changes that weren't written yet are kept on top of it """
+        if self._properties is properties:
+            return
+        pending = self._new is not None or self._removed is not None
+        merged = dict(properties)
+        merged.update(self._new_properties)
+        for key in self._removed_properties:
+            merged.pop(key, None)
+        # same dict object, MemoryNode.dic() hands it out
+        self._properties.clear()
+        self._properties.update(merged)
+        if not pending:
+            self.label = label
+
+    def refresh(self) -> bool:
+        """ Re-reads the node from the graph, returns False if it no longer exists """
+        return self._graph.refresh(self)
 
     @staticmethod
     def ensure_alive(method):
@@ -317,6 +1031,13 @@ class Node:
     
     def __str__(self):
         return f"[{self.label}] {self._properties}"
+
+    def _unit(self) -> UnitOfWork | None:
+        """ The unit of work this node's changes go to, if one is open in this thread """
+        unit = self._graph._unit()
+        if unit is not None:
+            unit.track(self)
+        return unit
     
     @ensure_alive
     def get_prop(self, key: str) -> str | int | float:
@@ -324,22 +1045,27 @@ class Node:
     
     @ensure_alive
     def set_prop(self, key: str, value: str | int | float):
+        self._unit()
         self._properties[key] = value
-        self._new_properties[key] = value
+        self._set_new(key, value)
     
     @ensure_alive
     def remove_prop(self, key: str):
+        self._unit()
         self._properties.pop(key)
-        if key not in self._removed_properties:
-            self._removed_properties.append(key)
+        self._add_removed(key)
     
     @ensure_alive
     def set_label(self, label: str):
+        self._unit()
         self.label = label
     
     @ensure_alive
     def update(self):
-        self.__graph._update_node(
+        if self._unit() is not None:
+            # written when the unit of work exits
+            return
+        self._graph._update_node(
             m_id=self.m_id,
             new_label=self.label,
             new_properties=self._new_properties,
@@ -354,7 +1080,7 @@ class Node:
         properties["r_id"] = uuid()
         from_m_id = self.m_id
         to_m_id = to.m_id
-        return self.__graph._create_rela(
+        return self._graph._create_rela(
             pos=(from_m_id, to_m_id),
             label=label,
             properties=properties
@@ -362,19 +1088,24 @@ class Node:
     
     @ensure_alive
     def _destroy(self):
-        self.__graph._delete_node(self.m_id)
+        if self._unit() is not None:
+            self._alive = False
+            return
+        self._graph._delete_node(self.m_id)
         self._alive = False
 
-class Relationship:
+class Relationship(_Changes):
+    __slots__ = ("_graph", "r_id", "pos", "label", "_properties", "_alive", "_new", "_removed")
+
     def __init__(self):
-        self.__graph: Graph = None
+        self._graph: Graph = None
         self.r_id = None
         self.pos = None
         self.label = None
         self._properties = None
         self._alive = False
-        self._new_properties = {}
-        self._removed_properties = []
+        self._new = None
+        self._removed = None
         raise RuntimeError("Use Node.create_rela to get a Relationship instance")
     
     @staticmethod
@@ -388,20 +1119,32 @@ class Relationship:
     @classmethod
     def _create(cls, graph: Graph, r_id: str, pos: Tuple[str, str], label: str, properties: Dict[str, str | int | float]) -> 'Relationship':
         instance = cls.__new__(cls)
-        instance.__graph = graph
+        instance._graph = graph
         instance.r_id = r_id
         instance.pos = pos
         instance.label = label
         instance._properties = properties
         instance._alive = True
-        instance._new_properties = {}
-        instance._removed_properties = []
+        instance._new = None
+        instance._removed = None
         
         return instance
+
+    @classmethod
+    def _load(cls, graph: Graph, r: neo4j.graph.Relationship) -> 'Relationship':
+        """ The relationship of a record read from the graph """
+        properties = dict(r)
+        return cls._create(graph=graph, r_id=properties["r_id"], pos=(properties["from"], properties["to"]), label=r.type, properties=properties)
     
     @ensure_alive
     def __str__(self):
         return f"[{self.label}] {self._properties}"
+
+    def _unit(self) -> UnitOfWork | None:
+        unit = self._graph._unit()
+        if unit is not None:
+            unit.track(self)
+        return unit
     
     @ensure_alive
     def get_prop(self, key: str) -> str | int | float:
@@ -409,14 +1152,15 @@ class Relationship:
     
     @ensure_alive
     def set_prop(self, key: str, value: str | int | float):
+        self._unit()
         self._properties[key] = value
-        self._new_properties[key] = value
+        self._set_new(key, value)
        
     @ensure_alive
     def remove_prop(self, key: str):
+        self._unit()
         self._properties.pop(key)
-        if key not in self._removed_properties:
-            self._removed_properties.append(key)
+        self._add_removed(key)
     
     @ensure_alive
     def set_label(self, label: str):
@@ -424,7 +1168,9 @@ class Relationship:
     
     @ensure_alive
     def update(self):
-        self.__graph.update_rela(
+        if self._unit() is not None:
+            return
+        self._graph.update_rela(
             r_id=self.r_id,
             pos=self.pos,
             new_properties=self._new_properties
@@ -432,7 +1178,10 @@ class Relationship:
         
     @ensure_alive
     def destroy(self):
-        self.__graph._delete_rela(
+        if self._unit() is not None:
+            self._alive = False
+            return
+        self._graph._delete_rela(
             r_id=self.r_id,
             pos=self.pos
         )
@@ -0,0 +1,128 @@
+import os
+import time
+import argparse
+from typing import (
+    List, Dict, Tuple, Any
+)
+import neo4j
+from .logger import logger
+
+# (version, description, statements), applied in order and never edited once released,
+# a schema change is a new entry at the end
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (
+        1,
+        "unique m_id for every memory node",
+        [
+            "CREATE CONSTRAINT memory_m_id IF NOT EXISTS FOR (p:memory) REQUIRE p.m_id IS UNIQUE"
+        ]
+    ),
+    (
+        2,
+        "lookups by abstract, ordering by familiarity",
+        [
+            "CREATE INDEX memory_abstract IF NOT EXISTS FOR (p:memory) ON (p.abstract)",
+            "CREATE INDEX word_abstract IF NOT EXISTS FOR (p:word) ON (p.abstract)",
+            "CREATE INDEX unfamiliar_word_abstract IF NOT EXISTS FOR (p:unfamiliar_word) ON (p.abstract)",
+            "CREATE INDEX topic_abstract IF NOT EXISTS FOR (p:topic) ON (p.abstract)",
+            "CREATE INDEX unfamiliar_word_familiarity IF NOT EXISTS FOR (p:unfamiliar_word) ON (p.familiarity)",
+            "CREATE INDEX weakness_familiarity IF NOT EXISTS FOR (p:weakness) ON (p.familiarity)"
+        ]
+    ),
+    (
+        3,
+        "relationship r_id",
+        [
+            f"CREATE INDEX {label}_r_id IF NOT EXISTS FOR ()-[r:{label}]-() ON (r.r_id)"
+            for label in ["relative", "synonyms", "antonyms", "derived", "display", "belong"]
+        ]
+    ),
+    (
+        4,
+        "keyset pagination by familiarity",
+        [
+            "CREATE INDEX unfamiliar_word_familiarity_m_id IF NOT EXISTS FOR (p:unfamiliar_word) ON (p.familiarity, p.m_id)",
+            "CREATE INDEX weakness_familiarity_m_id IF NOT EXISTS FOR (p:weakness) ON (p.familiarity, p.m_id)"
+        ]
+    )
+]
+
+class Schema:
+    """ Versioned schema migrations of the memory graph.
+    Applied versions are recorded as (:_SchemaMigration) nodes, so `migrate` is idempotent
+    and only runs the entries of MIGRATIONS that the database hasn't seen yet.
+    `database` is the one the graph works on, None is the default database of the server.
+    """
+    def __init__(self, driver: neo4j.Driver, migrations: List[Tuple[int, str, List[str]]] = MIGRATIONS, database: str | None = None):
+        self.driver = driver
+        self.database = database
+        self.migrations = sorted(migrations, key=lambda migration: migration[0])
+
+    def applied(self) -> List[int]:
+        with self.driver.session(database=self.database) as session:
+            result = session.run("MATCH (m:_SchemaMigration) RETURN m.version AS version ORDER BY version")
+            return [record["version"] for record in result]
+
+    def pending(self) -> List[Tuple[int, str, List[str]]]:
+        applied = set(self.applied())
+        return [migration for migration in self.migrations if migration[0] not in applied]
+
+    def migrate(self) -> List[int]:
+        """ Applies the pending migrations, returns their versions """
+        done = []
+        for version, description, statements in self.pending():
+            with self.driver.session(database=self.database) as session:
+                # schema statements can't share a transaction with data writes
+                for statement in statements:
+                    session.run(statement).consume()
+                session.run(
+                    "MERGE (m:_SchemaMigration { version: $version }) SET m.description = $description, m.applied_at = $applied_at",
+                    version=version,
+                    description=description,
+                    applied_at=time.time()
+                ).consume()
+            logger.info(f"Schema.migrate() : applied migration {version} : {description}")
+            done.append(version)
+        return done
+
+    def usage(self) -> List[Dict[str, Any]]:
+        """ Indexes and constraints with how often they were read since the database started """
+        with self.driver.session(database=self.database) as session:
+            result = session.run(
+                "SHOW INDEXES YIELD name, type, entityType, labelsOrTypes, properties, state, readCount, lastRead, owningConstraint\n"
+                "RETURN name, type, entityType, labelsOrTypes, properties, state, readCount, lastRead, owningConstraint\n"
+                "ORDER BY readCount DESC"
+            )
+            return [record.data() for record in result]
+
+
+def bootstrap(driver: neo4j.Driver, database: str | None = None) -> List[int]:
+    try:
+        return Schema(driver, database=database).migrate()
+    except Exception as e:
+        # the graph is still usable without its indexes, only slower
+        logger.error("neo4j_schema.bootstrap() : an error occurred while attempting to migrate the graph schema", e)
+        return []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Schema migrations and index usage of the memory graph")
+    parser.add_argument("command", choices=["status", "migrate", "usage"])
+    parser.add_argument("--uri", default=os.environ.get("NEO4J_URI", "bolt://localhost:7687"))
+    parser.add_argument("--user", default="neo4j")
+    parser.add_argument("--password", default=os.environ.get("NEO4J_PASSWORD", "clara-neo4j"))
+    parser.add_argument("--database", default=os.environ.get("NEO4J_DATABASE"))
+    args = parser.parse_args()
+    with neo4j.GraphDatabase.driver(args.uri, auth=(args.user, args.password)) as driver:
+        schema = Schema(driver, database=args.database)
+        if args.command == "status":
+            applied = set(schema.applied())
+            for version, description, _ in schema.migrations:
+                print(f"{'applied' if version in applied else 'pending'}\t{version}\t{description}")
+        elif args.command == "migrate":
+            print(f"applied: {schema.migrate()}")
+        else:
+            print(f"{'name':<32}{'type':<8}{'on':<40}{'state':<10}{'reads':>10}  last read")
+            for index in schema.usage():
+                on = f"{index['entityType'].lower()} {','.join(index['labelsOrTypes'] or [])}({','.join(index['properties'] or [])})"
+                print(f"{index['name']:<32}{index['type']:<8}{on:<40}{index['state']:<10}{index['readCount'] or 0:>10}  {index['lastRead'] or '-'}")
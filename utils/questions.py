@@ -1,5 +1,7 @@
 import os
 import random
+import asyncio
+from concurrent.futures import Future
 from pathlib import Path
 import subprocess
 import yaml, json
@@ -15,10 +17,11 @@ from agent.retriever import (
     Retriever
 )
 from utils.general import (
-    gpt_4o, tts_hd,
     LLMEngine,
-    AMEngine
+    AMEngine,
+    registry
 )
+from utils.concurrency import background_loop
 from utils.string import Formatter
 from .logger import logger
 from shortuuid import uuid
@@ -123,6 +126,17 @@ class SentenceMakingQuestion(Question):
         
 
 class ListeningQuestion(Question):
+    # the TTS engine (see config/setting/engines.yml) used both to pre-warm and to play the audio
+    tts = "tts_hd"
+    # format played when the client doesn't ask for one
+    audio_format = "opus"
+    # formats clients asked for, `Quiz.prewarm` synthesizes each of them
+    audio_formats = {audio_format}
+
+    @staticmethod
+    def requested(response_format: str):
+        ListeningQuestion.audio_formats.add(response_format)
+
     def __init__(self, content, solution, rela_nodes, analysis = None, *args, **kwargs):
         super().__init__(content, solution, rela_nodes, analysis, *args, **kwargs)
         self.voice = kwargs.get("voice", None)
@@ -210,6 +224,9 @@ class ListeningQuestion(Question):
 
 
 class Quiz:
+    # at most this many clips are synthesized at the same time by `prewarm`
+    prewarm_concurrency = 4
+
     def __init__(self):
         self.filepath = None
         self.knowledges: List[MemoryNode] = []
@@ -293,82 +310,83 @@ class Quiz:
     def shell(self, retriever: Retriever):
         def _clear():
             subprocess.run("clear", shell=True)
+        # the shell plays mp3, have the clips ready by the listening part
+        self.prewarm(["mp3"])
         _clear()
         for idx, node in enumerate(self.knowledges):
             print(f"{idx + 1}. {node.get_prop('abstract')}")
             print(node.get_prop('content'))
             input("> Press ENTER to continue :")
             _clear()
-        for idx, (q_type, q_list) in enumerate(self.problemset.items()):
-            print(f"PART {idx + 1} : {q_type}")
-            input("> Press ENTER to start :")
-            _clear()
-            scale, low = 1, 0
-            if q_type == "GapFillingQuestion":
-                scale, low = 10, 0
-            elif q_type == "ListeningQuestion":
-                scale, low = 20, 0.7
-            elif q_type == "SentenceMakingQuestion":
-                scale, low = 20, 0.6
-            else:
-                continue
-            for q in q_list:
-                w = q.rela_nodes[0]
-                mistake = q.rela_nodes[1] if len(q.rela_nodes) > 1 else None
-                print("=" * 30)
-                print(q.question(hint=True))
-                print("\n")
-                if q_type == "ListeningQuestion":
-                    voice = random.choice(
-                        ['alloy', 'echo', 'fable', 'onyx', 'nova', 'shimmer']
-                    )
-                    name = tts_hd.generate(q.solution, voice)
-                    for i in range(2):
-                        AMEngine.play(name)
-                answer = input("> ")
-                score, analysis, feedbacks = q.mark(answer, gpt_4o)
-                try:
-                    if q_type in ["ListeningQuestion", "SentenceMakingQuestion"] and score <= low and len(feedbacks) > 0:
-                        mistake_abstract = ", ".join(v["abstract"] for v in feedbacks) if not mistake else mistake.get_prop("mistake")
-                        mistake_feedbacks = "\n".join(f"{v['abstract']} : {v['content']}" for v in feedbacks)
-                        mistake_content = (
-                            f"question: {q.question(hint=True)}\n"
-                            f"solution: {q.solution}\n"
-                            f"student's answer: {answer}\n"
-                            f"feedbacks : {mistake_feedbacks}"
-                        )
-                        node_profile = {
-                            "label": "mistake",
-                            "abstract": mistake_abstract,
-                            "type": q_type,
-                            "content": mistake_content,
-                            "familiarity": 0
-                        }
-                        node = retriever.remember(node_profile, 0)
-                        node.create_rela(w, "relative", {})
-                except Exception as e:
-                    logger.error(f"Quiz.shell() : an error occurred while attempting to generate a mistake node of {w.get_prop('abstract')}", e)
-                print(f"\n* score : {score}")
-                print(f"solution : {q.solution}")
-                if analysis:
-                    print(f"* analysis :\n{analysis}")
-                input("> Press ENTER to continue :")
+        # familiarity changes are written in one transaction once the quiz is completed
+        with retriever.unit_of_work():
+            for idx, (q_type, q_list) in enumerate(self.problemset.items()):
+                print(f"PART {idx + 1} : {q_type}")
+                input("> Press ENTER to start :")
                 _clear()
-                k = max(-5, int(scale * (score - low)))
-                for node in q.rela_nodes:
-                    familiarity = node.get_prop("familiarity")
-                    if familiarity is None:
-                        familiarity = 0
-                    familiarity += k
-                    node.set_prop("familiarity", familiarity)
-                    node.update()
-                    logger.info(f"Quiz.shell() : updated [familiarity ({k})] {node}")
-                    if familiarity >= 100:
-                        if node.label == "unfamiliar_word":
-                            node.set_label("word")
-                            node.update()
-                        elif node.label == "mistake":
-                            node.destroy()
+                scale, low = 1, 0
+                if q_type == "GapFillingQuestion":
+                    scale, low = 10, 0
+                elif q_type == "ListeningQuestion":
+                    scale, low = 20, 0.7
+                elif q_type == "SentenceMakingQuestion":
+                    scale, low = 20, 0.6
+                else:
+                    continue
+                for q in q_list:
+                    w = q.rela_nodes[0]
+                    mistake = q.rela_nodes[1] if len(q.rela_nodes) > 1 else None
+                    print("=" * 30)
+                    print(q.question(hint=True))
+                    print("\n")
+                    if q_type == "ListeningQuestion":
+                        name = registry.get(ListeningQuestion.tts).generate(q.solution, q.voice, response_format="mp3")
+                        for i in range(2):
+                            AMEngine.play(name)
+                    answer = input("> ")
+                    score, analysis, feedbacks = q.mark(answer, registry.get("gpt_4o"))
+                    try:
+                        if q_type in ["ListeningQuestion", "SentenceMakingQuestion"] and score <= low and len(feedbacks) > 0:
+                            mistake_abstract = ", ".join(v["abstract"] for v in feedbacks) if not mistake else mistake.get_prop("mistake")
+                            mistake_feedbacks = "\n".join(f"{v['abstract']} : {v['content']}" for v in feedbacks)
+                            mistake_content = (
+                                f"question: {q.question(hint=True)}\n"
+                                f"solution: {q.solution}\n"
+                                f"student's answer: {answer}\n"
+                                f"feedbacks : {mistake_feedbacks}"
+                            )
+                            node_profile = {
+                                "label": "mistake",
+                                "abstract": mistake_abstract,
+                                "type": q_type,
+                                "content": mistake_content,
+                                "familiarity": 0
+                            }
+                            node = retriever.remember(node_profile, 0)
+                            node.create_rela(w, "relative", {})
+                    except Exception as e:
+                        logger.error(f"Quiz.shell() : an error occurred while attempting to generate a mistake node of {w.get_prop('abstract')}", e)
+                    print(f"\n* score : {score}")
+                    print(f"solution : {q.solution}")
+                    if analysis:
+                        print(f"* analysis :\n{analysis}")
+                    input("> Press ENTER to continue :")
+                    _clear()
+                    k = max(-5, int(scale * (score - low)))
+                    for node in q.rela_nodes:
+                        familiarity = node.get_prop("familiarity")
+                        if familiarity is None:
+                            familiarity = 0
+                        familiarity += k
+                        node.set_prop("familiarity", familiarity)
+                        node.update()
+                        logger.info(f"Quiz.shell() : updated [familiarity ({k})] {node}")
+                        if familiarity >= 100:
+                            if node.label == "unfamiliar_word":
+                                node.set_label("word")
+                                node.update()
+                            elif node.label == "mistake":
+                                node.destroy()
         print("> This quiz was completed!")
     
     def save(self, path: str | Path = Path("material") / "quiz") -> str:
@@ -402,11 +420,38 @@ class Quiz:
         with open(filepath, 'w') as f:
             quiz_dat_str = json.dumps(quiz_dat)
             f.write(quiz_dat_str)
+        self.prewarm()
         
         return filepath
+
+    def prewarm(self, formats: List[str] | None = None) -> Future | None:
+        """ Synthesizes the audio of every listening question on the background loop, in every format
+        played so far (ListeningQuestion.audio_formats) unless `formats` is given,
+        so that playing them later is served from the audio cache. Returns immediately.
+        """
+        formats = formats if formats is not None else sorted(ListeningQuestion.audio_formats)
+        clips = {
+            (q.solution, q.voice, response_format)
+            for q in self.problemset.get("ListeningQuestion", []) if q is not None
+            for response_format in formats
+        }
+        if len(clips) == 0:
+            return None
+        tts = registry.get(ListeningQuestion.tts)
+        async def _generate(semaphore: asyncio.Semaphore, text: str, voice: str, response_format: str):
+            async with semaphore:
+                try:
+                    await tts.async_generate(text=text, voice=voice, timeout=60, response_format=response_format)
+                except Exception as e:
+                    logger.error(f"Quiz.prewarm() : an error occurred while attempting to synthesize : [{voice}] {response_format} {text}", e)
+        async def _prewarm():
+            semaphore = asyncio.Semaphore(Quiz.prewarm_concurrency)
+            await asyncio.gather(*[_generate(semaphore, text, voice, response_format) for text, voice, response_format in clips])
+            logger.info(f"Quiz.prewarm() : {len(clips)} listening clips are ready")
+        return background_loop.submit(_prewarm())
     
     @staticmethod
-    def load(filepath: str | Path, retriever: Retriever) -> 'Quiz':
+    def load(filepath: str | Path, retriever: Retriever) -> 'Quiz | None':
         try:
             with open(filepath) as f:
                 quiz_dat: Dict = json.load(f)
@@ -417,13 +462,22 @@ class Quiz:
         if "description" in quiz_dat:
             quiz.description = quiz_dat.pop("description")
         knowledges = quiz_dat.pop("Knowledges", [])
+        # every node of the quiz, with the images related to the knowledges in any way, in one query
+        m_ids = list(knowledges)
+        for question_type in quiz_dat:
+            if isinstance(quiz_dat[question_type], list):
+                for q_dat in quiz_dat[question_type]:
+                    m_ids.extend(q_dat.get("rela_nodes", []))
+        try:
+            subgraph = retriever.match_subgraph(m_ids, expand=None, to_label="image")
+        except Exception as e:
+            logger.error(f"Quiz.load() : an error ocurred while attempting to load the nodes of quiz {filepath}", e)
+            return None
         for m_id in knowledges:
             try:
-                node = retriever.match_node(
-                    {"m_id": m_id}
-                )[0]
+                node, images = subgraph[m_id]
                 urls = []
-                for _, _, image_node in retriever.match(from_prop={"m_id": m_id}, to_prop={"label": "image"}, rela_prop={}, bidirect=True):
+                for _, image_node in images:
                     url = image_node.get_prop("content")
                     urls.append(url)
                 quiz.addn(node)
@@ -447,13 +501,12 @@ class Quiz:
                 rela_nodes = []
                 for m_id in q_dat["rela_nodes"]:
                     try:
-                        rela_node = retriever.match_node(
-                            {"m_id": m_id}
-                        )[0]
+                        rela_node, _ = subgraph[m_id]
                         rela_nodes.append(rela_node)
                     except Exception as e:
                         logger.error(f"Quiz.load() : an error occurred while attempting to load a question from quiz : {filepath}", e)
                 q = question_class(content, solution, rela_nodes, analysis, voice=voice)
                 quiz.addq(q)
             quiz.filepath = filepath
+        quiz.prewarm()
         return quiz
\ No newline at end of file
@@ -0,0 +1,358 @@
+import os
+import json, time, random
+import asyncio, threading
+import argparse, hashlib
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import (
+    List, Dict, Tuple, Iterator, Literal
+)
+from .general import (
+    LLMEngine, AMEngine, Prompt
+)
+from .cache import AudioCache
+from .logger import logger
+
+class Cassette:
+    """ Request/response pairs recorded from real providers, stored as one JSON file.
+    Audio clips live next to it in `<name>.audio/`.
+    """
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.audio_path = self.path.with_suffix(".audio")
+        self.__lock = threading.Lock()
+        self.__data = {"chat": {}, "speech": {}}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.__data.update(json.load(f))
+
+    @staticmethod
+    def speech_key(model: str, voice: str, text: str, response_format: str = "mp3") -> str:
+        return hashlib.sha256(f"{model} [{voice}] {response_format} : {text}".encode("utf-8")).hexdigest()
+
+    def get_chat(self, key: str) -> Dict | None:
+        return self.__data["chat"].get(key)
+
+    def put_chat(self, key: str, entry: Dict):
+        with self.__lock:
+            self.__data["chat"][key] = entry
+            self.__save()
+
+    def get_speech(self, key: str) -> bytes | None:
+        filename = self.__data["speech"].get(key)
+        if filename is None:
+            return None
+        with open(self.audio_path / filename, "rb") as f:
+            return f.read()
+
+    def put_speech(self, key: str, audio: bytes, response_format: str = "mp3"):
+        with self.__lock:
+            if not os.path.exists(self.audio_path):
+                os.makedirs(self.audio_path)
+            filename = f"{key}.{response_format}"
+            with open(self.audio_path / filename, "wb") as f:
+                f.write(audio)
+            self.__data["speech"][key] = filename
+            self.__save()
+
+    def __save(self):
+        if not os.path.exists(self.path.parent):
+            os.makedirs(self.path.parent)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.__data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+class ReplayMissError(KeyError):
+    pass
+
+
+def _synthetic_latency(latency: float | Tuple[float, float]) -> float:
+    if isinstance(latency, (tuple, list)):
+        return random.uniform(*latency)
+    return latency
+
+
+class ReplayEngine:
+    """ Drop-in replacement for an LLMEngine backed by a cassette.
+    mode "record" forwards every call to `engine` and stores the answer, "replay" only answers from
+    the cassette (after a synthetic `latency`), "auto" replays what it has and records the rest.
+    """
+    def __init__(self,
+                 model: str,
+                 cassette: Cassette,
+                 engine: LLMEngine | None = None,
+                 mode: Literal["record", "replay", "auto"] = "replay",
+                 latency: float | Tuple[float, float] = 0.0
+                 ):
+        if mode != "replay" and engine is None:
+            raise RuntimeError(f"ReplayEngine : mode '{mode}' needs a real engine to record from")
+        self.model = model
+        self.cassette = cassette
+        self.engine = engine
+        self.mode = mode
+        self.latency = latency
+
+    @staticmethod
+    def __params(kwargs: Dict) -> Dict:
+        return {k: v for k, v in kwargs.items() if k not in ["use_cache", "coalesce", "tool_timeouts"]}
+
+    def __lookup(self, key: str) -> Dict | None:
+        if self.mode == "record":
+            return None
+        entry = self.cassette.get_chat(key)
+        if entry is None and self.mode == "replay":
+            raise ReplayMissError(f"ReplayEngine [{self.model}] : no recorded answer for request {key}")
+        return entry
+
+    def generate(self, prompt: str | Prompt | None = None, sys_prompt: str | Prompt | None = None, few_shots: List[Dict] = [],
+                 *args, **kwargs) -> str:
+        messages = LLMEngine.pack_message(prompt, sys_prompt, few_shots)
+        params = ReplayEngine.__params(kwargs)
+        key = LLMEngine.request_key(self.model, messages, params)
+        entry = self.__lookup(key)
+        if entry is not None:
+            time.sleep(_synthetic_latency(self.latency))
+            return entry["response"]
+        response = self.engine.generate(prompt, sys_prompt, few_shots, *args, **kwargs)
+        self.cassette.put_chat(key, {"model": self.model, "messages": messages, "params": params, "response": response})
+        return response
+
+    async def async_generate(self, prompt: str | Prompt | None = None, sys_prompt: str | Prompt | None = None, few_shots: List[Dict] = [],
+                             *args, **kwargs) -> str:
+        messages = LLMEngine.pack_message(prompt, sys_prompt, few_shots)
+        params = ReplayEngine.__params(kwargs)
+        key = LLMEngine.request_key(self.model, messages, params)
+        entry = self.__lookup(key)
+        if entry is not None:
+            await asyncio.sleep(_synthetic_latency(self.latency))
+            return entry["response"]
+        response = await self.engine.async_generate(prompt, sys_prompt, few_shots, *args, **kwargs)
+        self.cassette.put_chat(key, {"model": self.model, "messages": messages, "params": params, "response": response})
+        return response
+
+    def chat(self, messages: List[Dict], sys_prompt: str | Prompt | None = "", toolset: Tuple[List, Dict] = ([], {}),
+             *args, stream: bool = False, **kwargs) -> str | Iterator[Dict]:
+        """ Tool calls are not executed again on replay, the recorded conversation is appended instead """
+        sys_prompt = sys_prompt.value if isinstance(sys_prompt, Prompt) else sys_prompt
+        params = ReplayEngine.__params(kwargs)
+        key = LLMEngine.request_key(self.model, [{"role": "system", "content": sys_prompt}] + messages, params)
+        entry = self.__lookup(key)
+        if entry is None:
+            n_messages = len(messages)
+            response = self.engine.chat(messages, sys_prompt, toolset, *args, **kwargs)
+            entry = {"model": self.model, "params": params, "response": response, "appended": messages[n_messages:]}
+            self.cassette.put_chat(key, entry)
+        else:
+            time.sleep(_synthetic_latency(self.latency))
+            messages.extend(entry["appended"])
+        if stream:
+            return iter(ReplayEngine.__events(entry))
+        return entry["response"]
+
+    @staticmethod
+    def __events(entry: Dict) -> List[Dict]:
+        """ The events LLMEngine.chat(stream=True) would have yielded for a recorded conversation """
+        events = []
+        for message in entry["appended"]:
+            if message["role"] == "assistant":
+                for tool_call in message.get("tool_calls", []):
+                    events.append({
+                        "type": "tool_call",
+                        "id": tool_call["id"],
+                        "name": tool_call["function"]["name"],
+                        "arguments": tool_call["function"]["arguments"]
+                    })
+            elif message["role"] == "tool":
+                events.append({"type": "tool_result", "id": message["tool_call_id"], "content": message["content"]})
+        events.append({"type": "delta", "content": entry["response"]})
+        events.append({"type": "done", "content": entry["response"]})
+        return events
+
+    def close(self):
+        if self.engine is not None:
+            self.engine.close()
+
+
+class ReplayAMEngine:
+    """ Drop-in replacement for an AMEngine backed by a cassette, see ReplayEngine """
+    def __init__(self,
+                 model: str,
+                 cassette: Cassette,
+                 engine: AMEngine | None = None,
+                 mode: Literal["record", "replay", "auto"] = "replay",
+                 latency: float | Tuple[float, float] = 0.0
+                 ):
+        if mode != "replay" and engine is None:
+            raise RuntimeError(f"ReplayAMEngine : mode '{mode}' needs a real engine to record from")
+        self.model = model
+        self.cassette = cassette
+        self.engine = engine
+        self.mode = mode
+        self.latency = latency
+
+    def __replay(self, text: str, voice: str, response_format: str) -> str | None:
+        key = Cassette.speech_key(self.model, voice, text, response_format)
+        audio = self.cassette.get_speech(key) if self.mode != "record" else None
+        if audio is None:
+            if self.mode == "replay":
+                raise ReplayMissError(f"ReplayAMEngine [{self.model}] : no recorded audio for voice {voice}: {text}")
+            return None
+        name = AudioCache.make_key(self.model, voice, text, response_format)
+        AMEngine.audio_cache.put_bytes(name, audio)
+        return name
+
+    def __record(self, text: str, voice: str, response_format: str, name: str):
+        with open(AMEngine.audio_cache.path(name), "rb") as f:
+            self.cassette.put_speech(Cassette.speech_key(self.model, voice, text, response_format), f.read(), response_format)
+
+    def generate(self, text: str, voice: str, response_format: str = "mp3") -> str:
+        name = self.__replay(text, voice, response_format)
+        if name is not None:
+            time.sleep(_synthetic_latency(self.latency))
+            return name
+        name = self.engine.generate(text, voice, response_format)
+        self.__record(text, voice, response_format, name)
+        return name
+
+    async def async_generate(self, text: str, voice: str, timeout: int = None, response_format: str = "mp3") -> str:
+        name = self.__replay(text, voice, response_format)
+        if name is not None:
+            await asyncio.sleep(_synthetic_latency(self.latency))
+            return name
+        name = await self.engine.async_generate(text, voice, timeout, response_format)
+        self.__record(text, voice, response_format, name)
+        return name
+
+    def stream(self, text: str, voice: str, chunk_size: int = 4096, response_format: str = "mp3") -> Tuple[str, Iterator[bytes] | None]:
+        # replayed clips are written to the audio cache in one go
+        return self.generate(text, voice, response_format), None
+
+    @staticmethod
+    def play(name: str):
+        AMEngine.play(name)
+
+
+class CassetteServer:
+    """ Local OpenAI-compatible stand-in that answers /v1/chat/completions and /v1/audio/speech from a cassette.
+    Point OPENAI_BASE_URL / DEEPSEEK_BASE_URL at http://host:port/v1 to run the whole app offline.
+    """
+    def __init__(self,
+                 cassette: Cassette,
+                 host: str = "127.0.0.1",
+                 port: int = 8765,
+                 latency: float | Tuple[float, float] = 0.0
+                 ):
+        self.cassette = cassette
+        self.latency = latency
+        self.httpd = ThreadingHTTPServer((host, port), self.__handler())
+        self.__thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def __handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(f"CassetteServer : {format % args}")
+
+            def __send(self, status: int, body: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def __error(self, status: int, message: str):
+                body = json.dumps({"error": {"message": message, "type": "replay_miss"}}).encode("utf-8")
+                self.__send(status, body, "application/json")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                time.sleep(_synthetic_latency(server.latency))
+                if self.path.endswith("/chat/completions"):
+                    self.__chat(request)
+                elif self.path.endswith("/audio/speech"):
+                    response_format = request.get("response_format", "mp3")
+                    key = Cassette.speech_key(request.get("model"), request.get("voice"), request.get("input"), response_format)
+                    audio = server.cassette.get_speech(key)
+                    if audio is None:
+                        return self.__error(404, f"no recorded audio for {key}")
+                    self.__send(200, audio, AudioCache.formats.get(response_format, "application/octet-stream"))
+                else:
+                    self.__error(404, f"unknown endpoint {self.path}")
+
+            def __chat(self, request: Dict):
+                model = request.pop("model", None)
+                messages = request.pop("messages", [])
+                # recorded chats only keep the final answer, tool rounds are not replayed
+                request.pop("tools", None)
+                stream = request.get("stream", False)
+                key = LLMEngine.request_key(model, messages, request)
+                entry = server.cassette.get_chat(key)
+                if entry is None:
+                    return self.__error(404, f"no recorded answer for request {key}")
+                completion_id = f"chatcmpl-replay-{key[:12]}"
+                created = int(time.time())
+                if not stream:
+                    body = {
+                        "id": completion_id,
+                        "object": "chat.completion",
+                        "created": created,
+                        "model": model,
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {"role": "assistant", "content": entry["response"]},
+                                "finish_reason": "stop"
+                            }
+                        ],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+                    }
+                    return self.__send(200, json.dumps(body).encode("utf-8"), "application/json")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                for delta, finish_reason in [({"role": "assistant", "content": entry["response"]}, None), ({}, "stop")]:
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+
+        return Handler
+
+    def start(self) -> 'CassetteServer':
+        self.__thread = threading.Thread(target=self.httpd.serve_forever, name="cassette-server", daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a recorded cassette as an OpenAI-compatible API")
+    parser.add_argument("cassette")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, nargs="+", default=[0.0], help="seconds, or a min and max")
+    args = parser.parse_args()
+    latency = tuple(args.latency) if len(args.latency) == 2 else args.latency[0]
+    server = CassetteServer(Cassette(args.cassette), args.host, args.port, latency)
+    print(f"Serving {args.cassette} at {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,261 @@
+import time, asyncio
+import threading
+from collections import deque
+from concurrent.futures import (
+    ThreadPoolExecutor, Future,
+    wait, FIRST_COMPLETED
+)
+from typing import (
+    List, Dict, Tuple, Callable, Iterator,
+    TYPE_CHECKING
+)
+from .logger import logger
+from .metrics import Telemetry
+if TYPE_CHECKING:
+    from .general import LLMEngine, Prompt
+
+class CircuitBreaker:
+    """ Opens after `threshold` consecutive failures or timeouts, lets one probe through after `cooldown` seconds """
+    def __init__(self, threshold: int = 3, cooldown: float = 30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.__lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        """ When half-open, the first caller claims the probe and the others are turned away
+        until it reports `success()` or `failure()` (or gives the slot back with `release()`)
+        """
+        with self.__lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "open" or self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def release(self):
+        """ Gives back a probe slot that `allow()` handed out but was not used """
+        with self.__lock:
+            self.probing = False
+
+    def success(self):
+        with self.__lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def failure(self):
+        with self.__lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+
+class RouterEngine:
+    """ Drop-in replacement for an LLMEngine that spreads one call over several engines.
+    The first healthy engine gets the request; if it hasn't answered after the `hedge_percentile`
+    of its recent latencies, the next one is asked too and the first valid answer wins.
+    Engines that keep failing or timing out are skipped until their circuit breaker closes again.
+    """
+    executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="router")
+
+    def __init__(self,
+                 engines: List['LLMEngine'],
+                 hedge_percentile: float = 0.9,
+                 hedge_after: float = 8.0,
+                 timeout: float = 120.0,
+                 failure_threshold: int = 3,
+                 cooldown: float = 30.0,
+                 window: int = 100,
+                 validator: Callable[[str], bool] | None = None
+                 ):
+        if len(engines) == 0:
+            raise RuntimeError("RouterEngine needs at least one engine")
+        self.engines = engines
+        self.hedge_percentile = hedge_percentile
+        self.hedge_after = hedge_after
+        self.timeout = timeout
+        self.validator = validator if validator is not None else (lambda response: isinstance(response, str) and len(response.strip()) > 0)
+        self.breakers = {id(engine): CircuitBreaker(failure_threshold, cooldown) for engine in engines}
+        self.latencies = {id(engine): deque(maxlen=window) for engine in engines}
+
+    @property
+    def model(self) -> str:
+        return "|".join(engine.model for engine in self.engines)
+
+    def hedge_delay(self, engine: 'LLMEngine') -> float:
+        samples = sorted(self.latencies[id(engine)])
+        if len(samples) < 10:
+            return self.hedge_after
+        idx = min(len(samples) - 1, int(len(samples) * self.hedge_percentile))
+        return samples[idx]
+
+    def candidates(self) -> List['LLMEngine']:
+        healthy = [engine for engine in self.engines if self.breakers[id(engine)].allow()]
+        # if every breaker is open, trying is still better than failing right away
+        return healthy if len(healthy) > 0 else list(self.engines)
+
+    def release(self, engines: List['LLMEngine']):
+        """ Releases the breakers of candidates that were not asked """
+        for engine in engines:
+            self.breakers[id(engine)].release()
+
+    def __succeeded(self, engine: 'LLMEngine', started: float):
+        self.latencies[id(engine)].append(time.monotonic() - started)
+        self.breakers[id(engine)].success()
+
+    def __failed(self, engine: 'LLMEngine', reason: str):
+        self.breakers[id(engine)].failure()
+        logger.warning(f"RouterEngine [{engine.model}] : {reason} (breaker: {self.breakers[id(engine)].state})")
+
+    def generate(self, prompt: 'str | Prompt | None' = None, sys_prompt: 'str | Prompt | None' = None, few_shots: List[Dict] = [],
+                 *args, **kwargs) -> str:
+        candidates = self.candidates()
+        deadline = time.monotonic() + self.timeout
+        running: Dict[Future, Tuple['LLMEngine', float]] = {}
+        tried = []
+        last_error = None
+
+        def launch():
+            engine = candidates[len(running) + len(tried)]
+            future = Telemetry.submit(RouterEngine.executor, engine.generate, prompt, sys_prompt, few_shots, *args, **kwargs)
+            running[future] = (engine, time.monotonic())
+
+        try:
+            launch()
+            while len(running) > 0:
+                remaining = deadline - time.monotonic()
+                can_hedge = len(running) + len(tried) < len(candidates)
+                primary = next(iter(running.values()))[0]
+                timeout = min(remaining, self.hedge_delay(primary)) if can_hedge else remaining
+                done, _ = wait(list(running), timeout=max(timeout, 0), return_when=FIRST_COMPLETED)
+                if len(done) == 0:
+                    if time.monotonic() >= deadline:
+                        break
+                    launch()
+                    continue
+                for future in done:
+                    engine, started = running.pop(future)
+                    tried.append(engine)
+                    try:
+                        response = future.result()
+                    except Exception as e:
+                        last_error = e
+                        self.__failed(engine, f"request failed: {e}")
+                        continue
+                    if self.validator(response):
+                        self.__succeeded(engine, started)
+                        for other in running:
+                            other.cancel()
+                        return response
+                    self.__failed(engine, "invalid response")
+                if len(running) == 0 and len(running) + len(tried) < len(candidates):
+                    launch()
+            for future, (engine, _) in running.items():
+                future.cancel()
+                self.__failed(engine, "timed out")
+            raise last_error if last_error is not None else TimeoutError(f"RouterEngine.generate() : no valid answer within {self.timeout}s")
+        finally:
+            # hedges that lost the race were cancelled without reporting back
+            self.release([engine for engine, _ in running.values()] + candidates[len(running) + len(tried):])
+
+    async def async_generate(self, prompt: 'str | Prompt | None' = None, sys_prompt: 'str | Prompt | None' = None, few_shots: List[Dict] = [],
+                             *args, **kwargs) -> str:
+        candidates = self.candidates()
+        deadline = time.monotonic() + self.timeout
+        running: Dict[asyncio.Task, Tuple['LLMEngine', float]] = {}
+        tried = []
+        last_error = None
+
+        def launch():
+            engine = candidates[len(running) + len(tried)]
+            task = asyncio.ensure_future(engine.async_generate(prompt, sys_prompt, few_shots, *args, **kwargs))
+            running[task] = (engine, time.monotonic())
+
+        try:
+            launch()
+            while len(running) > 0:
+                remaining = deadline - time.monotonic()
+                can_hedge = len(running) + len(tried) < len(candidates)
+                primary = next(iter(running.values()))[0]
+                timeout = min(remaining, self.hedge_delay(primary)) if can_hedge else remaining
+                done, _ = await asyncio.wait(list(running), timeout=max(timeout, 0), return_when=asyncio.FIRST_COMPLETED)
+                if len(done) == 0:
+                    if time.monotonic() >= deadline:
+                        break
+                    launch()
+                    continue
+                for task in done:
+                    engine, started = running.pop(task)
+                    tried.append(engine)
+                    try:
+                        response = task.result()
+                    except Exception as e:
+                        last_error = e
+                        self.__failed(engine, f"request failed: {e}")
+                        continue
+                    if self.validator(response):
+                        self.__succeeded(engine, started)
+                        for other in running:
+                            other.cancel()
+                        return response
+                    self.__failed(engine, "invalid response")
+                if len(running) == 0 and len(running) + len(tried) < len(candidates):
+                    launch()
+            for task, (engine, _) in running.items():
+                task.cancel()
+                self.__failed(engine, "timed out")
+            raise last_error if last_error is not None else TimeoutError(f"RouterEngine.async_generate() : no valid answer within {self.timeout}s")
+        finally:
+            # hedges that lost the race were cancelled without reporting back
+            self.release([engine for engine, _ in running.values()] + candidates[len(running) + len(tried):])
+
+    def chat(self, messages: List[Dict], sys_prompt: 'str | Prompt | None' = "", toolset: Tuple[List, Dict] = ([], {}),
+             *args, stream: bool = False, **kwargs) -> str | Iterator[Dict]:
+        # tools have side effects, so chat is never hedged: engines are only tried one after another
+        candidates = self.candidates()
+        if stream:
+            # the outcome of a stream is not reported to the breaker
+            self.release(candidates)
+            return candidates[0].chat(messages, sys_prompt, toolset, *args, stream=True, **kwargs)
+        last_error = None
+        for n, engine in enumerate(candidates):
+            local = list(messages)
+            started = time.monotonic()
+            try:
+                response = engine.chat(local, sys_prompt, toolset, *args, **kwargs)
+            except Exception as e:
+                last_error = e
+                self.__failed(engine, f"request failed: {e}")
+                continue
+            self.__succeeded(engine, started)
+            self.release(candidates[n + 1:])
+            messages.extend(local[len(messages):])
+            return response
+        raise last_error
+
+    def stats(self) -> Dict[str, Dict]:
+        return {
+            engine.model: {
+                "breaker": self.breakers[id(engine)].state,
+                "hedge_delay": self.hedge_delay(engine),
+                "samples": len(self.latencies[id(engine)])
+            } for engine in self.engines
+        }
+
+    def close(self):
+        for engine in self.engines:
+            engine.close()